@@ -1,27 +1,35 @@
 import argparse
 from argparse import RawTextHelpFormatter
 import base64
+import copy
 from copy import deepcopy
-import inspect
 import time
-from typing import Dict, Tuple, List, Any, Callable, Optional, Union
+import itertools
+from itertools import islice
+from typing import Dict, Tuple, List, Any, Callable, Iterable, Iterator, Optional, Union
 import re
 import pprint
 import logging
 import gc
 import os
-import socket
 
-import git
-import git.exc
-import joblib
-from joblib import Parallel, delayed
 from mkdir_p import mkdir_p
-from sklearn.model_selection import ParameterGrid
 
+from .environment import get_git_hash, get_hostname, get_repo, get_rss
+from .grid import iter_grid
+from .profiling import Profiler, no_profile
+from .parallel import WorkerSnapshot, batch_tasks, run_group, schedule_tasks
+from .pool import RecyclingPool
+from .cost_model import CostModel
+from .timeout import time_limit
+from .distributed import WorkQueue, run_worker
+from .cache import cache_key, freeze_arrays, get_memo_cache, get_memory_cache, \
+    load_or_compute
+from .cache import cache_filename as get_cache_filename
 from .base import default_fn_dict, default_val_dict, \
         ParameterAlreadyRanError, VariableValueNotSetError, \
-        VariableNotRegisteredError
+        VariableNotRegisteredError, CompiledVariable, Resolution, compile_variables, \
+        ExperimentTimeoutError
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -29,6 +37,14 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+# grid points handed to the before dispatch hooks at once when streaming
+_DISPATCH_CHUNK_SIZE = 10000
+
+# RSS after the last full collection of the 'threshold' gc_policy
+_gc_state = {'rss': 0}
+
 
 def add_all_commit(repo, commit_msg="update"):
     repo.git.commit('-m', commit_msg)
@@ -39,13 +55,39 @@ def add_all_commit(repo, commit_msg="update"):
 class AutoVar(object):
 
     def __init__(self, before_experiment_hooks=None, after_experiment_hooks=None,
-                 settings: Dict=None, logging_level: int=logging.WARNING) -> None:
+                 settings: Dict=None, logging_level: int=logging.WARNING,
+                 before_dispatch_hooks=None) -> None:
         """
         settings : {
             'server_url': 'http://127.0.0.1:8080/nn_attack/',
             'result_file_dir': './results/'
-            'file_format': 'json' or 'pickle'
+            'file_format': 'json', 'pickle' or 'sqlite' (one database,
+                settings['sqlite_path'] or result_file_dir/results.sqlite)
+                or the binary 'joblib', 'npz' and 'msgpack' formats (see
+                hooks.formats)
+            'result_compression': codec of the 'joblib' and 'npz' result
+                files ('zlib' by default, None for no compression)
+            'result_compression_level': level of that codec (3 by default,
+                ignored for 'npz' on Python 3.6)
+            'memory_cache_bytes': byte budget of the in-process LRU tier in
+                front of the cache_outputs files (0 disables it). Its hits
+                return the same object to every caller, so the numpy arrays
+                in a stored output are made read-only (copy them to change
+                them)
+            'profile': record per stage timings and the cache use of every
+                variable into ret['profile']
+            'memoize_bytes': byte budget of the outputs kept by the memoize
+                decorator (1GiB by default). Like the memory cache it hands
+                the same object to every caller, with its numpy arrays made
+                read-only
+            'gc_policy': full gc.collect() after each experiment, 'always'
+                (default), 'threshold' (once the RSS grew by
+                'gc_threshold_bytes' since the last one) or 'never'
         }
+        before_dispatch_hooks : functions called as hook(auto_var, params_list)
+            by run_grid_params before anything is dispatched, each returning
+            the grid points that should still run. They may add counts to
+            self.dispatch_stats, which is reset at every grid run.
         """
         logger.setLevel(logging_level)
 
@@ -55,6 +97,7 @@ class AutoVar(object):
         self.var_description: Dict[str, str] = {}
         self.var_class: Dict[str, Any] = {}
         self.var_value: Dict[str, Any] = {}
+        self._compiled: Dict[str, CompiledVariable] = {}
 
         self.inter_var: Dict[str, Any] = {}
         self.result_fields: List[str] = []
@@ -65,22 +108,46 @@ class AutoVar(object):
         if ('result_file_dir' in self.settings) and self.settings['result_file_dir']:
             mkdir_p(self.settings['result_file_dir'])
 
-        try:
-            self.repo = git.Repo(search_parent_directories=True)
-            self.var_value['git_hash'] = self.repo.head.object.hexsha
-        except git.exc.InvalidGitRepositoryError:
+        # probed once per process and working directory
+        self._repo = None
+        git_hash = get_git_hash(os.getcwd())
+        if git_hash is not None:
+            self.var_value['git_hash'] = git_hash
+        else:
             logger.warning("Git repository not found.")
-        
-        try:
-            self.var_value['hostname'] = socket.gethostname()
-        except:
+
+        hostname = get_hostname()
+        if hostname is not None:
+            self.var_value['hostname'] = hostname
+        else:
             logger.warning("Unable to get hostname.")
-                
+
         self.after_experiment_hooks = after_experiment_hooks
         self.before_experiment_hooks = before_experiment_hooks
+        self.before_dispatch_hooks = before_dispatch_hooks
 
         self._read_only: bool = False
         self._no_hooks: bool = False
+        self._profiler: Optional[Profiler] = None
+        self.profile_sink: Optional[Callable[[Dict, Dict], None]] = None
+        # running times of the results seen by this AutoVar, for schedule='lpt'
+        self.cost_model = CostModel()
+        # grid points that timed out in the last run_grid_params
+        self.timed_out_params: List[Dict[str, Any]] = []
+        # counts the before dispatch hooks recorded in the last grid run,
+        # e.g. skip_completed_params
+        self.dispatch_stats: Dict[str, int] = {}
+
+    @property
+    def repo(self):
+        """GitPython Repo of the working directory, opened on first use."""
+        if self._repo is None:
+            self._repo = get_repo(os.getcwd())
+        return self._repo
+
+    @repo.setter
+    def repo(self, repo) -> None:
+        self._repo = repo
 
     def set_logging_level(self, level: int):
         logger.setLevel(level)
@@ -96,6 +163,10 @@ class AutoVar(object):
         self.var_class[var_name] = variable_class
         #self.variables.setdefault(var_name, deepcopy(default_fn_dict))
         self.variables.update(variable_class.__class__.variables)
+        compiled = getattr(variable_class.__class__, 'compiled_variables', None)
+        if compiled is None:
+            compiled = compile_variables(variable_class.__class__.variables)
+        self._compiled.update(compiled)
         self.var_shown_name.update(
                 variable_class.__class__.variable_shown_name)
 
@@ -158,14 +229,8 @@ class AutoVar(object):
 
         if self.variables[var_name]["type"] == "val":
             return True
-        else:
-            if argument in self.variables[var_name]["argument_fn"]:
-                return True
-            else:
-                for arg_template in self.variables[var_name]["argument_fn"]:
-                    m = re.fullmatch(arg_template, argument)
-                    if m is not None:
-                        return True
+        elif self._compiled[var_name].resolve(argument) is not None:
+            return True
         return None
 
     def get_variable_value(self, var_name: str):
@@ -182,63 +247,98 @@ class AutoVar(object):
     def get_var_with_argument(self, var_name: str, argument: str, *args, **kwargs):
         if self.variables[var_name]["type"] == "val":
             return argument
+        if self._profiler is None:
+            return self._get_choice_var(var_name, argument, None, args, kwargs)
+        with self._profiler.variable(var_name, argument) as record:
+            return self._get_choice_var(var_name, argument, record, args, kwargs)
+
+    def _get_choice_var(self, var_name: str, argument: str,
+                        record: Optional[Dict[str, Any]], args, kwargs):
+        resolved = self._compiled[var_name].resolve(argument)
+        if resolved is None:
+            raise ValueError('Argument "%s" not matched in Variable '
+                             '"%s".' % (argument, var_name))
+        if resolved.memoize_scope is not None:
+            memo_key = self._memo_key(var_name, argument, resolved.memoize_scope,
+                                      args, kwargs)
+            memo_cache = get_memo_cache()
+            if 'memoize_bytes' in self.settings:
+                memo_cache.set_max_bytes(self.settings['memoize_bytes'])
+            func_outputs = memo_cache.get(memo_key, _MISSING)
+            if func_outputs is not _MISSING:
+                logger.info(f"using memoized {var_name} {argument} ...")
+                if record is not None:
+                    record['source'] = 'memory'
+                return func_outputs
+        func = resolved.func
+        cache_dir = resolved.cache_dir
+        required_vars = resolved.required_vars
+        kwargs.update(resolved.groupdict)
+
+        kwargs['auto_var'] = self
+        if resolved.pass_var_value:
+            kwargs['var_value'] = self.var_value
+        if resolved.pass_inter_var:
+            kwargs['inter_var'] = self.inter_var
+
+        if cache_dir is not None:
+            #var_used = {var_name: self.var_value[var_name]}
+            var_used = {var_name: argument}
+            if required_vars is not None:
+                for var in required_vars:
+                    if var not in self.var_value:
+                        raise ValueError('Variable "%s" required by Variable '
+                                         '"%s" is not set.' % (var, argument))
+
+                    var_used[var] = self.var_value[var]
+            cache_filename = get_cache_filename(cache_dir, var_used)
+
+            meta = {'var_name': var_name, 'argument': argument, 'var_used': var_used}
+            func_outputs = self._load_or_compute(
+                    cache_filename, resolved, record, meta, func, *args, **kwargs)
         else:
-            cache_dir = None
-            if argument in self.variables[var_name]["argument_fn"]:
-                func = self.variables[var_name]["argument_fn"][argument]
-                cache_dir = self.variables[var_name]['cache_dirs'][argument]
-                required_vars = self.variables[var_name]['required_vars'][argument]
-            else:
-                m = None
-                for arg_template, func in self.variables[var_name]["argument_fn"].items():
-                    m = re.fullmatch(arg_template, argument)
-                    if m is not None:
-                        kwargs.update(m.groupdict())
-                        cache_dir = self.variables[var_name]['cache_dirs'][arg_template]
-                        required_vars = self.variables[var_name]['required_vars'][arg_template]
-                        break
-                if m is None:
-                    raise ValueError('Argument "%s" not matched in Variable '
-                                     '"%s".' % (argument, var_name))
-
-            kwargs['auto_var'] = self
-            named_args = inspect.getfullargspec(func)[0]
-            if 'var_value' in named_args:
-                kwargs['var_value'] = self.var_value
-            if 'inter_var' in named_args:
-                kwargs['inter_var'] = self.inter_var
-
-            if cache_dir is not None:
-                mkdir_p(cache_dir)
-                #var_used = {var_name: self.var_value[var_name]}
-                var_used = {var_name: argument}
-                if required_vars is not None:
-                    for var in required_vars:
-                        if var not in self.var_value:
-                            raise ValueError('Variable "%s" required by Variable '
-                                             '"%s" is not set.' % (var, argument))
-
-                        var_used[var] = self.var_value[var]
-                required_variables = [str(v) for k, v in sorted(var_used.items())]
-                cache_filename = os.path.join(cache_dir, '-'.join(required_variables) + '.pkl')
-
-                if os.path.exists(cache_filename):
-                    try:
-                        func_outputs = joblib.load(cache_filename)
-                        logger.info(f"using result from cache file {cache_filename} ...")
-                    except:
-                        os.unlink(cache_filename)
-                        func_outputs = func(*args, **kwargs)
-                        logger.info(f"dumping cache file to {cache_filename} ...")
-                        joblib.dump(func_outputs, cache_filename)
-                else:
-                    func_outputs = func(*args, **kwargs)
-                    logger.info(f"dumping cache file to {cache_filename} ...")
-                    joblib.dump(func_outputs, cache_filename)
-            else:
-                func_outputs = func(*args, **kwargs)
-
-            return func_outputs
+            func_outputs = func(*args, **kwargs)
+
+        if resolved.memoize_scope is not None:
+            if memo_cache.put(memo_key, func_outputs):
+                # every later caller in the scope gets this same object
+                freeze_arrays(func_outputs)
+        return func_outputs
+
+    def _memo_key(self, var_name: str, argument: str, scope: List[str], args, kwargs) -> str:
+        scope_value = {}
+        for var in scope:
+            if var not in self.var_value:
+                raise ValueError('Variable "%s" in the memoize scope of Variable '
+                                 '"%s" is not set.' % (var, argument))
+            scope_value[var] = self.var_value[var]
+        return cache_key({'var_name': var_name, 'argument': argument,
+                          'scope': scope_value, 'args': args, 'kwargs': kwargs})
+
+    def _load_or_compute(self, cache_filename: str, resolved: Resolution,
+                         record: Optional[Dict[str, Any]], meta: Dict[str, Any],
+                         func, *args, **kwargs):
+        memory_cache = get_memory_cache()
+        if 'memory_cache_bytes' in self.settings:
+            memory_cache.set_max_bytes(self.settings['memory_cache_bytes'])
+        if memory_cache.max_bytes > 0:
+            func_outputs = memory_cache.get(cache_filename, _MISSING)
+            if func_outputs is not _MISSING:
+                logger.info(f"using result from memory cache {cache_filename} ...")
+                if record is not None:
+                    record['source'] = 'memory'
+                return func_outputs
+
+        func_outputs = load_or_compute(cache_filename, func, args, kwargs,
+                                       mmap_mode=resolved.mmap_mode, stats=record,
+                                       meta=meta, compress=resolved.cache_compress,
+                                       max_bytes=resolved.cache_max_bytes)
+
+        if memory_cache.max_bytes > 0:
+            if memory_cache.put(cache_filename, func_outputs):
+                # every later caller gets this same object
+                freeze_arrays(func_outputs)
+        return func_outputs
 
     def get_intermidiate_variable(self, var_name: str):
         return self.inter_var[var_name]
@@ -274,33 +374,81 @@ class AutoVar(object):
                     raise
         return True
 
+    def _run_before_dispatch_hooks(self, params_list: List[Dict[str, Any]]):
+        if not self._no_hooks and self.before_dispatch_hooks is not None:
+            for hook_fn in self.before_dispatch_hooks:
+                params_list = hook_fn(self, params_list)
+        return params_list
+
     def _run_after_hooks(self, ret):
         if not self._no_hooks and self.after_experiment_hooks is not None:
             for hook_fn in self.after_experiment_hooks:
                 hook_fn(self, ret)
 
+    def _collect_garbage(self) -> None:
+        policy = self.settings.get('gc_policy', 'always')
+        if policy == 'always':
+            gc.collect()
+        elif policy == 'threshold':
+            # full collection only once the process grew by gc_threshold_bytes
+            rss = get_rss()
+            threshold = self.settings.get('gc_threshold_bytes', 512 * 1024 ** 2)
+            if rss is None or rss - _gc_state['rss'] > threshold:
+                gc.collect()
+                _gc_state['rss'] = get_rss() or 0
+        elif policy != 'never':
+            raise ValueError(f"Not supported gc_policy {policy}")
+
+    def _stage(self, name: str):
+        if self._profiler is None:
+            return no_profile()
+        return self._profiler.stage(name)
+
+    def set_profile_sink(self, sink: Optional[Callable[[Dict, Dict], None]]) -> None:
+        """sink(profile, var_value) is called with the profile of every
+        experiment run with settings['profile'] set. For run_grid_params it
+        is called in the calling process as the results come back."""
+        self.profile_sink = sink
+
     def run_single_experiment(self, experiment_fn: Union[Callable[..., Any], str],
                               with_hook: bool=True,
-                              verbose: int=0) -> Optional[bool]:
+                              verbose: int=0,
+                              timeout: Optional[float]=None,
+                              cpu_timeout: Optional[float]=None) -> Optional[Dict[str, Any]]:
+        """
+        timeout, cpu_timeout : wall-clock and CPU seconds the experiment may
+            run. Past them it is interrupted with ExperimentTimeoutError,
+            after the after hooks ran with None (only enforced in the main
+            thread, see time_limit).
+        """
         self._read_only = True
         if isinstance(experiment_fn, str):
             if experiment_fn not in self.experiments:
                 raise ValueError(f"experiment_fn {experiment_fn} is not a registered experiment")
+            if self.experiments[experiment_fn]['batch_vars'] is not None:
+                self._read_only = False
+                return self.run_batched_experiment(
+                    experiment_fn, [{}], with_hook=with_hook, verbose=verbose,
+                    timeout=timeout, cpu_timeout=cpu_timeout)[0]
             original_settings = deepcopy(self.settings)
             self.settings.update(self.experiments[experiment_fn]['settings'])
+        if self.settings.get('profile', False):
+            self._profiler = Profiler()
 
         ret = None
         ret_hook = True
         if with_hook:
-            ret_hook = self._run_before_hooks()
+            with self._stage('before_hooks'):
+                ret_hook = self._run_before_hooks()
 
         try:
             if ret_hook:
                 start_time = time.time()
-                if isinstance(experiment_fn, str):
-                    ret = self.experiments[experiment_fn]['fn'](self)
-                else:
-                    ret = experiment_fn(self)
+                with time_limit(timeout, cpu_timeout):
+                    if isinstance(experiment_fn, str):
+                        ret = self.experiments[experiment_fn]['fn'](self)
+                    else:
+                        ret = experiment_fn(self)
                 end_time = time.time()
                 logger.info("Running time: %f", end_time - start_time)
                 if isinstance(ret, dict):
@@ -309,17 +457,108 @@ class AutoVar(object):
                     # return value is not dict
                     pass
                 ret['var_value'] = deepcopy(self.var_value)
+                if self._profiler is not None:
+                    self._profiler.add_time(
+                        'experiment_body', end_time - start_time
+                        - self._profiler.stages.get('get_var', 0.))
+                    # after_hooks and gc are added to the same dict later,
+                    # so they are not part of what the hooks save
+                    ret['profile'] = self._profiler.as_dict()
         finally:
             if with_hook and ret_hook:
-                self._run_after_hooks(ret)
+                with self._stage('after_hooks'):
+                    self._run_after_hooks(ret)
             self.inter_var.clear()
             self._read_only = False
-            gc.collect()
+            with self._stage('gc'):
+                self._collect_garbage()
+            if self._profiler is not None:
+                if isinstance(ret, dict) and self.profile_sink is not None:
+                    self.profile_sink(ret['profile'], ret['var_value'])
+                self._profiler = None
 
         if isinstance(experiment_fn, str):
             self.settings = original_settings
         return ret
 
+    def run_batched_experiment(self, experiment_name: str,
+                               params_list: List[Dict[str, Any]],
+                               with_hook: bool=True,
+                               verbose: int=0,
+                               timeout: Optional[float]=None,
+                               cpu_timeout: Optional[float]=None) -> List[Optional[Dict[str, Any]]]:
+        """Runs the batched experiment ``experiment_name`` once for all the
+        points of ``params_list``, which may only differ in its batch_vars.
+
+        The before hooks run for every point with var_value set to it, the
+        points they skip are left out of the batch. The after hooks run for
+        every point with its own result, and with None for all of them if
+        the experiment raised. Returns one result per point. Batched
+        experiments are not profiled, and timeout and cpu_timeout apply to
+        the whole batch.
+        """
+        experiment = self.experiments[experiment_name]
+        batch_vars = experiment['batch_vars']
+        original_settings = deepcopy(self.settings)
+        self.settings.update(experiment['settings'])
+        base_var_value = self.var_value
+        # the state of the AutoVar for each point after its before hooks
+        # (e.g. the parameter_id of submit_parameter), None if skipped
+        states: List[Optional[Dict[str, Any]]] = []
+        rets: List[Any] = [None] * len(params_list)
+        try:
+            shared = None
+            for params in params_list:
+                self.var_value = dict(base_var_value)
+                self.set_variable_value_by_dict(params)
+                point_shared = {k: v for k, v in self.var_value.items() if k not in batch_vars}
+                if shared is None:
+                    shared = point_shared
+                elif point_shared != shared:
+                    raise ValueError(f"{params} differs from the batch in more "
+                                     f"than {batch_vars}")
+                self._read_only = True
+                ret_hook = self._run_before_hooks() if with_hook else True
+                self._read_only = False
+                states.append(dict(self.__dict__) if ret_hook else None)
+
+            # the states of the points the before hooks kept, by index
+            running = {i: state for i, state in enumerate(states) if state is not None}
+            if running:
+                assert shared is not None
+                self.__dict__.update(next(iter(running.values())))
+                self.var_value = shared
+                self._read_only = True
+                start_time = time.time()
+                with time_limit(timeout, cpu_timeout):
+                    results = experiment['fn'](
+                        self, [dict(state['var_value']) for state in running.values()])
+                end_time = time.time()
+                logger.info("Running time: %f for %d points",
+                            end_time - start_time, len(running))
+                if len(results) != len(running):
+                    raise ValueError(f"{experiment_name} returned {len(results)} "
+                                     f"results for {len(running)} points")
+                for i, ret in zip(running, results):
+                    if isinstance(ret, dict):
+                        ret['running_time'] = (end_time - start_time) / len(running)
+                        ret['batch_size'] = len(running)
+                        ret['var_value'] = deepcopy(running[i]['var_value'])
+                    rets[i] = ret
+        finally:
+            if with_hook:
+                for i, state in enumerate(states):
+                    if state is not None:
+                        self.__dict__.update(state)
+                        self._read_only = True
+                        self._run_after_hooks(rets[i])
+            self.var_value = base_var_value
+            self.inter_var.clear()
+            self._read_only = False
+            self._collect_garbage()
+            self.settings = original_settings
+        return rets
+
     def _check_var_argument(self, var_name: str, argument):
         if self.variables[var_name]["type"] != "val" \
             and not self.match_variable(var_name, argument):
@@ -337,6 +576,275 @@ class AutoVar(object):
                 self._check_var_argument(k, i)
         return True
 
+    def _iter_grid_params(self,
+                          grid_params: Union[Dict[str, List], List[Dict[str, List]]],
+                          max_params: int=-1,
+                          constraint: Optional[Callable[[Dict[str, Any]], bool]]=None
+                          ) -> Iterator[Dict[str, Any]]:
+        """Lazily expands the grids, without the points rejected by
+        ``constraint`` and the ones an earlier grid already yielded."""
+        if not isinstance(grid_params, list):
+            grid_params = [grid_params]
+        for grid_param in grid_params:
+            self._check_grid_params(grid_param)
+        ret_params = iter_grid(grid_params, constraint=constraint, dedupe=True)
+        if max_params != -1:
+            ret_params = islice(ret_params, max_params)
+        return ret_params
+
+    def _expand_grid_params(self,
+                            grid_params: Union[Dict[str, List], List[Dict[str, List]]],
+                            max_params: int=-1,
+                            constraint: Optional[Callable[[Dict[str, Any]], bool]]=None
+                            ) -> List[Dict[str, Any]]:
+        return list(self._iter_grid_params(grid_params, max_params, constraint))
+
+    def _iter_before_dispatch_hooks(self, params_iter: Iterable[Dict[str, Any]]
+                                    ) -> Iterator[List[Dict[str, Any]]]:
+        """The points of ``params_iter`` the before dispatch hooks keep,
+        in chunks that each went through the hooks."""
+        params_iter = iter(params_iter)
+        while True:
+            chunk = list(islice(params_iter, _DISPATCH_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield self._run_before_dispatch_hooks(chunk)
+
+    def _iter_results(self,
+                      experiment_fn: Union[Callable[..., Any], str],
+                      params_list: Iterable[Dict[str, Any]],
+                      with_hook: bool=True,
+                      verbose: int=0,
+                      allow_failure: bool=True,
+                      n_jobs: int=-1,
+                      backend: Optional[str]=None,
+                      pre_dispatch: str='2 * n_jobs',
+                      schedule: str='grid',
+                      ordered: bool=True,
+                      max_tasks_per_worker: Optional[int]=None,
+                      max_worker_memory: Optional[int]=None,
+                      max_retries: int=1,
+                      timeout: Optional[float]=None,
+                      cpu_timeout: Optional[float]=None,
+                      dispatch_hooks: bool=False
+                      ) -> Iterator[Tuple[int, Dict[str, Any], Any]]:
+        """Yields (index in the dispatched points, params, result) as the
+        tasks finish.
+
+        With the 'grid' schedule ``params_list`` may be a lazy iterable,
+        points are pulled from it as the workers need them. With
+        ``dispatch_hooks`` the points first go through the before dispatch
+        hooks, chunk by chunk for a lazy iterable, and the workers see what
+        the hooks of their chunk set on this AutoVar (e.g. parameter_ids).
+        """
+        experiment = None
+        if isinstance(experiment_fn, str):
+            experiment = self.experiments.get(experiment_fn)
+        batched = experiment is not None and experiment['batch_vars'] is not None
+        dispatch_hooks = dispatch_hooks and not self._no_hooks \
+            and self.before_dispatch_hooks is not None
+
+        def make_snapshot() -> WorkerSnapshot:
+            return WorkerSnapshot(
+                self,
+                experiment_fn=experiment_fn,
+                with_hook=(with_hook and (not self._no_hooks)),
+                verbose=verbose,
+                allow_failure=allow_failure,
+                batched=batched,
+                timeout=timeout,
+                cpu_timeout=cpu_timeout,
+            )
+
+        # the params of the points dispatched but not yielded yet
+        inflight: Dict[int, Dict[str, Any]] = {}
+        groups: Iterable[Tuple[WorkerSnapshot, List]]
+        if schedule == 'grid' and not batched:
+            def lazy_groups():
+                if dispatch_hooks:
+                    chunks = self._iter_before_dispatch_hooks(params_list)
+                else:
+                    chunks = [params_list]
+                i = 0
+                for chunk in chunks:
+                    # taken after the hooks of the chunk ran
+                    snapshot = make_snapshot()
+                    for params in chunk:
+                        inflight[i] = params
+                        yield snapshot, [(i, params)]
+                        i += 1
+            groups = lazy_groups()
+        else:
+            points = list(params_list)
+            if dispatch_hooks:
+                points = self._run_before_dispatch_hooks(points)
+            inflight.update(enumerate(points))
+            snapshot = make_snapshot()
+            if batched and experiment is not None:
+                tasks = batch_tasks(points, experiment['batch_vars'],
+                                    experiment['max_batch_size'])
+            else:
+                tasks = schedule_tasks(self, points, schedule, n_jobs=n_jobs)
+            groups = [(snapshot, [(i, points[i]) for i in task]) for task in tasks]
+        self.timed_out_params = []
+        recycle = max_tasks_per_worker is not None or max_worker_memory is not None
+        if timeout is not None and backend is None and not recycle:
+            # workers stuck past their timeout can only be killed in the pool
+            logger.warning("running the grid on a RecyclingPool of forked workers "
+                           "to enforce the timeout, pass a backend to use joblib")
+            recycle = True
+        if (timeout is not None or cpu_timeout is not None) and backend == 'threading':
+            logger.warning("timeout and cpu_timeout are only enforced in the main "
+                           "thread, the experiments of the threading backend run "
+                           "without a time limit")
+        if not recycle:
+            outputs = self._run_with_joblib(
+                groups, verbose=verbose, n_jobs=n_jobs,
+                backend=backend, pre_dispatch=pre_dispatch, ordered=ordered)
+        else:
+            if backend is not None:
+                logger.warning("backend %s is ignored when recycling workers", backend)
+            outputs = self._run_with_recycling_pool(
+                groups, allow_failure=allow_failure, n_jobs=n_jobs,
+                ordered=ordered, max_tasks_per_worker=max_tasks_per_worker,
+                max_worker_memory=max_worker_memory, max_retries=max_retries,
+                timeout=timeout, with_hook=with_hook)
+        for output in outputs:
+            for i, result in output:
+                params = inflight.pop(i)
+                if isinstance(result, ExperimentTimeoutError):
+                    self.timed_out_params.append(params)
+                    result = None
+                if self.profile_sink is not None \
+                        and isinstance(result, dict) and 'profile' in result:
+                    self.profile_sink(result['profile'],
+                                      result.get('var_value', params))
+                self.cost_model.add_result(result)
+                yield i, params, result
+
+    def _run_with_joblib(self, groups: Iterable[Tuple[WorkerSnapshot, List]],
+                         verbose: int, n_jobs: int, backend: Optional[str],
+                         pre_dispatch: str, ordered: bool):
+        import joblib
+        from joblib import Parallel, delayed
+        candidates = ['generator', None] if ordered else ['generator_unordered', 'generator', None]
+        for return_as in candidates:
+            kwargs = {} if return_as is None else {'return_as': return_as}
+            try:
+                parallel = Parallel(n_jobs=n_jobs, verbose=verbose, backend=backend,
+                                    pre_dispatch=pre_dispatch, **kwargs)
+                break
+            except (TypeError, ValueError):
+                # joblib < 1.4 or a backend that can not stream
+                continue
+        if return_as is None:
+            logger.warning("joblib %s or backend %s can not stream results, they "
+                           "are yielded once every task finished", joblib.__version__, backend)
+        with parallel:
+            yield from parallel(delayed(run_group)(snapshot, group)
+                                for snapshot, group in groups)
+
+    def _run_with_recycling_pool(self, groups: Iterable[Tuple[WorkerSnapshot, List]],
+                                 allow_failure: bool, n_jobs: int, ordered: bool,
+                                 max_tasks_per_worker: Optional[int],
+                                 max_worker_memory: Optional[int],
+                                 max_retries: int,
+                                 timeout: Optional[float]=None,
+                                 with_hook: bool=True):
+        pool = RecyclingPool(n_workers=n_jobs,
+                             max_tasks_per_worker=max_tasks_per_worker,
+                             max_worker_memory=max_worker_memory,
+                             max_retries=max_retries)
+        # the groups handed to the pool and not yielded yet, groups is
+        # only pulled as workers become free
+        dispatched: Dict[int, List] = {}
+
+        def tasks():
+            for g, (snapshot, group) in enumerate(groups):
+                dispatched[g] = group
+                yield (snapshot, group)
+
+        def group_timeout(group) -> Optional[float]:
+            if timeout is None:
+                return None
+            # the worker interrupts the experiment itself at timeout, it is
+            # only killed if it did not come back after a grace period
+            return (timeout + max(1., 0.1 * timeout)) * len(group)
+
+        timeouts = None
+        if timeout is not None:
+            # the pool pulls the timeout right after the task of the same index
+            timeouts = (group_timeout(dispatched[g]) for g in itertools.count())
+        def clean_up(g: int) -> None:
+            # the retry must not find the placeholders of the dead attempt
+            self._clean_up_killed([p for _, p in dispatched[g]])
+        on_requeue = clean_up if with_hook and not self._no_hooks else None
+        finished: Dict[int, List] = {}
+        next_group = 0
+        for g, status, value in pool.imap_unordered(run_group, tasks(), timeouts=timeouts,
+                                                    on_requeue=on_requeue):
+            group = dispatched.pop(g)
+            if status == 'error':
+                raise value
+            elif status in ['died', 'timeout']:
+                params = [p for _, p in group]
+                if status == 'died' and not allow_failure:
+                    raise RuntimeError("Worker died while running " + str(params))
+                logger.error("Worker %s while running %s", 'died' if status == 'died'
+                             else 'was killed after timing out', params)
+                if with_hook and not self._no_hooks:
+                    self._clean_up_killed(params)
+                if status == 'died':
+                    value = [(i, None) for i, _ in group]
+                else:
+                    value = [(i, ExperimentTimeoutError(
+                        f"killed after {group_timeout(group)}s")) for i, _ in group]
+            if not ordered:
+                yield value
+                continue
+            finished[g] = value
+            while next_group in finished:
+                yield finished.pop(next_group)
+                next_group += 1
+
+    def _clean_up_killed(self, params_list: List[Dict[str, Any]]) -> None:
+        """Runs the after hooks with None for the grid points of a killed
+        worker, e.g. so remove_placeholder_if_error removes their
+        placeholders.
+
+        Some points of a group may have finished and saved their result, so
+        for a group the hooks only run for the points whose result is still
+        a placeholder (named by default_get_file_name).
+        """
+        if len(params_list) > 1:
+            params_list = self._placeholder_params(params_list)
+        for params in params_list:
+            probe = copy.copy(self)
+            probe.var_value = dict(self.var_value)
+            probe.var_value.update(params)
+            probe.inter_var = {}
+            probe._read_only = True
+            try:
+                probe._run_after_hooks(None)
+            except Exception:
+                logger.exception("after hooks of %s failed", params)
+
+    def _placeholder_params(self, params_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        from .hooks import default_get_file_name, scan_result_dir
+        probe = copy.copy(self)
+        names = []
+        for params in params_list:
+            probe.var_value = dict(self.var_value)
+            probe.var_value.update(params)
+            names.append(default_get_file_name(probe))
+        try:
+            placeholders = scan_result_dir(self, names=set(names)).placeholders
+        except (KeyError, ValueError):
+            logger.error("not running the after hooks of %s, no result_file_dir "
+                         "to find their placeholders in", params_list)
+            return []
+        return [params for params, name in zip(params_list, names) if name in placeholders]
+
     def run_grid_params(self,
                         experiment_fn: Union[Callable[..., Any], str],
                         grid_params: Union[Dict[str, List], List[Dict[str, List]]],
@@ -347,53 +855,183 @@ class AutoVar(object):
                         allow_failure: bool=True,
                         n_jobs: int=-1,
                         backend: Optional[str]=None,
-                        pre_dispatch: str='2 * n_jobs') -> Tuple[List, List]:
+                        pre_dispatch: str='2 * n_jobs',
+                        schedule: str='grid',
+                        max_tasks_per_worker: Optional[int]=None,
+                        max_worker_memory: Optional[int]=None,
+                        max_retries: int=1,
+                        timeout: Optional[float]=None,
+                        cpu_timeout: Optional[float]=None,
+                        constraint: Optional[Callable[[Dict[str, Any]], bool]]=None
+                        ) -> Tuple[List, List]:
+        """
+        schedule : 'grid' dispatches one grid point per task in grid order.
+            'locality' groups the points that need the same cache_outputs
+            variables (the variable and its required_vars) and runs each
+            group in sequence on one worker. 'lpt' dispatches the points
+            with the longest predicted running time first, learned from the
+            results of earlier runs in self.cost_model (e.g.
+            CostModel.from_result_dir), and uses grid order without history.
+        max_tasks_per_worker, max_worker_memory : if either is set, the
+            grid runs on a RecyclingPool instead of joblib. A worker process
+            is replaced after that many tasks, or once its RSS is above that
+            many bytes. A task whose worker died is run again up to
+            max_retries times before it gets a None result.
+        timeout, cpu_timeout : wall-clock and CPU seconds each experiment may
+            run (see run_single_experiment). Timed out points get a None
+            result and are listed in self.timed_out_params. With a timeout
+            (and no backend) the grid runs on a RecyclingPool, which kills
+            a worker that did not come back from the timeout, runs the after
+            hooks for its points in this process and starts a fresh worker.
+            The limits are not enforced with the 'threading' backend.
+
+        Grid points removed by the before dispatch hooks (e.g. because
+        their results already exist) are not dispatched and get None as
+        result.
+        """
 
         if commit_before_run:
             if self.repo is None:
                 raise ValueError("Not currently in git repo.")
             add_all_commit(self.repo)
 
-        if isinstance(grid_params, list):
-            ret_params: List = []
-            for grid_param in grid_params:
-                self._check_grid_params(grid_param)
-
-                grid = ParameterGrid(grid_param)
-                ret_params += list(grid)
-        else:
-            ret_params = list(ParameterGrid(grid_params))
-
-        if max_params != -1:
-            ret_params = ret_params[:max_params]
-
-        parallel = Parallel(n_jobs=n_jobs, verbose=verbose,
-                            backend=backend, pre_dispatch=pre_dispatch)
-
-        def _helper(auto_var, params):
-            auto_var.set_variable_value_by_dict(params)
-            if verbose:
-                logger.info("Running parameter:" + str(params))
-            try:
-                results = auto_var.run_single_experiment(
-                    experiment_fn,
-                    with_hook=(with_hook and (not self._no_hooks)),
-                    verbose=verbose
-                )
-            except Exception as e:
-                if allow_failure:
-                    logger.error("Error with " + str(params))
-                else:
-                    raise e
-                results = None
+        ret_params = self._expand_grid_params(grid_params, max_params, constraint)
+        # points dropped by the before dispatch hooks keep a None result
+        index = {id(params): i for i, params in enumerate(ret_params)}
+        # by cache_key, built only if a hook returned copies of the points
+        key_index: Optional[Dict[str, int]] = None
+        pending = ret_params
+        self.dispatch_stats = {}
+        if with_hook:
+            pending = self._run_before_dispatch_hooks(ret_params)
+
+        ret_results: List = [None] * len(ret_params)
+        for _, params, result in self._iter_results(
+                experiment_fn, pending, with_hook=with_hook, verbose=verbose,
+                allow_failure=allow_failure, n_jobs=n_jobs, backend=backend,
+                pre_dispatch=pre_dispatch, schedule=schedule, ordered=False,
+                max_tasks_per_worker=max_tasks_per_worker,
+                max_worker_memory=max_worker_memory, max_retries=max_retries,
+                timeout=timeout, cpu_timeout=cpu_timeout):
+            j = index.get(id(params))
+            if j is None:
+                if key_index is None:
+                    key_index = {cache_key(p): i for i, p in enumerate(ret_params)}
+                j = key_index[cache_key(params)]
+            ret_results[j] = result
 
-            return results
+        return ret_params, ret_results
 
-        with parallel:
-            ret_results = parallel(delayed(_helper)(deepcopy(self), params)
-                                   for params in ret_params)
+    def submit_grid_params(self,
+                           queue_dir: str,
+                           grid_params: Union[Dict[str, List], List[Dict[str, List]]],
+                           with_hook: bool=True,
+                           max_params: int=-1,
+                           constraint: Optional[Callable[[Dict[str, Any]], bool]]=None
+                           ) -> WorkQueue:
+        """Writes the grid points into the work queue in ``queue_dir``
+        (a directory shared by the nodes), for workers started with
+        run_queue_worker. Points already in the queue or dropped by the
+        before dispatch hooks are not added."""
+        ret_params = self._expand_grid_params(grid_params, max_params, constraint)
+        self.dispatch_stats = {}
+        if with_hook:
+            ret_params = self._run_before_dispatch_hooks(ret_params)
+        queue = WorkQueue(queue_dir)
+        n_added = queue.submit(ret_params)
+        logger.info("added %d of %d grid points to %s", n_added, len(ret_params), queue_dir)
+        return queue
+
+    def run_queue_worker(self,
+                         experiment_fn: Union[Callable[..., Any], str],
+                         queue_dir: str,
+                         with_hook: bool=True,
+                         verbose: int=0,
+                         allow_failure: bool=True,
+                         lease_timeout: float=300.,
+                         wait: bool=True,
+                         max_attempts: int=3) -> int:
+        """Runs grid points from the work queue in ``queue_dir`` until all of
+        them are done, returns how many this worker ran.
+
+        Results go through the after hooks as with run_grid_params. A task
+        holds a lease renewed by heartbeats, if a worker dies its lease
+        expires after ``lease_timeout`` seconds and another worker runs the
+        task again. A task whose experiment fails is retried, up to
+        ``max_attempts`` runs. With ``wait`` the worker keeps polling for
+        expiring leases until every task is done.
+        """
+        queue = WorkQueue(queue_dir, lease_timeout=lease_timeout)
+        return run_worker(self, queue, experiment_fn,
+                          with_hook=(with_hook and (not self._no_hooks)),
+                          verbose=verbose, allow_failure=allow_failure, wait=wait,
+                          poll_interval=min(1., lease_timeout / 5),
+                          max_attempts=max_attempts)
+
+    def iter_grid_params(self,
+                         experiment_fn: Union[Callable[..., Any], str],
+                         grid_params: Union[Dict[str, List], List[Dict[str, List]]],
+                         with_hook: bool=True,
+                         max_params: int=-1,
+                         commit_before_run: bool=False,
+                         verbose: int=0,
+                         allow_failure: bool=True,
+                         n_jobs: int=-1,
+                         backend: Optional[str]=None,
+                         pre_dispatch: str='2 * n_jobs',
+                         schedule: str='grid',
+                         max_tasks_per_worker: Optional[int]=None,
+                         max_worker_memory: Optional[int]=None,
+                         max_retries: int=1,
+                         timeout: Optional[float]=None,
+                         cpu_timeout: Optional[float]=None,
+                         ordered: bool=False,
+                         constraint: Optional[Callable[[Dict[str, Any]], bool]]=None,
+                         on_result: Optional[Callable[[Dict[str, Any], Any], None]]=None
+                         ) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """Streaming version of run_grid_params.
+
+        Yields (params, result) as soon as each grid point finishes, in
+        completion order, or in submission order if ``ordered`` is True.
+        Nothing is kept once it has been yielded. ``on_result(params,
+        result)`` is called for every point before it is yielded. With the
+        'grid' schedule the grid is expanded lazily while the points are
+        dispatched, and the before dispatch hooks see it in chunks.
+        """
+        if commit_before_run:
+            if self.repo is None:
+                raise ValueError("Not currently in git repo.")
+            # before returning, so the commit happens even if the caller
+            # consumes the results later
+            add_all_commit(self.repo)
 
-        return ret_params, ret_results
+        return self._stream_grid_params(
+            experiment_fn, grid_params, with_hook=with_hook, max_params=max_params,
+            verbose=verbose, allow_failure=allow_failure, n_jobs=n_jobs,
+            backend=backend, pre_dispatch=pre_dispatch, schedule=schedule,
+            max_tasks_per_worker=max_tasks_per_worker,
+            max_worker_memory=max_worker_memory, max_retries=max_retries,
+            timeout=timeout, cpu_timeout=cpu_timeout, ordered=ordered,
+            constraint=constraint, on_result=on_result)
+
+    def _stream_grid_params(self, experiment_fn, grid_params, with_hook, max_params,
+                            verbose, allow_failure, n_jobs, backend, pre_dispatch,
+                            schedule, max_tasks_per_worker, max_worker_memory,
+                            max_retries, timeout, cpu_timeout, ordered, constraint,
+                            on_result) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        ret_params = self._iter_grid_params(grid_params, max_params, constraint)
+        self.dispatch_stats = {}
+
+        for _, params, result in self._iter_results(
+                experiment_fn, ret_params, with_hook=with_hook, verbose=verbose,
+                allow_failure=allow_failure, n_jobs=n_jobs, backend=backend,
+                pre_dispatch=pre_dispatch, schedule=schedule, ordered=ordered,
+                max_tasks_per_worker=max_tasks_per_worker,
+                max_worker_memory=max_worker_memory, max_retries=max_retries,
+                timeout=timeout, cpu_timeout=cpu_timeout, dispatch_hooks=with_hook):
+            if on_result is not None:
+                on_result(params, result)
+            yield params, result
 
     def summary(self) -> None:
         pp = pprint.PrettyPrinter(indent=4)
@@ -405,7 +1043,18 @@ class AutoVar(object):
 
     def register_experiment(self, experiment_name: str,
                                experiment_fn: Callable[..., Any],
-                               settings: Dict = None) -> None:
+                               settings: Dict = None,
+                               batch_vars: Optional[List[str]] = None,
+                               max_batch_size: Optional[int] = None) -> None:
+        """
+        batch_vars : makes it a batched experiment, called as
+            experiment_fn(auto_var, var_values) with the var_value of every
+            grid point of a batch and returning one result per point. The
+            points of a batch only differ in batch_vars, which are not set
+            in auto_var.var_value during the call. run_grid_params groups
+            the points into batches of at most max_batch_size, the before
+            and after hooks still run once per point.
+        """
         if experiment_name in self.experiments:
             logger.info(f"Overriding experiment {experiment_name}")
         if settings is None:
@@ -413,6 +1062,8 @@ class AutoVar(object):
         self.experiments[experiment_name] = {
             "fn": experiment_fn,
             "settings": settings,
+            "batch_vars": batch_vars,
+            "max_batch_size": max_batch_size,
         }
 
     def get_argparser(self) -> argparse.ArgumentParser:
@@ -3,6 +3,7 @@
 from typing import Dict, List, Optional
 from copy import deepcopy
 from .decorators import register_var
+from .registry import CompiledVariable, Resolution, compile_variables
 
 default_fn_dict = {
     "type": "choice",
@@ -41,8 +42,20 @@ class RegisteringChoiceType(type):
                 cls.variables.setdefault(var_name, deepcopy(default_fn_dict))["argument_fn"][argument] = val.__func__
                 cls.variables[var_name].setdefault('required_vars', {})[argument] = prop['required_vars'] if 'required_vars' in prop else None
                 cls.variables[var_name].setdefault('cache_dirs', {})[argument] = prop['cache_dir'] if 'cache_dir' in prop else None
+                cls.variables[var_name].setdefault('mmap_modes', {})[argument] = prop.get('mmap_mode', None)
+                cls.variables[var_name].setdefault('cache_compress', {})[argument] = prop.get('cache_compress', 0)
+                cls.variables[var_name].setdefault('cache_max_bytes', {})[argument] = prop.get('cache_max_bytes', None)
+                if prop.get('memoize', False):
+                    scope = prop['memoize_scope']
+                    if scope is None:
+                        scope = prop.get('required_vars') or []
+                else:
+                    scope = None
+                cls.variables[var_name].setdefault('memoize_scopes', {})[argument] = scope
                 cls.arguments.append(argument)
                 cls.variable_shown_name.setdefault(var_name, dict())[argument] = shown_name
+        cls.compiled_variables: Dict[str, CompiledVariable] = \
+                compile_variables(cls.variables)
 
 class ParameterAlreadyRanError(Exception):
     def __init__(self, message="", errors=""):
@@ -70,3 +83,12 @@ class VariableNotRegisteredError(Exception):
 
         # Now for your custom code...
         self.errors = errors
+
+class ExperimentTimeoutError(Exception):
+    def __init__(self, message="", errors=""):
+
+        # Call the base class constructor with the parameters it needs
+        super().__init__(message)
+
+        # Now for your custom code...
+        self.errors = errors
@@ -1,5 +1,4 @@
 from typing import List, Optional
-import joblib
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -38,13 +37,45 @@ def requires(required_vars: List[str]):
         return func
     return decorator
 
-def cache_outputs(cache_dir: str):
+def memoize(scope: Optional[List[str]] = None):
     """
     Should com after register_var decorator.
+
+    Keeps the output in memory across the experiments of a process, for
+    as long as the variables in ``scope`` (by default the required_vars)
+    keep their values. The output is shared between the experiments and
+    must not be modified. Bounded by settings['memoize_bytes'].
+    """
+    def decorator(func):
+        if hasattr(func, 'registers'):
+            for reg in func.registers:
+                reg['memoize'] = True
+                reg['memoize_scope'] = scope
+        return func
+    return decorator
+
+def cache_outputs(cache_dir: str, mmap_mode: Optional[str] = None,
+                  compress=0, max_bytes: Optional[int] = None):
+    """
+    Should com after register_var decorator.
+
+    mmap_mode is passed to joblib.load (e.g. 'r'). The outputs are stored
+    uncompressed, so large numpy arrays are memory mapped from the cache
+    file and the page cache is shared by all processes reading it.
+
+    compress is passed to joblib.dump (e.g. 3 or ('lz4', 3)) and trades CPU
+    time for disk space, it can not be combined with mmap_mode. With
+    max_bytes the least recently used files of cache_dir are evicted once
+    it grows larger (see autovar.cache.CacheManager).
     """
+    if compress and mmap_mode is not None:
+        raise ValueError("compressed cache files can not be memory mapped")
     def decorator(func):
         if hasattr(func, 'registers'):
             for reg in func.registers:
                 reg['cache_dir'] = cache_dir
+                reg['mmap_mode'] = mmap_mode
+                reg['cache_compress'] = compress
+                reg['cache_max_bytes'] = max_bytes
         return func
     return decorator
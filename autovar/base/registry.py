@@ -0,0 +1,126 @@
+"""
+Compiled lookup tables for choice variables.
+"""
+import inspect
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Pattern
+
+# ``(?P<name>`` is rewritten into a plain capturing group so that templates
+# sharing group names can live in one alternation.
+_NAMED_GROUP = re.compile(r'(?<!\\)\(\?P<[^>]+>')
+# Templates with back-references can not be renumbered safely.
+_BACKREF = re.compile(r'\(\?P=|\\[1-9]')
+
+
+class Resolution(NamedTuple):
+    func: Callable
+    groupdict: Dict[str, Optional[str]]
+    template: str
+    cache_dir: Optional[str]
+    mmap_mode: Optional[str]
+    cache_compress: Any
+    cache_max_bytes: Optional[int]
+    required_vars: Optional[List[str]]
+    memoize_scope: Optional[List[str]]
+    pass_var_value: bool
+    pass_inter_var: bool
+
+
+class CompiledVariable(object):
+    """Precompiled form of a choice variable from ``RegisteringChoiceType``.
+
+    All argument templates are joined into one alternation, and every
+    argument that was resolved once is memoized, so repeated lookups of the
+    same argument cost a single dict access.
+    """
+
+    def __init__(self, variable: dict) -> None:
+        self.variable = variable
+        self.templates: List[str] = list(variable['argument_fn'].keys())
+        self.patterns: Dict[str, Pattern] = {
+            t: re.compile(t) for t in self.templates}
+        self.named_args: Dict[Callable, List[str]] = {}
+        for func in variable['argument_fn'].values():
+            if func not in self.named_args:
+                self.named_args[func] = inspect.getfullargspec(func)[0]
+        self.combined, self.group_index = self._combine()
+        self._memo: Dict[str, Optional[Resolution]] = {}
+
+    def _combine(self):
+        if not self.templates:
+            return None, {}
+        offset = 1
+        group_index: Dict[int, str] = {}
+        parts: List[str] = []
+        for template in self.templates:
+            if _BACKREF.search(template):
+                return None, {}
+            group_index[offset] = template
+            parts.append('(%s)' % _NAMED_GROUP.sub('(', template))
+            offset += 1 + self.patterns[template].groups
+        try:
+            combined = re.compile('|'.join(parts))
+        except re.error:
+            return None, {}
+        if combined.groups != offset - 1:
+            return None, {}
+        return combined, group_index
+
+    def _find_template(self, argument: str) -> Optional[str]:
+        if self.combined is None:
+            for template in self.templates:
+                if self.patterns[template].fullmatch(argument) is not None:
+                    return template
+            return None
+        m = self.combined.fullmatch(argument)
+        if m is None:
+            return None
+        # the outermost wrapper closes last, so lastindex points at it
+        return self.group_index[m.lastindex]
+
+    def _build(self, argument: str) -> Optional[Resolution]:
+        template = argument
+        groupdict: Dict[str, Optional[str]] = {}
+        if argument not in self.variable['argument_fn']:
+            found = self._find_template(argument)
+            if found is None:
+                return None
+            template = found
+            m = self.patterns[template].fullmatch(argument)
+            # _find_template only returns templates matching argument
+            assert m is not None
+            groupdict = m.groupdict()
+        func = self.variable['argument_fn'][template]
+        named_args = self.named_args[func]
+        return Resolution(
+            func=func,
+            groupdict=groupdict,
+            template=template,
+            cache_dir=self.variable['cache_dirs'][template],
+            mmap_mode=self.variable.get('mmap_modes', {}).get(template),
+            cache_compress=self.variable.get('cache_compress', {}).get(template, 0),
+            cache_max_bytes=self.variable.get('cache_max_bytes', {}).get(template),
+            required_vars=self.variable['required_vars'][template],
+            memoize_scope=self.variable.get('memoize_scopes', {}).get(template),
+            pass_var_value=('var_value' in named_args),
+            pass_inter_var=('inter_var' in named_args),
+        )
+
+    def resolve(self, argument: str) -> Optional[Resolution]:
+        try:
+            return self._memo[argument]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable argument, never matches a template
+            return None
+        if not isinstance(argument, str):
+            return None
+        ret = self._build(argument)
+        self._memo[argument] = ret
+        return ret
+
+
+def compile_variables(variables: Dict[str, dict]) -> Dict[str, CompiledVariable]:
+    return {var_name: CompiledVariable(v) for var_name, v in variables.items()
+            if v['type'] == 'choice'}
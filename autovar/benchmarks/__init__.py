@@ -0,0 +1,33 @@
+"""
+Benchmarks for the overhead of the AutoVar framework itself.
+
+Each ``bench_*`` module has a ``run()`` function returning a flat dict of
+measurements in seconds (lower is better) and can be executed directly,
+e.g. ``python -m autovar.benchmarks.bench_dispatch``. To run all of them
+and compare against an earlier commit::
+
+    python -m autovar.benchmarks -o new.json --compare old.json
+"""
+import time
+from typing import Callable
+
+BENCHMARKS = [
+    'bench_startup',
+    'bench_get_var',
+    'bench_argparse',
+    'bench_dispatch',
+    'bench_hooks',
+    'bench_cache',
+    'bench_formats',
+]
+
+
+def measure(fn: Callable[[], object], number: int = 1000, repeat: int = 5) -> float:
+    """Best time per call of ``fn`` over ``repeat`` rounds of ``number`` calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
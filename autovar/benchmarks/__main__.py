@@ -0,0 +1,83 @@
+"""
+Runs the benchmark suite and writes the measurements as JSON.
+"""
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from . import BENCHMARKS
+
+
+def git_hash() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(old: dict, new: dict, threshold: float) -> bool:
+    """Prints the ratio new/old of every measurement, True if any of them
+    got slower than ``threshold``."""
+    regressed = False
+    for bench, measurements in new['results'].items():
+        for key, value in measurements.items():
+            old_value = old['results'].get(bench, {}).get(key)
+            if not old_value:
+                continue
+            ratio = value / old_value
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{bench}.{key:<40} {old_value:12.6g} -> {value:12.6g}  x{ratio:.2f}{flag}")
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="file to write the results to (default: stdout)")
+    parser.add_argument('--only', type=str, nargs='*', default=None,
+                        choices=BENCHMARKS, help="benchmarks to run")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in (args.only or BENCHMARKS):
+        module = importlib.import_module(f'{__package__}.{name}')
+        print(f"running {name} ...", file=sys.stderr)
+        results[name] = module.run()
+
+    output = {
+        'meta': {
+            'git_hash': git_hash(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+        },
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        if compare(old, output, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
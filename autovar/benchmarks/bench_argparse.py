@@ -0,0 +1,28 @@
+"""
+parse_argparse for variable classes with hundreds of arguments.
+"""
+import json
+from typing import Dict
+
+from autovar import AutoVar
+from autovar.benchmarks import measure
+from autovar.benchmarks.bench_get_var import make_var_class
+
+
+def run(n_templates: int = 300, n_classes: int = 3, n_vals: int = 100) -> Dict[str, float]:
+    auto_var = AutoVar()
+    args = []
+    for c in range(n_classes):
+        auto_var.add_variable_class(make_var_class(n_templates, 'many%d' % c)())
+        args += ['--many%d' % c, 't%d_1' % (n_templates - 1)]
+    for v in range(n_vals):
+        auto_var.add_variable('val%d' % v, int, default=v)
+
+    return {
+        'get_argparser': measure(auto_var.get_argparser, number=5),
+        'parse_argparse': measure(lambda: auto_var.parse_argparse(args), number=5),
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
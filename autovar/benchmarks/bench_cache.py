@@ -0,0 +1,60 @@
+"""
+Hit and miss paths of cache_outputs variables.
+"""
+import json
+import shutil
+import tempfile
+from typing import Dict
+
+import numpy as np
+
+from autovar import AutoVar
+from autovar.base import RegisteringChoiceType, VariableClass, register_var
+from autovar.base.decorators import cache_outputs
+from autovar.cache import get_memory_cache
+from autovar.benchmarks import measure
+
+
+def _array_var_class(cache_dir: str):
+
+    class ArrayVarClass(VariableClass, metaclass=RegisteringChoiceType):
+        var_name = "array"
+
+        @cache_outputs(cache_dir=cache_dir)
+        @register_var(argument=r"zeros_(?P<n>\d+)")
+        @staticmethod
+        def zeros(auto_var, n):
+            return np.zeros((int(n), 100))
+
+    return ArrayVarClass
+
+
+def run(n_rows: int = 10000) -> Dict[str, float]:
+    ret: Dict[str, float] = {}
+    cache_dir = tempfile.mkdtemp()
+    try:
+        auto_var = AutoVar()
+        auto_var.add_variable_class(_array_var_class(cache_dir)())
+        misses = iter('zeros_%d' % (n_rows + i) for i in range(10 ** 7))
+        ret['cache_miss'] = measure(
+            lambda: auto_var.get_var_with_argument('array', next(misses)),
+            number=20, repeat=3)
+
+        argument = 'zeros_%d' % n_rows
+        auto_var.settings['memory_cache_bytes'] = 0
+        get_memory_cache().set_max_bytes(0)
+        ret['cache_hit_disk'] = measure(
+            lambda: auto_var.get_var_with_argument('array', argument), number=50)
+
+        auto_var.settings['memory_cache_bytes'] = 10 ** 9
+        ret['cache_hit_memory'] = measure(
+            lambda: auto_var.get_var_with_argument('array', argument), number=1000)
+        get_memory_cache().clear()
+        get_memory_cache().set_max_bytes(0)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,64 @@
+"""
+Per-task dispatch overhead of ``run_grid_params`` with a no-op experiment.
+"""
+from copy import deepcopy
+import json
+import time
+from typing import Dict, List, Optional
+
+try:
+    import cloudpickle
+except ImportError:
+    from joblib.externals import cloudpickle  # type: ignore
+
+from autovar import AutoVar
+from autovar.base import RegisteringChoiceType, VariableClass, register_var
+
+
+class NoopVarClass(VariableClass, metaclass=RegisteringChoiceType):
+    var_name = "noop"
+
+    @register_var(argument=r"noop_(?P<idx>\d+)")
+    @staticmethod
+    def noop(auto_var, idx):
+        return int(idx)
+
+
+def noop_experiment(auto_var):
+    return {}
+
+
+def make_auto_var() -> AutoVar:
+    auto_var = AutoVar()
+    auto_var.add_variable_class(NoopVarClass())
+    auto_var.add_variable('random_seed', int)
+    return auto_var
+
+
+def run(n_points: int = 200, n_jobs: int = 2,
+        backends: Optional[List[str]] = None) -> Dict[str, float]:
+    if backends is None:
+        backends = ['sequential', 'threading', 'loky']
+    auto_var = make_auto_var()
+    grid_params: Dict[str, List] = {
+        'noop': ['noop_%d' % i for i in range(10)],
+        'random_seed': list(range(n_points // 10)),
+    }
+    ret: Dict[str, float] = {}
+    for backend in backends:
+        start = time.perf_counter()
+        auto_var.run_grid_params(noop_experiment, grid_params, n_jobs=n_jobs,
+                                 backend=backend, with_hook=False)
+        ret[f'dispatch_{backend}_per_task'] = \
+            (time.perf_counter() - start) / n_points
+
+    # what dispatching used to pay per task: deepcopy + pickling the copy
+    start = time.perf_counter()
+    for _ in range(200):
+        cloudpickle.dumps(deepcopy(auto_var))
+    ret['deepcopy_pickle_per_task'] = (time.perf_counter() - start) / 200
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
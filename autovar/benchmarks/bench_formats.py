@@ -0,0 +1,66 @@
+"""
+Write and read time of a result with large arrays in every file format of
+save_result_to_file, and the file size (``*_bytes``, in bytes).
+"""
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict
+
+import numpy as np
+
+from autovar.hooks import formats
+from autovar.hooks.formats import dump_result, load_result
+from autovar.benchmarks import measure
+
+FORMATS = [
+    ('json', 'json', None),
+    ('pickle', 'pickle', None),
+    ('joblib_zlib', 'joblib', 'zlib'),
+    ('joblib_lz4', 'joblib', 'lz4'),
+    ('npz', 'npz', None),
+    ('npz_zlib', 'npz', 'zlib'),
+    ('msgpack', 'msgpack', None),
+]
+
+
+def make_result(n_samples: int) -> dict:
+    rng = np.random.RandomState(0)
+    return {
+        'var_value': {'dataset': 'mnist', 'random_seed': 0},
+        'trn_acc': .99,
+        'tst_acc': .98,
+        'pred': rng.randint(10, size=n_samples),
+        'proba': rng.rand(n_samples, 10).astype(np.float32),
+        'dist': rng.rand(500, 500),
+    }
+
+
+def run(n_samples: int = 20000) -> Dict[str, float]:
+    ret: Dict[str, float] = {}
+    result = make_result(n_samples)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, file_format, compression in FORMATS:
+            if file_format == 'msgpack' and formats.msgpack is None:
+                continue
+            if compression == 'lz4':
+                try:
+                    import lz4  # noqa: F401  pylint: disable=unused-import
+                except ImportError:
+                    continue
+            path = os.path.join(tmp_dir, name)
+            ret[f'{name}_write'] = measure(
+                lambda: dump_result(result, path, file_format, compression=compression),
+                number=3, repeat=3)
+            ret[f'{name}_read'] = measure(
+                lambda: load_result(path, file_format), number=3, repeat=3)
+            ret[f'{name}_bytes'] = float(os.path.getsize(path))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,38 @@
+"""
+get_var resolution against a variable with many regex templates.
+"""
+import json
+from typing import Dict
+
+from autovar import AutoVar
+from autovar.base import RegisteringChoiceType, VariableClass, register_var
+from autovar.benchmarks import measure
+
+
+def make_var_class(n_templates: int, var_name: str = 'many'):
+    attrs = {'var_name': var_name, 'default': None}
+    for i in range(n_templates):
+        def fn(auto_var, n):
+            return n
+        attrs['t%d' % i] = register_var(argument=r"t%d_(?P<n>\d+)" % i)(staticmethod(fn))
+    return RegisteringChoiceType('ManyVarClass', (VariableClass, ), attrs)
+
+
+def run(n_templates: int = 500) -> Dict[str, float]:
+    auto_var = AutoVar()
+    auto_var.add_variable_class(make_var_class(n_templates)())
+    last = 't%d_3' % (n_templates - 1)
+    auto_var.set_variable_value('many', last)
+
+    arguments = iter('t%d_%d' % (n_templates - 1, i) for i in range(10 ** 7))
+    return {
+        'get_var_last_template': measure(lambda: auto_var.get_var('many')),
+        'get_var_first_seen_argument': measure(
+            lambda: auto_var.get_var_with_argument('many', next(arguments)), number=200),
+        'match_variable_miss': measure(
+            lambda: auto_var.match_variable('many', 'unknown_3')),
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,44 @@
+"""
+Overhead of the file hooks around run_single_experiment.
+"""
+import json
+import shutil
+import tempfile
+from typing import Dict
+
+from autovar import AutoVar
+from autovar.hooks import check_result_file_exist, create_placeholder_file, \
+    save_result_to_file, remove_placeholder_if_error
+from autovar.benchmarks import measure
+
+
+def run(number: int = 200) -> Dict[str, float]:
+    ret: Dict[str, float] = {}
+    result_dir = tempfile.mkdtemp()
+    try:
+        for name, before, after in [
+                ('no_hooks', [], []),
+                ('file_hooks', [check_result_file_exist, create_placeholder_file],
+                 [save_result_to_file, remove_placeholder_if_error])]:
+            auto_var = AutoVar(
+                settings={'result_file_dir': result_dir},
+                before_experiment_hooks=before,
+                after_experiment_hooks=after,
+            )
+            auto_var.add_variable('random_seed', int)
+            seeds = iter(range(10 ** 7))
+
+            def experiment(auto_var):
+                return {'x': 1}
+
+            def run_one():
+                auto_var.set_variable_value('random_seed', next(seeds))
+                auto_var.run_single_experiment(experiment)
+            ret[f'run_single_experiment_{name}'] = measure(run_one, number=number, repeat=3)
+    finally:
+        shutil.rmtree(result_dir)
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
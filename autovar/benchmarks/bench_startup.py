@@ -0,0 +1,63 @@
+"""
+Import and AutoVar construction time of a fresh interpreter, and the
+``--help`` of a small experiment script.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+SCRIPT = '''
+from autovar import AutoVar
+from autovar.base import RegisteringChoiceType, VariableClass, register_var
+
+class OrdVarClass(VariableClass, metaclass=RegisteringChoiceType):
+    var_name = "ord"
+    default = "2"
+
+    @register_var(argument='2')
+    @staticmethod
+    def l2(auto_var):
+        return 2
+
+auto_var = AutoVar()
+auto_var.add_variable_class(OrdVarClass())
+auto_var.parse_argparse()
+'''
+
+
+def _best_wall_time(cmd, repeat: int) -> float:
+    # make the autovar under test importable from the temporary script
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_root] + [p for p in [env.get('PYTHONPATH')] if p])
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, env=env)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(repeat: int = 5) -> Dict[str, float]:
+    ret: Dict[str, float] = {}
+    ret['python_startup'] = _best_wall_time([sys.executable, '-c', 'pass'], repeat)
+    ret['import_autovar'] = _best_wall_time(
+        [sys.executable, '-c', 'import autovar, autovar.hooks'], repeat)
+    ret['construct_autovar'] = _best_wall_time(
+        [sys.executable, '-c', 'from autovar import AutoVar; AutoVar()'], repeat)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        script = os.path.join(temp_dir, 'experiment.py')
+        with open(script, 'w') as f:
+            f.write(SCRIPT)
+        ret['script_help'] = _best_wall_time([sys.executable, script, '--help'], repeat)
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,8 @@
+"""
+Caching layers used by the ``cache_outputs`` decorator.
+"""
+from .memory import MemoryCache, estimate_nbytes, freeze_arrays, \
+        get_memo_cache, get_memory_cache
+from .disk import FileLock, atomic_dump, cache_filename, cache_key, \
+        load_or_compute, meta_filename, read_meta, remove_cache_file
+from .manager import CacheEntry, CacheManager
@@ -0,0 +1,104 @@
+"""
+Lists, evicts and removes the entries of a cache_outputs directory.
+
+    python -m autovar.cache list CACHE_DIR --sort size
+    python -m autovar.cache evict CACHE_DIR --max-bytes 10G --dry-run
+    python -m autovar.cache remove CACHE_DIR KEY_PREFIX [KEY_PREFIX ...]
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from .manager import CacheManager
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_bytes(value: str) -> int:
+    """'500M', '10G' or a plain number of bytes."""
+    value = value.strip().upper().rstrip('B') or '0'
+    unit = value[-1] if value[-1] in _UNITS else ''
+    try:
+        return int(float(value[:len(value) - len(unit)]) * _UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {value}")
+
+
+def format_bytes(n: float) -> str:
+    for unit in ['B', 'K', 'M', 'G']:
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == 'B' else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}T"
+
+
+def _format_time(t) -> str:
+    if t is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def print_entries(entries) -> None:
+    print(f"{'key':<16} {'size':>8} {'hits':>5} {'last used':<19}  variable")
+    for e in entries:
+        if e.var_name is None:
+            produced = '?'
+        else:
+            others = {k: v for k, v in (e.var_used or {}).items() if k != e.var_name}
+            produced = f"{e.var_name}={e.argument}"
+            if others:
+                produced += ' ' + json.dumps(others, sort_keys=True)
+        print(f"{e.key[:16]:<16} {format_bytes(e.size):>8} {e.hits:>5} "
+              f"{_format_time(e.last_used):<19}  {produced}")
+    print(f"{len(entries)} entries, {format_bytes(sum(e.size for e in entries))}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('list', help="list the entries, least recently used first")
+    p.add_argument('cache_dir', type=str)
+    p.add_argument('--sort', type=str, default='last_used',
+                   choices=['last_used', 'size', 'hits', 'created'])
+
+    p = subparsers.add_parser('evict', help="remove least recently used entries")
+    p.add_argument('cache_dir', type=str)
+    p.add_argument('--max-bytes', type=parse_bytes, required=True,
+                   help="size to shrink the directory to, e.g. 500M or 10G")
+    p.add_argument('--dry-run', action='store_true',
+                   help="only list what would be removed")
+
+    p = subparsers.add_parser('remove', help="remove entries by key")
+    p.add_argument('cache_dir', type=str)
+    p.add_argument('keys', type=str, nargs='+')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # add_subparsers(required=True) needs Python 3.7
+        parser.error("a command is required")
+
+    manager = CacheManager(args.cache_dir)
+    if args.command == 'list':
+        entries = sorted(manager.entries(), key=lambda e: getattr(e, args.sort))
+        print_entries(entries)
+    elif args.command == 'evict':
+        removed = manager.evict(args.max_bytes, dry_run=args.dry_run)
+        print_entries(removed)
+        print(f"{'would remove' if args.dry_run else 'removed'} {len(removed)} entries, "
+              f"{format_bytes(manager.total_bytes())} left"
+              + (" before eviction" if args.dry_run else ""))
+    elif args.command == 'remove':
+        entries = manager.entries()
+        for key in args.keys:
+            matches = [e for e in entries if e.key.startswith(key)]
+            if len(matches) != 1:
+                print(f"{key} matches {len(matches)} entries", file=sys.stderr)
+                return 1
+            manager.remove(matches[0])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
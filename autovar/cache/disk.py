@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+from mkdir_p import mkdir_p
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+_logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def cache_key(var_used: Dict[str, Any]) -> str:
+    """Content hash of the variables a cached output depends on.
+
+    Values are serialized with their type (1 and '1' differ), so keys do
+    not collide the way the joined string representation does.
+    """
+    canonical = json.dumps(var_used, sort_keys=True, default=repr,
+                           separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def cache_filename(cache_dir: str, var_used: Dict[str, Any]) -> str:
+    return os.path.join(cache_dir, cache_key(var_used) + '.pkl')
+
+
+class FileLock(object):
+    """Exclusive lock on ``path`` shared between processes.
+
+    Uses flock where available, otherwise falls back to creating the lock
+    file exclusively and polling.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.1) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> None:
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+                return
+            except FileExistsError:
+                time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        else:
+            os.close(self._fd)
+            os.unlink(self.path)
+        self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _atomic_write(filename: str, write: Callable[[str], None]) -> None:
+    dirname, basename = os.path.split(filename)
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=dirname, prefix='.' + basename + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
+
+
+def atomic_dump(value: Any, filename: str, compress=0) -> None:
+    """joblib.dump into a temporary file and rename it over ``filename``.
+    ``compress`` is passed to joblib.dump (e.g. 3 or ('lz4', 3))."""
+    import joblib
+    _atomic_write(filename, lambda tmp: joblib.dump(value, tmp, compress=compress or 0))
+
+
+def meta_filename(filename: str) -> str:
+    """Sidecar of a cache file, recording which variable and argument
+    produced it and how often it was loaded."""
+    return os.path.splitext(filename)[0] + '.meta.json'
+
+
+def read_meta(filename: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(meta_filename(filename), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(filename: str, meta: Dict[str, Any]) -> None:
+    content = json.dumps(meta, default=repr)
+
+    def write(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            f.write(content)
+    _atomic_write(meta_filename(filename), write)
+
+
+# hits counted since the sidecar was last rewritten, per cache file
+_pending_hits: Dict[str, Tuple[int, float]] = {}
+_HIT_FLUSH_INTERVAL = 10.
+
+
+def record_hit(filename: str) -> None:
+    """Records a load of ``filename`` in its sidecar.
+
+    The sidecar mtime is bumped on every hit, which keeps the last use
+    exact. The hit count is rewritten at most every few seconds per file
+    and process, so counts lag behind and hits of a process exiting in
+    between are lost.
+    """
+    now = time.time()
+    n_hits, flushed_at = _pending_hits.get(filename, (0, 0.))
+    n_hits += 1
+    if now - flushed_at < _HIT_FLUSH_INTERVAL:
+        try:
+            os.utime(meta_filename(filename))
+            _pending_hits[filename] = (n_hits, flushed_at)
+            return
+        except OSError:
+            pass
+    meta = read_meta(filename) or {}
+    meta['hits'] = meta.get('hits', 0) + n_hits
+    meta['last_hit'] = now
+    try:
+        write_meta(filename, meta)
+        _pending_hits[filename] = (0, now)
+    except OSError as e:
+        _logger.warning(f"unable to record the use of {filename}: {e!r}")
+
+
+def remove_cache_file(filename: str, remove_lock: bool = True) -> None:
+    """Removes a cache file, its sidecar and its lock file.
+
+    A process waiting on the removed lock file may then compute the output
+    at the same time as one locking a new lock file, which only costs the
+    duplicate work since outputs are renamed into place.
+    """
+    _pending_hits.pop(filename, None)
+    paths = [filename, meta_filename(filename)]
+    if remove_lock:
+        paths.append(filename + '.lock')
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _try_load(filename: str, mmap_mode: Optional[str], remove_broken: bool):
+    if not os.path.exists(filename):
+        return _MISSING
+    import joblib
+    try:
+        ret = joblib.load(filename, mmap_mode=mmap_mode)
+        _logger.info(f"using result from cache file {filename} ...")
+        return ret
+    except Exception as e:  # pylint: disable=broad-except
+        if remove_broken:
+            _logger.warning(f"removing broken cache file {filename}: {e!r}")
+            # the caller holds the lock
+            remove_cache_file(filename, remove_lock=False)
+        else:
+            _logger.info(f"unable to load cache file {filename}: {e!r}")
+        return _MISSING
+
+
+def load_or_compute(filename: str, func: Callable, args=(), kwargs=None,
+                    mmap_mode: Optional[str] = None,
+                    stats: Optional[Dict[str, Any]] = None,
+                    meta: Optional[Dict[str, Any]] = None,
+                    compress=0, max_bytes: Optional[int] = None):
+    """Load ``filename`` or compute it with ``func(*args, **kwargs)``.
+
+    The computation runs under a per-key lock, so when several processes
+    miss at the same time one computes and the others wait and load the
+    result. If ``stats`` is given, the source ('disk' or 'computed') and the
+    time spent loading, waiting for the lock, computing and dumping are
+    written into it.
+
+    Every load is counted in the sidecar of the file, which is created with
+    ``meta`` on dump. ``compress`` is passed to joblib.dump. With
+    ``max_bytes`` the least recently used files of the directory are
+    evicted after a dump (see CacheManager).
+    """
+    if kwargs is None:
+        kwargs = {}
+    if stats is None:
+        stats = {}
+    start = time.perf_counter()
+    ret = _try_load(filename, mmap_mode, remove_broken=False)
+    stats['load_time'] = time.perf_counter() - start
+    if ret is not _MISSING:
+        stats['source'] = 'disk'
+        record_hit(filename)
+        return ret
+
+    mkdir_p(os.path.dirname(filename))
+    start = time.perf_counter()
+    with FileLock(filename + '.lock'):
+        stats['lock_time'] = time.perf_counter() - start
+        start = time.perf_counter()
+        ret = _try_load(filename, mmap_mode, remove_broken=True)
+        stats['load_time'] += time.perf_counter() - start
+        if ret is not _MISSING:
+            stats['source'] = 'disk'
+            record_hit(filename)
+            return ret
+        start = time.perf_counter()
+        ret = func(*args, **kwargs)
+        stats['compute_time'] = time.perf_counter() - start
+        stats['source'] = 'computed'
+        _logger.info(f"dumping cache file to {filename} ...")
+        start = time.perf_counter()
+        atomic_dump(ret, filename, compress=compress)
+        write_meta(filename, dict(meta or {}, created=time.time(), hits=0, last_hit=None,
+                                  compute_time=stats['compute_time'], compress=compress))
+        stats['dump_time'] = time.perf_counter() - start
+    if max_bytes is not None:
+        from .manager import enforce_quota
+        enforce_quota(os.path.dirname(filename), max_bytes,
+                      os.path.getsize(filename), keep=[filename])
+    if mmap_mode is not None:
+        # drop the private copy and map the file like the other readers
+        import joblib
+        ret = joblib.load(filename, mmap_mode=mmap_mode)
+    return ret
@@ -0,0 +1,159 @@
+"""
+Inspection and size quota of cache_outputs directories.
+"""
+import os
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+import logging
+
+from .disk import meta_filename, read_meta, remove_cache_file
+
+_logger = logging.getLogger(__name__)
+
+_EXT = '.pkl'
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    path: str
+    # bytes of the cache file and its sidecar
+    size: int
+    created: float
+    last_hit: Optional[float]
+    hits: int
+    var_name: Optional[str]
+    argument: Optional[str]
+    var_used: Optional[Dict[str, Any]]
+
+    @property
+    def last_used(self) -> float:
+        return self.last_hit if self.last_hit is not None else self.created
+
+
+class CacheManager(object):
+    """The files of a cache_outputs directory.
+
+    Entries written before the sidecars existed are listed without the
+    variable and argument, with their mtime as creation time.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    def _entry(self, path: str, st: os.stat_result) -> CacheEntry:
+        meta = read_meta(path) or {}
+        size = st.st_size
+        last_hit = meta.get('last_hit')
+        try:
+            meta_st = os.stat(meta_filename(path))
+            size += meta_st.st_size
+            # record_hit bumps the sidecar mtime between rewrites
+            if last_hit is not None:
+                last_hit = max(last_hit, meta_st.st_mtime)
+        except OSError:
+            pass
+        return CacheEntry(
+            key=os.path.basename(path)[:-len(_EXT)],
+            path=path,
+            size=size,
+            created=meta.get('created') or st.st_mtime,
+            last_hit=last_hit,
+            hits=meta.get('hits', 0),
+            var_name=meta.get('var_name'),
+            argument=meta.get('argument'),
+            var_used=meta.get('var_used'),
+        )
+
+    def entries(self) -> List[CacheEntry]:
+        """Every cache file, least recently used first."""
+        ret: List[CacheEntry] = []
+        if not os.path.isdir(self.cache_dir):
+            return ret
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                # skip the temporary files of dumps in progress
+                if entry.name.startswith('.') or not entry.name.endswith(_EXT):
+                    continue
+                try:
+                    ret.append(self._entry(entry.path, entry.stat()))
+                except FileNotFoundError:
+                    continue
+        ret.sort(key=lambda e: e.last_used)
+        return ret
+
+    def total_bytes(self) -> int:
+        return sum(e.size for e in self.entries())
+
+    def remove(self, entry: Union[CacheEntry, str]) -> None:
+        """Removes an entry, given as CacheEntry or key."""
+        if isinstance(entry, CacheEntry):
+            path = entry.path
+        else:
+            path = os.path.join(self.cache_dir, entry + _EXT)
+        remove_cache_file(path)
+
+    def evict(self, max_bytes: int, keep: Iterable[str] = (),
+              dry_run: bool = False,
+              entries: Optional[List[CacheEntry]] = None) -> List[CacheEntry]:
+        """Removes the least recently used entries until the directory
+        holds at most ``max_bytes``, never the paths in ``keep``. Returns
+        the removed entries (only lists them with ``dry_run``).
+
+        Processes that already opened or memory mapped a removed file keep
+        reading it.
+        """
+        keep = {os.path.abspath(p) for p in keep}
+        if entries is None:
+            entries = self.entries()
+        total = sum(e.size for e in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if os.path.abspath(entry.path) in keep:
+                continue
+            if not dry_run:
+                self.remove(entry)
+            total -= entry.size
+            removed.append(entry)
+        if removed and not dry_run:
+            _logger.info("evicted %d cache files from %s, %d bytes left",
+                         len(removed), self.cache_dir, total)
+        return removed
+
+    def clear(self) -> int:
+        """Removes every entry, returns how many."""
+        entries = self.entries()
+        for entry in entries:
+            self.remove(entry)
+        _dir_bytes.pop(self.cache_dir, None)
+        return len(entries)
+
+
+# estimated bytes of each cache directory and when it was last scanned
+_dir_bytes: Dict[str, Tuple[int, float]] = {}
+_RESCAN_INTERVAL = 60.
+
+
+def enforce_quota(cache_dir: str, max_bytes: int, added_bytes: int,
+                  keep: Iterable[str] = ()) -> None:
+    """Evicts from ``cache_dir`` after a dump of ``added_bytes`` if it may
+    hold more than ``max_bytes``.
+
+    The size of the directory is estimated from the dumps of this process
+    and only scanned once the estimate goes over the quota, or when it is
+    older than a minute to pick up the dumps of other processes.
+    """
+    estimate, scanned_at = _dir_bytes.get(cache_dir, (None, 0.))
+    if estimate is not None and time.time() - scanned_at < _RESCAN_INTERVAL:
+        estimate += added_bytes
+        if estimate <= max_bytes:
+            _dir_bytes[cache_dir] = (estimate, scanned_at)
+            return
+    manager = CacheManager(cache_dir)
+    entries = manager.entries()
+    total = sum(e.size for e in entries)
+    if total > max_bytes:
+        removed = manager.evict(max_bytes, keep=keep, entries=entries)
+        total -= sum(e.size for e in removed)
+    _dir_bytes[cache_dir] = (total, time.time())
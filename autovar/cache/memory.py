@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import sys
+import threading
+from typing import Any, Dict, Hashable, Tuple
+import logging
+
+_logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _is_memmapped(obj: Any) -> bool:
+    while obj is not None:
+        if getattr(obj, 'filename', None) is not None \
+                and hasattr(obj, 'offset'):
+            return True
+        obj = getattr(obj, 'base', None)
+    return False
+
+
+def estimate_nbytes(obj: Any, _seen=None) -> int:
+    """Rough in-memory size of ``obj``.
+
+    Array-like objects report their buffer size through ``nbytes``;
+    containers are walked recursively.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(nbytes, int):
+        if _is_memmapped(obj):
+            # the data lives in the page cache, not in this process
+            return sys.getsizeof(obj)
+        return nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += estimate_nbytes(k, _seen) + estimate_nbytes(v, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += estimate_nbytes(v, _seen)
+    return size
+
+
+def freeze_arrays(obj: Any, _seen=None) -> None:
+    """Marks the numpy arrays in ``obj`` (walking containers like
+    estimate_nbytes) read-only."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return
+    _seen.add(id(obj))
+
+    flags = getattr(obj, 'flags', None)
+    if flags is not None and hasattr(flags, 'writeable'):
+        flags.writeable = False
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            freeze_arrays(v, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            freeze_arrays(v, _seen)
+
+
+class MemoryCache(object):
+    """LRU cache bounded by the estimated size of the stored values.
+
+    A ``max_bytes`` of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes: int = 0) -> None:
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """Store ``value``, returns False if it does not fit the budget."""
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:
+                return False
+            self._data[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+        return True
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: Hashable) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.current_bytes -= item[1]
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._data:
+            key, (_, nbytes) = self._data.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+            _logger.debug("evicting %s from memory cache", key)
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._data),
+            'current_bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+# One instance per process, so it outlives the AutoVar copies that
+# run_grid_params hands to each task.
+_memory_cache = MemoryCache()
+
+
+def get_memory_cache() -> MemoryCache:
+    return _memory_cache
+
+
+# outputs of the variables decorated with memoize
+_memo_cache = MemoryCache(1024 ** 3)
+
+
+def get_memo_cache() -> MemoryCache:
+    return _memo_cache
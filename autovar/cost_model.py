@@ -0,0 +1,91 @@
+"""
+Running time predictions for the 'lpt' schedule of run_grid_params.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+from .cache import cache_key
+
+_logger = logging.getLogger(__name__)
+
+
+class CostModel(object):
+    """Predicts the running_time of a grid point from past results.
+
+    A point seen before is predicted by its mean running time. Otherwise
+    the overall mean is scaled by how much slower or faster each of its
+    variable values was on average (a multiplicative main effects model);
+    values never seen leave the prediction unchanged. Variables in
+    ``ignore`` do not affect the running time.
+    """
+
+    def __init__(self, ignore: Iterable[str] = ('git_hash', 'hostname')) -> None:
+        self.ignore = set(ignore)
+        self.total = 0.
+        self.n = 0
+        self._exact: Dict[str, List[float]] = {}
+        self._by_value: Dict[Tuple[str, str], List[float]] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _items(self, var_value: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in var_value.items() if k not in self.ignore}
+
+    def add(self, var_value: Dict[str, Any], running_time: float) -> None:
+        items = self._items(var_value)
+        self.total += running_time
+        self.n += 1
+        stat = self._exact.setdefault(cache_key(items), [0., 0])
+        stat[0] += running_time
+        stat[1] += 1
+        for k, v in items.items():
+            stat = self._by_value.setdefault((k, repr(v)), [0., 0])
+            stat[0] += running_time
+            stat[1] += 1
+
+    def add_result(self, ret) -> bool:
+        """Learns from a result of run_single_experiment, if it has a
+        running_time."""
+        if not isinstance(ret, dict) or not isinstance(ret.get('var_value'), dict) \
+                or not isinstance(ret.get('running_time'), (int, float)):
+            return False
+        self.add(ret['var_value'], ret['running_time'])
+        return True
+
+    def predict(self, var_value: Dict[str, Any]) -> Optional[float]:
+        """Predicted running time, None without any history."""
+        if self.n == 0:
+            return None
+        items = self._items(var_value)
+        stat = self._exact.get(cache_key(items))
+        if stat is not None:
+            return stat[0] / stat[1]
+        mean = self.total / self.n
+        ret = mean
+        if mean > 0:
+            for k, v in items.items():
+                stat = self._by_value.get((k, repr(v)))
+                if stat is not None:
+                    ret *= (stat[0] / stat[1]) / mean
+        return ret
+
+    @classmethod
+    def from_results(cls, results: Iterable, **kwargs) -> "CostModel":
+        model = cls(**kwargs)
+        for ret in results:
+            model.add_result(ret)
+        return model
+
+    @classmethod
+    def from_result_dir(cls, result_file_dir: str, file_format: str = 'json',
+                        **kwargs) -> "CostModel":
+        """Learns from the results saved by save_result_to_file."""
+        from .hooks.loader import read_result_file, _list_result_files
+        from .hooks import get_ext
+        model = cls(**kwargs)
+        files = _list_result_files(result_file_dir, '.' + get_ext(file_format))
+        for path, _ in files.values():
+            model.add_result(read_result_file(path, file_format))
+        _logger.info("learned running times of %d results", len(model))
+        return model
@@ -0,0 +1,309 @@
+"""
+Work queue in a shared directory, so grid points can be run by worker
+processes on any number of nodes that see the same filesystem.
+
+Layout of the queue directory::
+
+    tasks/<seq>-<key>.pkl    the parameter dict of a grid point
+    leases/<task>.lease      held by the worker running the task; its
+                             mtime is the last heartbeat
+    done/<task>.json         written once the task finished
+    failed/<task>.log        one line per failed attempt
+
+A lease whose heartbeat is older than ``lease_timeout`` belongs to a
+crashed worker and is taken over by the next worker that sees it.
+"""
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+import logging
+
+from mkdir_p import mkdir_p
+
+from .cache import cache_key
+
+_logger = logging.getLogger(__name__)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class WorkQueue(object):
+    """Grid points shared between workers through ``queue_dir``."""
+
+    def __init__(self, queue_dir: str, lease_timeout: float = 300.,
+                 heartbeat_interval: Optional[float] = None) -> None:
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        if heartbeat_interval is None:
+            heartbeat_interval = lease_timeout / 5
+        self.heartbeat_interval = heartbeat_interval
+        self.task_dir = os.path.join(queue_dir, 'tasks')
+        self.lease_dir = os.path.join(queue_dir, 'leases')
+        self.done_dir = os.path.join(queue_dir, 'done')
+        self.failed_dir = os.path.join(queue_dir, 'failed')
+        for d in [self.task_dir, self.lease_dir, self.done_dir, self.failed_dir]:
+            mkdir_p(d)
+        # tasks not done at the last listing, next_task walks them in order
+        self._pending: List[str] = []
+        self._cursor = 0
+        # tasks leased by taking over the expired lease of a crashed worker,
+        # whose attempt may have left e.g. a placeholder behind
+        self.taken_over: Set[str] = set()
+
+    def _lease_path(self, task_id: str) -> str:
+        return os.path.join(self.lease_dir, task_id + '.lease')
+
+    def _done_path(self, task_id: str) -> str:
+        return os.path.join(self.done_dir, task_id + '.json')
+
+    def submit(self, params_list: List[Dict[str, Any]]) -> int:
+        """Adds the grid points not in the queue yet, returns how many."""
+        existing = {name.split('-', 1)[1][:-len('.pkl')]
+                    for name in os.listdir(self.task_dir) if name.endswith('.pkl')}
+        seq = len(existing)
+        n_added = 0
+        for params in params_list:
+            key = cache_key(params)
+            if key in existing:
+                continue
+            existing.add(key)
+            _atomic_write(os.path.join(self.task_dir, '%08d-%s.pkl' % (seq, key)),
+                          pickle.dumps(params))
+            seq += 1
+            n_added += 1
+        return n_added
+
+    def tasks(self) -> List[str]:
+        return sorted(name[:-len('.pkl')] for name in os.listdir(self.task_dir)
+                      if name.endswith('.pkl'))
+
+    def load(self, task_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self.task_dir, task_id + '.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def is_done(self, task_id: str) -> bool:
+        return os.path.exists(self._done_path(task_id))
+
+    def _lease_expired(self, path: str) -> bool:
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def acquire(self, task_id: str, worker_id: str) -> bool:
+        """Takes the lease of ``task_id``, breaking it if it expired."""
+        path = self._lease_path(task_id)
+        expired = self._lease_expired(path)
+        if expired:
+            # only one worker wins the rename of an expired lease
+            expired_path = '%s.expired.%s' % (path, worker_id)
+            try:
+                os.rename(path, expired_path)
+            except FileNotFoundError:
+                return False
+            if not self._lease_expired(expired_path):
+                # renewed since our stat, give it back unless a new lease
+                # was created meanwhile; link never replaces a file
+                try:
+                    os.link(expired_path, path)
+                except FileExistsError:
+                    pass
+                os.unlink(expired_path)
+                return False
+            _logger.warning("lease of task %s expired, taking it over", task_id)
+            os.unlink(expired_path)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(worker_id)
+        if self.is_done(task_id):
+            # finished between the listing and the lease
+            self.release(task_id, worker_id)
+            return False
+        if expired:
+            self.taken_over.add(task_id)
+        return True
+
+    def owns(self, task_id: str, worker_id: str) -> bool:
+        try:
+            with open(self._lease_path(task_id), 'r') as f:
+                return f.read() == worker_id
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        """Renews the lease, False if it was lost to another worker."""
+        try:
+            with open(self._lease_path(task_id), 'r') as f:
+                if f.read() != worker_id:
+                    return False
+            os.utime(self._lease_path(task_id))
+        except FileNotFoundError:
+            # moved away for a moment by a worker checking for expiry
+            pass
+        return True
+
+    def release(self, task_id: str, worker_id: str) -> None:
+        if self.owns(task_id, worker_id):
+            os.unlink(self._lease_path(task_id))
+
+    def complete(self, task_id: str, worker_id: str, status: str) -> None:
+        _atomic_write(self._done_path(task_id), json.dumps({
+            'worker': worker_id, 'status': status, 'time': time.time()}).encode())
+        self.release(task_id, worker_id)
+
+    def fail(self, task_id: str, worker_id: str) -> int:
+        """Records a failed attempt and releases the task so it runs
+        again, returns the number of failed attempts so far."""
+        path = os.path.join(self.failed_dir, task_id + '.log')
+        # appends of one short line are atomic, also between nodes
+        with open(path, 'a') as f:
+            f.write(worker_id + '\n')
+        with open(path, 'r') as f:
+            n_failures = len(f.read().splitlines())
+        self.release(task_id, worker_id)
+        return n_failures
+
+    def status(self) -> Dict[str, int]:
+        """Number of 'pending', 'running', 'expired' and 'done' tasks."""
+        ret = {'pending': 0, 'running': 0, 'expired': 0, 'done': 0}
+        for task_id in self.tasks():
+            if self.is_done(task_id):
+                ret['done'] += 1
+            elif not os.path.exists(self._lease_path(task_id)):
+                ret['pending'] += 1
+            elif self._lease_expired(self._lease_path(task_id)):
+                ret['expired'] += 1
+            else:
+                ret['running'] += 1
+        return ret
+
+    def _refresh(self) -> None:
+        done = {name[:-len('.json')] for name in os.listdir(self.done_dir)
+                if name.endswith('.json')}
+        self._pending = [task_id for task_id in self.tasks() if task_id not in done]
+        self._cursor = 0
+
+    def next_task(self, worker_id: str) -> Tuple[Optional[str], bool]:
+        """Leases the next runnable task.
+
+        The tasks not done are listed once and tried in order across calls,
+        and listed again after a pass, so a worker costs O(1) metadata
+        operations per task. Returns (task_id, False) on success, and
+        (None, True) if nothing could be leased but other workers still hold
+        leases that may expire.
+        """
+        if self._cursor >= len(self._pending):
+            self._refresh()
+        while self._cursor < len(self._pending):
+            task_id = self._pending[self._cursor]
+            self._cursor += 1
+            if self.acquire(task_id, worker_id):
+                return task_id, False
+        # a whole pass found nothing, the next call starts a new one
+        self._refresh()
+        return None, bool(self._pending)
+
+
+class _Heartbeat(object):
+
+    def __init__(self, queue: WorkQueue, task_id: str, worker_id: str) -> None:
+        self.queue = queue
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.queue.heartbeat_interval):
+            if not self.queue.heartbeat(self.task_id, self.worker_id):
+                _logger.warning("lost the lease of task %s", self.task_id)
+                return
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(auto_var, queue: WorkQueue, experiment_fn, with_hook: bool = True,
+               verbose: int = 0, allow_failure: bool = True, wait: bool = True,
+               poll_interval: float = 1., max_tasks: Optional[int] = None,
+               max_attempts: int = 3) -> int:
+    """Runs tasks of ``queue`` until all of them are done.
+
+    With ``wait`` the worker keeps polling while other workers hold leases,
+    so it can take over the tasks of crashed workers; the after hooks of the
+    crashed attempt are run with None first, e.g. so
+    remove_placeholder_if_error removes its placeholder. A task whose
+    experiment raised or timed out is released and run again, and marked
+    done as 'failed' after ``max_attempts`` failures. Without
+    ``allow_failure`` the error is raised after recording the attempt.
+    Returns the number of tasks this worker ran.
+    """
+    from .base import ExperimentTimeoutError
+    from .parallel import WorkerSnapshot, run_task
+
+    worker_id = '%s-%d-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    snapshot = WorkerSnapshot(
+        auto_var,
+        experiment_fn=experiment_fn,
+        with_hook=with_hook,
+        verbose=verbose,
+        allow_failure=False,
+    )
+    n_tasks = 0
+    while max_tasks is None or n_tasks < max_tasks:
+        task_id, waiting = queue.next_task(worker_id)
+        if task_id is None:
+            if not (wait and waiting):
+                break
+            time.sleep(poll_interval)
+            continue
+        params = queue.load(task_id)
+        _logger.info("%s running task %s", worker_id, task_id)
+        if task_id in queue.taken_over:
+            queue.taken_over.discard(task_id)
+            if with_hook:
+                auto_var._clean_up_killed([params])
+        error: Optional[BaseException] = None
+        try:
+            with _Heartbeat(queue, task_id, worker_id):
+                ret = run_task(snapshot, params)
+            if isinstance(ret, ExperimentTimeoutError):
+                error = ret
+        except Exception as e:  # pylint: disable=broad-except
+            error = e
+        except BaseException:
+            queue.release(task_id, worker_id)
+            raise
+        n_tasks += 1
+        if error is None:
+            if ret is None:
+                # the before hooks skipped the point, e.g. its result exists
+                _logger.warning("task %s was skipped by the before hooks", task_id)
+            queue.complete(task_id, worker_id, 'ok' if ret is not None else 'skipped')
+            continue
+        n_failures = queue.fail(task_id, worker_id)
+        _logger.error("task %s failed (attempt %d of %d): %r",
+                      task_id, n_failures, max_attempts, error)
+        if n_failures >= max_attempts:
+            queue.complete(task_id, worker_id, 'failed')
+        if not allow_failure:
+            raise error
+    return n_tasks
@@ -0,0 +1,109 @@
+"""
+Process-wide, on-demand probing of the environment an experiment runs in.
+"""
+from functools import lru_cache
+import os
+import socket
+from typing import Optional
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def find_git_dir(path: str) -> Optional[str]:
+    """The .git directory of the repository containing ``path``."""
+    path = os.path.abspath(path)
+    while True:
+        git_path = os.path.join(path, '.git')
+        if os.path.isdir(git_path):
+            return git_path
+        if os.path.isfile(git_path):
+            # worktrees and submodules: "gitdir: <path>"
+            with open(git_path, 'r') as f:
+                content = f.read().strip()
+            if content.startswith('gitdir:'):
+                return os.path.join(path, content[len('gitdir:'):].strip())
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read_ref(git_dir: str, ref: str) -> Optional[str]:
+    common_dir = git_dir
+    if os.path.isfile(os.path.join(git_dir, 'commondir')):
+        with open(os.path.join(git_dir, 'commondir'), 'r') as f:
+            common_dir = os.path.join(git_dir, f.read().strip())
+    for d in (git_dir, common_dir):
+        ref_file = os.path.join(d, ref)
+        if os.path.isfile(ref_file):
+            with open(ref_file, 'r') as f:
+                return f.read().strip()
+    packed_refs = os.path.join(common_dir, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        with open(packed_refs, 'r') as f:
+            for line in f:
+                parts = line.strip().split(' ')
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_git_hash(path: str = '.') -> Optional[str]:
+    """Commit hash of HEAD, read from the .git directory without loading
+    GitPython. Falls back to GitPython for layouts it does not handle."""
+    try:
+        git_dir = find_git_dir(path)
+        if git_dir is None:
+            return None
+        with open(os.path.join(git_dir, 'HEAD'), 'r') as f:
+            head = f.read().strip()
+        if not head.startswith('ref:'):
+            return head
+        sha = _read_ref(git_dir, head[len('ref:'):].strip())
+        if sha is not None:
+            return sha
+    except OSError:
+        pass
+    repo = get_repo(path)
+    if repo is None:
+        return None
+    try:
+        return repo.head.object.hexsha
+    except ValueError:
+        # repository without any commit
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_repo(path: str = '.'):
+    """GitPython Repo containing ``path``, None if there is none."""
+    import git
+    import git.exc
+    try:
+        return git.Repo(path, search_parent_directories=True)
+    except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_hostname() -> Optional[str]:
+    try:
+        return socket.gethostname()
+    except OSError:
+        return None
+
+
+def get_rss() -> Optional[int]:
+    """Current resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
@@ -0,0 +1,41 @@
+"""
+Expansion of grid parameters into the individual parameter dicts.
+"""
+from itertools import product
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Union
+
+from .cache import cache_key
+
+
+def iter_grid(grid_params: Union[Dict[str, List], List[Dict[str, List]]],
+              constraint: Optional[Callable[[Dict[str, Any]], bool]] = None,
+              dedupe: bool = False) -> Iterator[Dict[str, Any]]:
+    """Yields every combination of ``grid_params``, in the same order as
+    sklearn's ParameterGrid (keys sorted, last key varies fastest).
+
+    Combinations for which ``constraint(params)`` is false are skipped.
+    With ``dedupe`` a combination already yielded (by an earlier grid) is
+    skipped as well, only the hash of every point is kept for that.
+    """
+    if isinstance(grid_params, dict):
+        grid_params = [grid_params]
+    seen: Optional[Set[bytes]] = set() if dedupe else None
+    for grid in grid_params:
+        items = sorted(grid.items())
+        for k, v in items:
+            if isinstance(v, (str, bytes)) or not hasattr(v, '__iter__'):
+                raise TypeError(f'Parameter grid value for "{k}" is not a list: {v!r}')
+        if not items:
+            combinations: Iterator = iter([{}])
+        else:
+            keys, values = zip(*items)
+            combinations = (dict(zip(keys, c)) for c in product(*values))
+        for params in combinations:
+            if constraint is not None and not constraint(params):
+                continue
+            if seen is not None:
+                key = bytes.fromhex(cache_key(params))
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield params
@@ -2,26 +2,34 @@ import signal
 import sys
 import os
 import urllib.parse
-import tempfile
 import json
 import copy
-from typing import Dict, Tuple, List, Any, Callable, AnyStr
+from typing import Dict, Tuple, List, Any, Callable, AnyStr, NamedTuple, Set
 import logging
 
-import requests
 from mkdir_p import mkdir_p
-import joblib
 
 from ..base import ParameterAlreadyRanError
 from ..auto_var import AutoVar
+from ..cache import cache_key
+from .result_store import SQLiteResultStore, get_result_store
+from .formats import dump_result, load_result
+from .loader import load_results, read_result_file
+from .uploader import ResultUploader, get_session, get_uploader
 
 _logger = logging.getLogger(__name__)
 
+PLACEHOLDER_CONTENT = "placeholder, program still running"
+
 def get_ext(file_format: str) -> str:
     if file_format == 'json':
         return 'json'
     elif file_format == 'pickle':
         return 'pkl'
+    elif file_format in ('joblib', 'npz', 'msgpack'):
+        return file_format
+    elif file_format == 'sqlite':
+        return 'sqlite'
     else:
         raise ValueError(f"Not supported file format {file_format}")
 
@@ -37,6 +45,11 @@ def check_result_file_exist(auto_var, get_name_fn=None):
     if get_name_fn is None:
         get_name_fn = default_get_file_name
     unique_name = get_name_fn(auto_var)
+    if auto_var.settings["file_format"] == 'sqlite':
+        if get_result_store(auto_var).has_result(unique_name):
+            _logger.warning(f"{unique_name} exists")
+            raise ParameterAlreadyRanError("%s exists" % unique_name)
+        return
     unique_name = f'{unique_name}.{get_ext(auto_var.settings["file_format"])}'
     base_dir = auto_var.settings['result_file_dir']
     file_path = os.path.join(base_dir, unique_name)
@@ -48,36 +61,124 @@ def create_placeholder_file(auto_var, get_name_fn=None):
     if get_name_fn is None:
         get_name_fn = default_get_file_name
     unique_name = get_name_fn(auto_var)
+    if auto_var.settings["file_format"] == 'sqlite':
+        get_result_store(auto_var).save_placeholder(unique_name, auto_var.var_value)
+        return
     unique_name = f'{unique_name}.{get_ext(auto_var.settings["file_format"])}'
     base_dir = auto_var.settings['result_file_dir']
     file_path = os.path.join(base_dir, unique_name)
     with open(file_path, "w") as f:
-        f.write("placeholder, program still running")
+        f.write(PLACEHOLDER_CONTENT)
         
 def remove_placeholder_if_error(auto_var, ret, get_name_fn=None):
     if ret is None:
+        if get_name_fn is None:
+            get_name_fn = default_get_file_name
         unique_name = get_name_fn(auto_var)
+        if auto_var.settings["file_format"] == 'sqlite':
+            _logger.warning(f"removing {unique_name} ...")
+            get_result_store(auto_var).delete(unique_name)
+            return
         unique_name = f'{unique_name}.{get_ext(auto_var.settings["file_format"])}'
         base_dir = auto_var.settings['result_file_dir']
         file_path = os.path.join(base_dir, unique_name)
         _logger.warning(f"removing {file_path} ...")
         os.unlink(file_path)
 
+class ResultScan(NamedTuple):
+    completed: Set[str]
+    placeholders: Set[str]
+
+
+def scan_result_dir(auto_var, names=None) -> ResultScan:
+    """List the result files of result_file_dir in a single directory scan.
+
+    Returns the file names (without extension) of finished results and of
+    placeholders of runs still in progress. If ``names`` is given only
+    those names are checked for being a placeholder.
+    """
+    if auto_var.settings["file_format"] == 'sqlite':
+        return ResultScan(*get_result_store(auto_var).scan())
+    ext = '.' + get_ext(auto_var.settings["file_format"])
+    base_dir = auto_var.settings['result_file_dir']
+    completed: Set[str] = set()
+    placeholders: Set[str] = set()
+    if not os.path.isdir(base_dir):
+        return ResultScan(completed, placeholders)
+
+    placeholder_size = len(PLACEHOLDER_CONTENT)
+    with os.scandir(base_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(ext):
+                continue
+            name = entry.name[:-len(ext)]
+            if names is not None and name not in names:
+                continue
+            if entry.stat().st_size == placeholder_size:
+                with open(entry.path, 'rb') as f:
+                    if f.read() == PLACEHOLDER_CONTENT.encode():
+                        placeholders.add(name)
+                        continue
+            completed.add(name)
+    return ResultScan(completed, placeholders)
+
+
+def skip_completed_params(auto_var, params_list, get_name_fn=None,
+                          skip_placeholders=True):
+    """Before dispatch hook removing grid points whose result file exists.
+
+    Use the same get_name_fn as the other hooks, e.g.
+    ``AutoVar(before_dispatch_hooks=[partial(skip_completed_params, get_name_fn=fn)])``.
+    Placeholders belong to runs still in flight and are skipped as well
+    unless ``skip_placeholders`` is False. The counts are added to
+    ``auto_var.dispatch_stats`` as 'total', 'completed', 'placeholders' and
+    'pending'.
+    """
+    if get_name_fn is None:
+        get_name_fn = default_get_file_name
+    probe = copy.copy(auto_var)
+    names = []
+    for params in params_list:
+        probe.var_value = dict(auto_var.var_value)
+        probe.var_value.update(params)
+        names.append(get_name_fn(probe))
+
+    scan = scan_result_dir(auto_var, names=set(names))
+    pending = []
+    n_completed, n_placeholders = 0, 0
+    for params, name in zip(params_list, names):
+        if name in scan.completed:
+            n_completed += 1
+        elif name in scan.placeholders and skip_placeholders:
+            n_placeholders += 1
+        else:
+            pending.append(params)
+    _logger.warning("%d grid points: %d already completed, %d in progress "
+                    "(placeholder), %d pending.", len(params_list),
+                    n_completed, n_placeholders, len(pending))
+    stats = getattr(auto_var, 'dispatch_stats', None)
+    if stats is not None:
+        for k, n in [('total', len(params_list)), ('completed', n_completed),
+                     ('placeholders', n_placeholders), ('pending', len(pending))]:
+            stats[k] = stats.get(k, 0) + n
+    return pending
+
+
 def save_result_to_file(auto_var, ret, get_name_fn=None):
     if get_name_fn is None:
         get_name_fn = default_get_file_name
     base_dir = auto_var.settings['result_file_dir']
     file_format = auto_var.settings["file_format"]
     unique_name = get_name_fn(auto_var)
+    if file_format == 'sqlite':
+        get_result_store(auto_var).save(unique_name, auto_var.var_value, ret)
+        _logger.info("Finish writing %s to %s", unique_name,
+                     get_result_store(auto_var).path)
+        return
     output_file = os.path.join(base_dir, f'{unique_name}.{get_ext(file_format)}')
-    if file_format == 'json':
-        with open(output_file, "w") as f:
-            json.dump(ret, f)
-    elif file_format == 'pickle':
-        with open(output_file, "wb") as f:
-            joblib.dump(ret, f)
-    else:
-        raise ValueError(f"Not supported file format {file_format}")
+    dump_result(ret, output_file, file_format,
+                compression=auto_var.settings.get('result_compression', 'zlib'),
+                level=auto_var.settings.get('result_compression_level', 3))
     _logger.info("Finish writing to file %s", output_file)
 
 def save_parameter_to_file(auto_var, get_name_fn=None):
@@ -91,30 +192,71 @@ def save_parameter_to_file(auto_var, get_name_fn=None):
     _logger.info("Finish writing to file %s", output_file)
 
 def upload_result(auto_var, ret):
-    #files = {'file_field': json.dumps(ret)}
-    if auto_var.parameter_id is None:
+    """Queues ``ret`` for upload to settings['server_url'] in the background,
+    see ResultUploader."""
+    if getattr(auto_var, 'parameter_id', None) is None:
         raise ValueError
-    url = urllib.parse.urljoin(auto_var.settings['server_url'], 'upload_result')
-    payload = {}
-    payload['variable'] = auto_var.parameter_id
-
-    fp = tempfile.NamedTemporaryFile('w', delete=False)
-    json.dump(ret, fp)
-    fp.close()
-    files = {'file_field': open(fp.name, 'r')}
-
-    res = requests.post(url, data=payload, files=files)
-    print(res.content)
+    get_uploader(auto_var).put(auto_var.parameter_id, ret)
 
 def submit_parameter(auto_var):
     if auto_var.settings['server_url'] is None:
         raise ValueError
+    parameter_ids = getattr(auto_var, 'parameter_ids', None)
+    if parameter_ids:
+        parameter_id = parameter_ids.get(cache_key(auto_var.var_value))
+        if parameter_id is not None:
+            # assigned by submit_parameters before dispatch
+            auto_var.parameter_id = parameter_id
+            return None
     url = urllib.parse.urljoin(auto_var.settings['server_url'], 'submit_parameter')
     payload = copy.deepcopy(auto_var.var_value)
     #payload['unique_name'] = auto_var.generate_name()
-    res = requests.post(url, data=json.dumps(payload))
+    res = get_session().post(url, data=json.dumps(payload))
     response_content = json.loads(res.content)
     if response_content['has_result']:
         raise ParameterAlreadyRanError
     auto_var.parameter_id = response_content['id']
     return res
+
+def submit_parameters(auto_var, params_list, batch_size=1000):
+    """Before dispatch hook submitting every grid point to the server at once.
+
+    Points the server already has a result for are dropped. The ids of the
+    others are kept in ``auto_var.parameter_ids`` (by cache_key of the
+    var_value), where submit_parameter picks them up instead of asking the
+    server again, so keep submit_parameter in the before experiment hooks.
+    If the server has no submit_parameters endpoint, nothing is dropped and
+    every task asks on its own.
+    """
+    if auto_var.settings['server_url'] is None:
+        raise ValueError
+    url = urllib.parse.urljoin(auto_var.settings['server_url'], 'submit_parameters')
+    var_values = []
+    for params in params_list:
+        var_value = dict(auto_var.var_value)
+        var_value.update(params)
+        var_values.append(var_value)
+
+    responses = []
+    for i in range(0, len(var_values), batch_size):
+        res = get_session().post(url, data=json.dumps(
+            {'parameters': var_values[i:i + batch_size]}, default=repr))
+        if res.status_code == 404:
+            _logger.warning("%s has no submit_parameters, parameters are "
+                            "submitted by each task", auto_var.settings['server_url'])
+            return params_list
+        res.raise_for_status()
+        responses += json.loads(res.content)['results']
+
+    # streamed grids call the hook once per chunk, keep the earlier ids
+    auto_var.parameter_ids = getattr(auto_var, 'parameter_ids', None) or {}
+    pending = []
+    for params, var_value, response in zip(params_list, var_values, responses):
+        if response['has_result']:
+            continue
+        auto_var.parameter_ids[cache_key(var_value)] = response['id']
+        pending.append(params)
+    _logger.warning("%d grid points: %d already have a result on the server, "
+                    "%d pending.", len(params_list), len(params_list) - len(pending),
+                    len(pending))
+    return pending
@@ -0,0 +1,172 @@
+"""
+Writers and readers of the result file formats of save_result_to_file.
+
+- ``json``: numpy arrays and scalars are written as lists and numbers.
+- ``pickle``: uncompressed joblib pickle.
+- ``joblib``: joblib pickle compressed with any codec joblib knows
+  ('zlib', 'gzip', 'bz2', 'lzma', 'xz', 'lz4').
+- ``npz``: every numpy array is its own ``.npy`` member of a zip archive
+  compressed with 'zlib', 'bz2', 'lzma' or None, the rest of the result is
+  kept as JSON in the ``__json__`` member. Readable without pickle, and
+  only the arrays of the requested fields are decompressed.
+- ``msgpack``: msgpack with numpy arrays as an extension type holding the
+  raw buffer (needs the msgpack package).
+"""
+import json
+import pickle
+import struct
+import sys
+import zipfile
+from typing import Any, Dict, List, Optional
+import logging
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+_logger = logging.getLogger(__name__)
+
+_NDARRAY_KEY = '__ndarray__'
+_JSON_MEMBER = '__json__'
+_MSGPACK_NDARRAY = 1
+
+_ZIP_COMPRESSION = {
+    None: zipfile.ZIP_STORED,
+    'zlib': zipfile.ZIP_DEFLATED,
+    'bz2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+
+def _to_builtin(obj):
+    """json/msgpack fallback for numpy arrays and scalars."""
+    import numpy as np
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def _is_plain_array(obj) -> bool:
+    import numpy as np
+    return isinstance(obj, np.ndarray) and not obj.dtype.hasobject \
+        and obj.dtype.fields is None
+
+
+def _dump_npz(ret, path: str, compression: Optional[str], level: Optional[int]) -> None:
+    import numpy as np
+    arrays: Dict[str, Any] = {}
+
+    def default(obj):
+        if _is_plain_array(obj):
+            name = 'arr_%d' % len(arrays)
+            arrays[name] = obj
+            return {_NDARRAY_KEY: name}
+        return _to_builtin(obj)
+
+    skeleton = json.dumps(ret, default=default).encode()
+    kwargs: Dict[str, Any] = {}
+    if sys.version_info >= (3, 7):
+        # Python 3.6 always uses the default level of the codec
+        kwargs['compresslevel'] = level
+    with zipfile.ZipFile(path, 'w', compression=_ZIP_COMPRESSION[compression],
+                         **kwargs) as zf:
+        with zf.open(_JSON_MEMBER + '.npy', 'w') as f:
+            np.lib.format.write_array(f, np.frombuffer(skeleton, dtype=np.uint8))
+        for name, arr in arrays.items():
+            with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, arr, allow_pickle=False)
+
+
+def _load_npz(path: str, fields: Optional[List[str]] = None):
+    import numpy as np
+    with np.load(path, allow_pickle=False) as npz:
+        ret = json.loads(bytes(npz[_JSON_MEMBER]).decode())
+        if fields is not None and isinstance(ret, dict):
+            ret = {k: v for k, v in ret.items() if k == 'var_value' or k in fields}
+
+        def resolve(obj):
+            if isinstance(obj, dict):
+                if len(obj) == 1 and _NDARRAY_KEY in obj:
+                    return npz[obj[_NDARRAY_KEY]]
+                return {k: resolve(v) for k, v in obj.items()}
+            if isinstance(obj, list):
+                return [resolve(v) for v in obj]
+            return obj
+
+        return resolve(ret)
+
+
+def _msgpack_default(obj):
+    import numpy as np
+    if _is_plain_array(obj):
+        obj = np.ascontiguousarray(obj)
+        return msgpack.ExtType(_MSGPACK_NDARRAY, msgpack.packb(
+            [obj.dtype.str, list(obj.shape), obj.data], use_bin_type=True))
+    return _to_builtin(obj)
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    import numpy as np
+    if code != _MSGPACK_NDARRAY:
+        return msgpack.ExtType(code, data)
+    dtype, shape, buf = msgpack.unpackb(data, raw=False)
+    return np.frombuffer(buf, dtype=np.dtype(dtype)).reshape(shape).copy()
+
+
+def _require_msgpack() -> None:
+    if msgpack is None:
+        raise ImportError("file_format 'msgpack' needs the msgpack package "
+                          "(pip install autovar[msgpack])")
+
+
+def dump_result(ret, path: str, file_format: str,
+                compression: Optional[str] = 'zlib', level: Optional[int] = 3) -> None:
+    """Writes ``ret`` to ``path``. ``compression`` and ``level`` are used by
+    the 'joblib' and 'npz' formats, None writes them uncompressed."""
+    if file_format == 'json':
+        with open(path, 'w') as f:
+            json.dump(ret, f, default=_to_builtin)
+    elif file_format == 'pickle':
+        import joblib
+        with open(path, 'wb') as f:
+            joblib.dump(ret, f)
+    elif file_format == 'joblib':
+        import joblib
+        joblib.dump(ret, path, compress=(compression, level) if compression else 0)
+    elif file_format == 'npz':
+        if compression not in _ZIP_COMPRESSION:
+            raise ValueError(f"Not supported npz compression {compression}")
+        _dump_npz(ret, path, compression, level)
+    elif file_format == 'msgpack':
+        _require_msgpack()
+        with open(path, 'wb') as f:
+            f.write(msgpack.packb(ret, default=_msgpack_default, use_bin_type=True))
+    else:
+        raise ValueError(f"Not supported file format {file_format}")
+
+
+def load_result(path: str, file_format: str, fields: Optional[List[str]] = None):
+    """Reads a result written by dump_result. With ``fields`` the 'npz'
+    format only loads the arrays of those fields (and var_value); the other
+    formats return everything."""
+    if file_format == 'json':
+        with open(path, 'r') as f:
+            return json.load(f)
+    elif file_format in ('pickle', 'joblib'):
+        import joblib
+        try:
+            return joblib.load(path)
+        except (KeyError, IndexError, struct.error) as e:
+            # how the pure Python unpickler of joblib fails on corrupt data
+            raise pickle.UnpicklingError(f"{path} is corrupt: {e!r}") from e
+    elif file_format == 'npz':
+        return _load_npz(path, fields)
+    elif file_format == 'msgpack':
+        _require_msgpack()
+        with open(path, 'rb') as f:
+            return msgpack.unpackb(f.read(), ext_hook=_msgpack_ext_hook,
+                                   raw=False, strict_map_key=False)
+    raise ValueError(f"Not supported file format {file_format}")
@@ -0,0 +1,155 @@
+import os
+import pickle
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from .formats import load_result
+
+_logger = logging.getLogger(__name__)
+
+_SNAPSHOT_VERSION = 1
+
+
+def flatten_result(name: Optional[str], ret: Dict[str, Any],
+                   fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """One table row: the run name, every variable of ``var_value`` as its
+    own column and the selected result fields."""
+    row: Dict[str, Any] = {'name': name}
+    row.update(ret.get('var_value', {}) or {})
+    for k, v in ret.items():
+        if k == 'var_value':
+            continue
+        if fields is None or k in fields:
+            row[k] = v
+    return row
+
+
+def read_result_file(path: str, file_format: str, fields: Optional[List[str]] = None):
+    """Load a result written by save_result_to_file, None for placeholders
+    and unreadable files. With ``fields`` the npz format only reads the
+    arrays of those fields."""
+    from . import PLACEHOLDER_CONTENT
+    try:
+        if os.path.getsize(path) == len(PLACEHOLDER_CONTENT):
+            with open(path, 'rb') as f:
+                if f.read() == PLACEHOLDER_CONTENT.encode():
+                    return None
+        return load_result(path, file_format, fields)
+    except (ValueError, EOFError, OSError, pickle.UnpicklingError,
+            zipfile.BadZipFile) as e:
+        _logger.warning(f"unable to read {path}: {e}")
+        return None
+
+
+def _read_rows(paths: List[Tuple[str, str]], file_format: str,
+               fields: Optional[List[str]]) -> List[Tuple[str, Optional[Dict]]]:
+    ret: List[Tuple[str, Optional[Dict]]] = []
+    for name, path in paths:
+        result = read_result_file(path, file_format, fields)
+        if not isinstance(result, dict):
+            ret.append((name, None))
+        else:
+            ret.append((name, flatten_result(name, result, fields)))
+    return ret
+
+
+def _list_result_files(result_file_dir: str, ext: str, exclude: Optional[str] = None
+                       ) -> Dict[str, Tuple[str, Tuple[int, int]]]:
+    files = {}
+    if exclude is not None:
+        exclude = os.path.abspath(exclude)
+    with os.scandir(result_file_dir) as it:
+        for entry in it:
+            if entry.name.endswith(ext) and entry.is_file() \
+                    and os.path.abspath(entry.path) != exclude:
+                st = entry.stat()
+                files[entry.name[:-len(ext)]] = (entry.path, (st.st_mtime_ns, st.st_size))
+    return files
+
+
+def load_results(result_file_dir: str, file_format: str = 'json',
+                 fields: Optional[List[str]] = None,
+                 snapshot_file: Optional[str] = None,
+                 n_jobs: int = -1, backend: Optional[str] = None,
+                 batch_size: int = 256, sqlite_path: Optional[str] = None):
+    """Read every result of ``result_file_dir`` into a pandas DataFrame.
+
+    There is one row per run, named like the result file, with one
+    column per variable of var_value and one per result field (only
+    ``fields`` if given). Files are read in parallel in batches of
+    ``batch_size``. Placeholders and unreadable files are skipped.
+
+    If ``snapshot_file`` is given, the table and the (mtime, size) of every
+    file read are kept there. The next call only reads files that are new
+    or changed, and drops rows whose file was removed.
+    """
+    import pandas as pd
+    from . import get_ext
+
+    if file_format == 'sqlite':
+        from .result_store import SQLiteResultStore
+        if sqlite_path is None:
+            sqlite_path = os.path.join(result_file_dir, 'results.sqlite')
+        store = SQLiteResultStore(sqlite_path)
+        rows = [flatten_result(None, ret, fields) for _, ret in store.query()
+                if isinstance(ret, dict)]
+        store.close()
+        df = pd.DataFrame(rows)
+        return df.drop(columns=['name']) if 'name' in df else df
+
+    # the snapshot may be a .pkl file among the pickle results
+    files = _list_result_files(result_file_dir, '.' + get_ext(file_format),
+                               exclude=snapshot_file)
+
+    snapshot = None
+    if snapshot_file is not None and os.path.exists(snapshot_file):
+        snapshot = pd.read_pickle(snapshot_file)
+        if snapshot.get('version') != _SNAPSHOT_VERSION \
+                or snapshot.get('fields') != fields \
+                or snapshot.get('file_format') != file_format:
+            snapshot = None
+
+    known: Dict[str, Tuple[int, int]] = {}
+    old_df = None
+    if snapshot is not None:
+        known = snapshot['files']
+        old_df = snapshot['df']
+    to_read = sorted((name, path) for name, (path, stat) in files.items()
+                     if known.get(name) != stat)
+    stale = {name for name in known if name not in files or known[name] != files[name][1]}
+
+    batches = [to_read[i:i + batch_size] for i in range(0, len(to_read), batch_size)]
+    if len(batches) > 1:
+        from joblib import Parallel, delayed
+        outputs = Parallel(n_jobs=n_jobs, backend=backend)(
+            delayed(_read_rows)(batch, file_format, fields) for batch in batches)
+    else:
+        outputs = [_read_rows(batch, file_format, fields) for batch in batches]
+
+    new_rows = [row for output in outputs for _, row in output if row is not None]
+    _logger.info("read %d result files, %d reused from snapshot",
+                 len(to_read), len(known) - len(stale))
+
+    frames = []
+    if old_df is not None and len(old_df):
+        frames.append(old_df[~old_df['name'].isin(stale)])
+    if new_rows:
+        frames.append(pd.DataFrame(new_rows))
+    if frames:
+        df = pd.concat(frames, ignore_index=True, sort=False)
+    else:
+        df = pd.DataFrame(columns=['name'])
+    df = df.sort_values('name').reset_index(drop=True)
+
+    if snapshot_file is not None:
+        tmp_file = snapshot_file + '.tmp'
+        pd.to_pickle({
+            'version': _SNAPSHOT_VERSION,
+            'fields': fields,
+            'file_format': file_format,
+            'files': {name: stat for name, (_, stat) in files.items()},
+            'df': df,
+        }, tmp_file)
+        os.replace(tmp_file, snapshot_file)
+    return df
@@ -0,0 +1,147 @@
+"""
+Minimal in-memory implementation of the result server protocol used by
+the server hooks, for tests and local runs.
+
+Endpoints (relative to the server url):
+
+- ``submit_parameter``: body is the JSON var_value, answers
+  ``{"id": ..., "has_result": ...}``.
+- ``submit_parameters``: JSON body ``{"parameters": [var_value, ...]}``,
+  answers ``{"results": [{"id": ..., "has_result": ...}, ...]}`` in the
+  same order.
+- ``upload_result``: multipart form with ``variable`` (the parameter id)
+  and ``file_field`` (the JSON result).
+- ``upload_results``: JSON body ``{"results": [{"variable": id,
+  "result": ...}, ...]}``, answers ``{"n_saved": ...}``.
+"""
+import email.parser
+import email.policy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def _parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+    fields: Dict[str, bytes] = {}
+    for part in message.iter_parts():
+        name = str(part.get_param('name', header='content-disposition'))
+        payload = part.get_payload(decode=True)
+        if isinstance(payload, bytes):
+            fields[name] = payload
+    return fields
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ReferenceServer(object):
+    """Serves the result server protocol from a background thread.
+
+    ``url`` is the base url to put in settings['server_url']. Parameters
+    and results are kept in memory; ``requests`` counts the requests per
+    endpoint and ``fail_next`` makes the next requests answer 503.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.parameters: Dict[str, int] = {}
+        self.var_values: List[Dict[str, Any]] = []
+        self.results: Dict[int, Any] = {}
+        self.requests: Dict[str, int] = {}
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        self._httpd = _ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f'http://{host}:{port}/'
+
+    def start(self) -> "ReferenceServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "ReferenceServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def submit_parameter(self, var_value: Dict[str, Any]) -> Dict[str, Any]:
+        key = json.dumps(var_value, sort_keys=True)
+        with self._lock:
+            if key not in self.parameters:
+                self.parameters[key] = len(self.var_values)
+                self.var_values.append(var_value)
+            parameter_id = self.parameters[key]
+            return {'id': parameter_id, 'has_result': parameter_id in self.results}
+
+    def save_result(self, parameter_id, result) -> None:
+        with self._lock:
+            self.results[int(parameter_id)] = result
+
+    def _handle(self, endpoint: str, content_type: str, body: bytes) -> Tuple[int, Any]:
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return 503, {'error': 'unavailable'}
+        if endpoint == 'submit_parameter':
+            return 200, self.submit_parameter(json.loads(body))
+        elif endpoint == 'submit_parameters':
+            return 200, {'results': [self.submit_parameter(var_value)
+                                     for var_value in json.loads(body)['parameters']]}
+        elif endpoint == 'upload_result':
+            fields = _parse_multipart(content_type, body)
+            self.save_result(fields['variable'].decode(), json.loads(fields['file_field']))
+            return 200, {'n_saved': 1}
+        elif endpoint == 'upload_results':
+            results = json.loads(body)['results']
+            for item in results:
+                self.save_result(item['variable'], item['result'])
+            return 200, {'n_saved': len(results)}
+        return 404, {'error': f'unknown endpoint {endpoint}'}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+                try:
+                    status, content = server._handle(
+                        endpoint, self.headers.get('Content-Type', ''), body)
+                except Exception as e:  # pylint: disable=broad-except
+                    _logger.exception("error handling %s", self.path)
+                    status, content = 400, {'error': repr(e)}
+                data = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                _logger.debug(format, *args)
+
+        return Handler
@@ -0,0 +1,194 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import logging
+
+_logger = logging.getLogger(__name__)
+
+_VAR_PREFIX = 'var_'
+
+
+def _quote(identifier: str) -> str:
+    return '"%s"' % identifier.replace('"', '""')
+
+
+def _to_column_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return json.dumps(value, sort_keys=True, default=repr)
+
+
+class SQLiteResultStore(object):
+    """Append-only result store in a single SQLite database.
+
+    Every run is one row keyed by its unique name (the same name the file
+    hooks would use). Each variable is an indexed column ``var_<name>``, and
+    the result is a pickled blob. A row with a NULL result is a
+    placeholder for a run still in progress. The database is in WAL mode
+    and every write takes the write lock up front, so several
+    run_grid_params workers can write to it concurrently.
+    """
+
+    def __init__(self, path: str, table: str = 'results',
+                 timeout: float = 60.) -> None:
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        self._local = threading.local()
+        self._columns: Set[str] = set()
+
+    def __getstate__(self):
+        return {'path': self.path, 'table': self.table, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, '
+                'created REAL, result BLOB)' % _quote(self.table))
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._columns = set()
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _load_columns(self) -> Set[str]:
+        rows = self.connection.execute(
+            'PRAGMA table_info(%s)' % _quote(self.table)).fetchall()
+        self._columns = {r[1] for r in rows}
+        return self._columns
+
+    def _ensure_columns(self, var_names) -> None:
+        """Add missing variable columns, must hold the write lock."""
+        columns = [_VAR_PREFIX + k for k in var_names]
+        if all(c in self._columns for c in columns):
+            return
+        existing = self._load_columns()
+        for column in columns:
+            if column in existing:
+                continue
+            self.connection.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                _quote(self.table), _quote(column)))
+            self.connection.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                _quote('idx_%s_%s' % (self.table, column)),
+                _quote(self.table), _quote(column)))
+            self._columns.add(column)
+
+    def _write(self, name: str, var_value: Dict[str, Any], blob) -> None:
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._ensure_columns(var_value.keys())
+            columns = ['name', 'created', 'result'] + \
+                [_VAR_PREFIX + k for k in var_value.keys()]
+            values = [name, time.time(), blob] + \
+                [_to_column_value(v) for v in var_value.values()]
+            conn.execute('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                _quote(self.table), ', '.join(_quote(c) for c in columns),
+                ', '.join('?' * len(columns))), values)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def save(self, name: str, var_value: Dict[str, Any], ret) -> None:
+        blob = sqlite3.Binary(pickle.dumps(ret, protocol=pickle.HIGHEST_PROTOCOL))
+        self._write(name, var_value, blob)
+
+    def save_placeholder(self, name: str, var_value: Dict[str, Any]) -> None:
+        self._write(name, var_value, None)
+
+    def delete(self, name: str) -> None:
+        self.connection.execute(
+            'DELETE FROM %s WHERE name = ?' % _quote(self.table), (name,))
+
+    def has_result(self, name: str, include_placeholder: bool = True) -> bool:
+        sql = 'SELECT 1 FROM %s WHERE name = ?' % _quote(self.table)
+        if not include_placeholder:
+            sql += ' AND result IS NOT NULL'
+        return self.connection.execute(sql, (name,)).fetchone() is not None
+
+    def scan(self) -> Tuple[Set[str], Set[str]]:
+        """Names of the finished runs and of the placeholders."""
+        completed: Set[str] = set()
+        placeholders: Set[str] = set()
+        for name, is_placeholder in self.connection.execute(
+                'SELECT name, result IS NULL FROM %s' % _quote(self.table)):
+            (placeholders if is_placeholder else completed).add(name)
+        return completed, placeholders
+
+    def _where(self, filters: Dict[str, Any]) -> Tuple[str, List]:
+        existing = self._load_columns()
+        clauses, values = ['result IS NOT NULL'], []
+        for k, v in filters.items():
+            column = _VAR_PREFIX + k
+            if column not in existing:
+                # no run ever had this variable
+                clauses.append('0')
+                continue
+            if isinstance(v, (list, tuple, set)):
+                clauses.append('%s IN (%s)' % (_quote(column), ', '.join('?' * len(v))))
+                values += [_to_column_value(i) for i in v]
+            else:
+                clauses.append('%s = ?' % _quote(column))
+                values.append(_to_column_value(v))
+        return ' AND '.join(clauses), values
+
+    def count(self, **filters) -> int:
+        where, values = self._where(filters)
+        return self.connection.execute('SELECT COUNT(*) FROM %s WHERE %s' % (
+            _quote(self.table), where), values).fetchone()[0]
+
+    def query(self, load_result: bool = True,
+              **filters) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """Yields (var_value, result) for the runs matching ``filters``.
+
+        Filters are variable name to value, or to a list of accepted
+        values. Only the matching rows are read and unpickled; with
+        ``load_result=False`` the result is None and no blob is read.
+        """
+        where, values = self._where(filters)
+        var_columns = sorted(c for c in self._columns if c.startswith(_VAR_PREFIX))
+        selected = var_columns + (['result'] if load_result else [])
+        cursor = self.connection.execute('SELECT %s FROM %s WHERE %s' % (
+            ', '.join(_quote(c) for c in selected), _quote(self.table), where), values)
+        for row in cursor:
+            var_value = {c[len(_VAR_PREFIX):]: v for c, v
+                         in zip(var_columns, row) if v is not None}
+            result = pickle.loads(row[-1]) if load_result else None
+            yield var_value, result
+
+
+_stores: Dict[str, SQLiteResultStore] = {}
+
+
+def get_result_store(auto_var) -> SQLiteResultStore:
+    """Store used when settings['file_format'] is 'sqlite'.
+
+    The database is settings['sqlite_path'], by default results.sqlite in
+    result_file_dir.
+    """
+    path = auto_var.settings.get('sqlite_path')
+    if path is None:
+        path = os.path.join(auto_var.settings['result_file_dir'], 'results.sqlite')
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = SQLiteResultStore(path)
+    return store
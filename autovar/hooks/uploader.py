@@ -0,0 +1,217 @@
+import json
+import multiprocessing.util
+import os
+import signal
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import urllib.parse
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ResultUploader(object):
+    """Uploads results to the result server from a background thread.
+
+    ``put`` only serializes the result and queues it, so the experiment
+    never waits on the network. The thread drains everything queued so
+    far into one ``upload_results`` request (at most ``batch_size``
+    results) over a pooled ``requests.Session``. Failed requests are
+    retried ``max_retries`` times with exponential backoff starting at
+    ``backoff`` seconds. If the server has no ``upload_results`` endpoint,
+    results are sent one by one to ``upload_result``.
+
+    The queue is flushed when the process exits, including multiprocessing
+    and joblib workers.
+    """
+
+    def __init__(self, server_url: str, batch_size: int = 64,
+                 max_retries: int = 5, backoff: float = 0.5,
+                 timeout: float = 30.) -> None:
+        self.server_url = server_url
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.n_uploaded = 0
+        self.n_failed = 0
+        self._items: Deque[Optional[Tuple[Any, str]]] = deque()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._thread: Optional[threading.Thread] = None
+        self._session: Any = None
+        self._batch_endpoint = True
+        self._closed = False
+        # runs at interpreter exit and at the end of multiprocessing workers
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def put(self, parameter_id, ret) -> None:
+        result = json.dumps(ret)
+        with self._cond:
+            if self._closed:
+                raise ValueError("uploader is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='autovar-uploader', daemon=True)
+                self._thread.start()
+            self._items.append((parameter_id, result))
+            self._pending += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything queued is uploaded (or given up on).
+
+        Returns False if ``timeout`` expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._items.append(None)
+                self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                _logger.error("%d results were not uploaded to %s",
+                              self._pending, self.server_url)
+        if self._session is not None:
+            self._session.close()
+
+    def _next_batch(self) -> Tuple[List[Tuple[Any, str]], bool]:
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            batch: List[Tuple[Any, str]] = []
+            while self._items and len(batch) < self.batch_size:
+                item = self._items.popleft()
+                if item is None:
+                    return batch, True
+                batch.append(item)
+            return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                self._send(batch)
+            with self._cond:
+                self._pending -= len(batch)
+                self._cond.notify_all()
+
+    def _send(self, batch: List[Tuple[Any, str]]) -> None:
+        import requests
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._post(batch)
+                self.n_uploaded += len(batch)
+                return
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                retry = response is None or response.status_code >= 500
+                if not retry or attempt == self.max_retries:
+                    _logger.error("failed to upload %d results to %s: %s",
+                                  len(batch), self.server_url, e)
+                    self.n_failed += len(batch)
+                    return
+                delay = self.backoff * 2 ** attempt
+                _logger.warning("upload to %s failed (%s), retrying in %.1fs",
+                                self.server_url, e, delay)
+                time.sleep(delay)
+
+    def _post(self, batch: List[Tuple[Any, str]]) -> None:
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        if self._batch_endpoint:
+            url = urllib.parse.urljoin(self.server_url, 'upload_results')
+            body = '{"results": [%s]}' % ', '.join(
+                '{"variable": %s, "result": %s}' % (json.dumps(parameter_id), result)
+                for parameter_id, result in batch)
+            res = self._session.post(url, data=body.encode(), timeout=self.timeout,
+                                     headers={'Content-Type': 'application/json'})
+            if res.status_code != 404:
+                res.raise_for_status()
+                return
+            _logger.info("%s has no upload_results, uploading one by one", self.server_url)
+            self._batch_endpoint = False
+        url = urllib.parse.urljoin(self.server_url, 'upload_result')
+        for parameter_id, result in batch:
+            res = self._session.post(
+                url, data={'variable': parameter_id}, timeout=self.timeout,
+                files={'file_field': ('result.json', result)})
+            res.raise_for_status()
+
+
+_sessions: Dict[Tuple[int, int], Any] = {}
+
+
+def get_session():
+    """requests.Session of the calling process and thread, so the
+    synchronous server hooks reuse their connections."""
+    key = (os.getpid(), threading.get_ident())
+    session = _sessions.get(key)
+    if session is None:
+        import requests
+        session = _sessions[key] = requests.Session()
+    return session
+
+
+_uploaders: Dict[Tuple[int, str], ResultUploader] = {}
+_previous_handlers: Dict[int, Any] = {}
+
+
+def _close_uploaders(signum, frame) -> None:
+    for uploader in list(_uploaders.values()):
+        uploader.close()
+    previous = _previous_handlers.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def _install_signal_handler(signum) -> None:
+    if signum in _previous_handlers \
+            or threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signum)
+    if previous is signal.SIG_IGN:
+        return
+    _previous_handlers[signum] = previous
+    signal.signal(signum, _close_uploaders)
+
+
+def get_uploader(auto_var) -> ResultUploader:
+    """Uploader of this process for settings['server_url'].
+
+    settings['upload_batch_size'], settings['upload_max_retries'] and
+    settings['upload_backoff'] override the ResultUploader defaults. The
+    queue is also flushed on SIGTERM.
+    """
+    server_url = auto_var.settings['server_url']
+    key = (os.getpid(), server_url)
+    uploader = _uploaders.get(key)
+    if uploader is None:
+        kwargs = {}
+        for name in ['batch_size', 'max_retries', 'backoff']:
+            if 'upload_' + name in auto_var.settings:
+                kwargs[name] = auto_var.settings['upload_' + name]
+        uploader = _uploaders[key] = ResultUploader(server_url, **kwargs)
+        _install_signal_handler(signal.SIGTERM)
+    return uploader
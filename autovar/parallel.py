@@ -0,0 +1,199 @@
+"""
+Helpers for dispatching experiments to joblib workers.
+"""
+import copy
+import pickle
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from .base import ExperimentTimeoutError
+from .cache import cache_key
+
+_logger = logging.getLogger(__name__)
+
+_options: Optional[Tuple[str, Dict[str, Any]]] = None
+
+
+class WorkerSnapshot(object):
+    """Picklable frozen copy of an AutoVar and the run options.
+
+    The AutoVar (without its git repo handle) and the options are
+    cloudpickled once into bytes, which is all that pickling the snapshot
+    ships, so any joblib backend can carry it and joblib sends it once per
+    batch of tasks. Every task gets its own AutoVar unpickled from those
+    bytes, so nothing a task changes is seen by the next one. The options
+    are unpickled once per process.
+    """
+
+    def __init__(self, auto_var, **options) -> None:
+        try:
+            import cloudpickle
+        except ImportError:
+            from joblib.externals import cloudpickle  # type: ignore
+        self.token = uuid.uuid4().hex
+        state = copy.copy(auto_var)
+        state._repo = None
+        # the profile sink is called in the parent as results come back
+        state.profile_sink = None
+        state.cost_model = None
+        state.inter_var = {}
+        self.payload = cloudpickle.dumps(state)
+        self.options_payload = cloudpickle.dumps(options)
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        global _options
+        loaded = _options
+        if loaded is None or loaded[0] != self.token:
+            loaded = (self.token, pickle.loads(self.options_payload))
+            # only the options of the latest snapshot are kept
+            _options = loaded
+        return loaded[1]
+
+    def get(self):
+        """A fresh copy of the AutoVar for one task."""
+        return pickle.loads(self.payload)
+
+
+def run_task(snapshot: WorkerSnapshot, params: Dict[str, Any]):
+    """Run one grid point on the AutoVar held by ``snapshot``."""
+    auto_var = snapshot.get()
+    options = snapshot.options
+    auto_var.set_variable_value_by_dict(params)
+    if options['verbose']:
+        _logger.info("Running parameter:" + str(params))
+    try:
+        results = auto_var.run_single_experiment(
+            options['experiment_fn'],
+            with_hook=options['with_hook'],
+            verbose=options['verbose'],
+            timeout=options.get('timeout'),
+            cpu_timeout=options.get('cpu_timeout'),
+        )
+    except ExperimentTimeoutError as e:
+        # handed back so the parent can record the point as timed out
+        _logger.error("Timeout with " + str(params) + ": " + str(e))
+        results = e
+    except Exception as e:
+        if options['allow_failure']:
+            _logger.error("Error with " + str(params))
+        else:
+            raise e
+        results = None
+
+    return results
+
+
+def run_batch(snapshot: WorkerSnapshot,
+              group: List[Tuple[int, Dict[str, Any]]]) -> List[Tuple[int, Any]]:
+    """Run the grid points of ``group`` with one call of a batched experiment."""
+    auto_var = snapshot.get()
+    options = snapshot.options
+    params_list = [params for _, params in group]
+    if options['verbose']:
+        _logger.info("Running batch:" + str(params_list))
+    try:
+        results = auto_var.run_batched_experiment(
+            options['experiment_fn'], params_list,
+            with_hook=options['with_hook'],
+            verbose=options['verbose'],
+            timeout=options.get('timeout'),
+            cpu_timeout=options.get('cpu_timeout'),
+        )
+    except ExperimentTimeoutError as e:
+        _logger.error("Timeout with batch " + str(params_list) + ": " + str(e))
+        results = [e] * len(group)
+    except Exception as e:
+        if options['allow_failure']:
+            _logger.error("Error with batch " + str(params_list))
+        else:
+            raise e
+        results = [None] * len(group)
+    return [(i, ret) for (i, _), ret in zip(group, results)]
+
+
+def run_group(snapshot: WorkerSnapshot,
+              group: List[Tuple[int, Dict[str, Any]]]) -> List[Tuple[int, Any]]:
+    """Run the grid points of ``group`` one after another in this worker,
+    or as one batch for a batched experiment."""
+    if snapshot.options.get('batched'):
+        return run_batch(snapshot, group)
+    return [(i, run_task(snapshot, params)) for i, params in group]
+
+
+def affinity_key(auto_var, params: Dict[str, Any]) -> Tuple:
+    """Values of the cached variables ``params`` needs, with their
+    required_vars, i.e. what decides which cache_outputs files it loads."""
+    var_value = dict(auto_var.var_value)
+    var_value.update(params)
+    key = set()
+    for var_name, argument in params.items():
+        compiled = auto_var._compiled.get(var_name)
+        if compiled is None:
+            continue
+        resolved = compiled.resolve(argument)
+        if resolved is None or resolved.cache_dir is None:
+            continue
+        key.add((var_name, argument))
+        for var in (resolved.required_vars or []):
+            key.add((var, repr(var_value.get(var))))
+    return tuple(sorted(key))
+
+
+def schedule_tasks(auto_var, params_list: List[Dict[str, Any]],
+                   schedule: str = 'grid', n_jobs: int = 1) -> List[List[int]]:
+    """Split the indices of ``params_list`` into tasks.
+
+    'grid' makes one task per point in grid order. 'locality' puts the
+    points sharing the same cached variables into one task, largest first,
+    so each worker loads a cached output once and reuses it; groups larger
+    than an even share of the ``n_jobs`` workers are split into chunks of
+    that size, and points needing no cached variable stay one-point tasks.
+    'lpt' makes one task per point, longest predicted running time first
+    according to ``auto_var.cost_model``, or grid order without history.
+    """
+    if schedule == 'grid':
+        return [[i] for i in range(len(params_list))]
+    elif schedule == 'lpt':
+        model = auto_var.cost_model
+        if len(model) == 0:
+            _logger.info("no running time history, using grid order")
+            return [[i] for i in range(len(params_list))]
+        costs = []
+        for params in params_list:
+            var_value = dict(auto_var.var_value)
+            var_value.update(params)
+            costs.append(model.predict(var_value))
+        return [[i] for i in sorted(range(len(params_list)), key=lambda i: -costs[i])]
+    elif schedule == 'locality':
+        from joblib import effective_n_jobs
+        chunk_size = max(1, -(-len(params_list) // effective_n_jobs(n_jobs)))
+        groups: Dict[Tuple, List[int]] = {}
+        tasks: List[List[int]] = []
+        for i, params in enumerate(params_list):
+            key = affinity_key(auto_var, params)
+            if key:
+                groups.setdefault(key, []).append(i)
+            else:
+                tasks.append([i])
+        for group in groups.values():
+            tasks += [group[j:j + chunk_size] for j in range(0, len(group), chunk_size)]
+        return sorted(tasks, key=len, reverse=True)
+    else:
+        raise ValueError(f"Not supported schedule {schedule}")
+
+
+def batch_tasks(params_list: List[Dict[str, Any]], batch_vars: List[str],
+                max_batch_size: Optional[int] = None) -> List[List[int]]:
+    """Group the indices of ``params_list`` whose points only differ in
+    ``batch_vars``, in grid order, at most ``max_batch_size`` per task."""
+    groups: Dict[str, List[int]] = {}
+    for i, params in enumerate(params_list):
+        shared = {k: v for k, v in params.items() if k not in batch_vars}
+        groups.setdefault(cache_key(shared), []).append(i)
+    tasks = []
+    for group in groups.values():
+        size = max_batch_size or len(group)
+        tasks += [group[j:j + size] for j in range(0, len(group), size)]
+    return tasks
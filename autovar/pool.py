@@ -0,0 +1,242 @@
+"""
+Process pool that recycles its workers, used by run_grid_params when
+workers have to be bounded in number of tasks or memory.
+"""
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import pickle
+import signal
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+from .environment import get_rss
+
+_logger = logging.getLogger(__name__)
+
+
+def _worker_main(conn) -> None:
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        task_id, payload = msg
+        try:
+            fn, args = pickle.loads(payload)
+            ret: Tuple[str, Any] = ('ok', fn(*args))
+        except BaseException as e:  # pylint: disable=broad-except
+            ret = ('error', e)
+        try:
+            conn.send((task_id, ret[0], ret[1], get_rss()))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            conn.send((task_id, 'error', RuntimeError(repr(e)), get_rss()))
+
+
+class _Worker(object):
+
+    def __init__(self, ctx) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, ), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[int] = None
+        self.deadline: Optional[float] = None
+        self.n_tasks = 0
+
+    def submit(self, task_id: int, payload: bytes,
+               timeout: Optional[float] = None) -> None:
+        self.task = task_id
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.conn.send((task_id, payload))
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            # Process.kill() needs Python 3.7
+            try:
+                os.kill(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+class RecyclingPool(object):
+    """Runs ``fn(*args)`` for each args in worker processes.
+
+    A worker is replaced by a fresh process after ``max_tasks_per_worker``
+    tasks, or once its resident memory passed ``max_worker_memory`` bytes
+    after a task. If a worker dies while running a task (e.g. killed by the
+    OOM killer), the task is queued again up to ``max_retries`` times. A
+    worker still running a task past its timeout is killed and replaced.
+    """
+
+    def __init__(self, n_workers: int = -1,
+                 max_tasks_per_worker: Optional[int] = None,
+                 max_worker_memory: Optional[int] = None,
+                 max_retries: int = 1,
+                 mp_context: Optional[str] = None) -> None:
+        if n_workers is None or n_workers < 0:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = n_workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_memory = max_worker_memory
+        self.max_retries = max_retries
+        self._ctx = multiprocessing.get_context(mp_context)
+        self.n_recycled = 0
+        self.n_died = 0
+        self.n_timeouts = 0
+
+    def _should_recycle(self, worker: _Worker, rss: Optional[int]) -> bool:
+        if self.max_tasks_per_worker is not None \
+                and worker.n_tasks >= self.max_tasks_per_worker:
+            return True
+        if self.max_worker_memory is not None and rss is not None \
+                and rss > self.max_worker_memory:
+            _logger.info("recycling worker %d, rss %d bytes", worker.process.pid, rss)
+            return True
+        return False
+
+    def imap_unordered(self, fn: Callable, args_list: Iterable[Tuple],
+                       timeouts: Optional[Iterable[Optional[float]]] = None,
+                       on_requeue: Optional[Callable[[int], None]] = None
+                       ) -> Iterator[Tuple[int, str, Any]]:
+        """Yields (index, status, value) as tasks finish.
+
+        ``args_list`` (and ``timeouts``, in the same order) may be lazy,
+        they are pulled as workers become free and only the tasks in flight
+        are kept. status is 'ok' with the return value, 'error' with the
+        exception raised by ``fn``, 'died' if the worker running the task
+        died more than ``max_retries`` times, or 'timeout' if the task ran
+        longer than its entry of ``timeouts`` (in seconds) and its worker
+        was killed. ``on_requeue(index)`` is called before a task whose
+        worker died is queued again, e.g. to clean up after the attempt.
+        """
+        try:
+            import cloudpickle
+        except ImportError:
+            from joblib.externals import cloudpickle  # type: ignore
+        source = iter(args_list)
+        timeout_source = None if timeouts is None else iter(timeouts)
+        # (payload, timeout) of the tasks taken from the source and not done
+        tasks: Dict[int, Tuple[bytes, Optional[float]]] = {}
+        queue: Deque[int] = deque()
+        attempts: Dict[int, int] = {}
+        n_taken = 0
+        exhausted = False
+
+        def next_task() -> Optional[int]:
+            nonlocal n_taken, exhausted
+            if queue:
+                return queue.popleft()
+            if exhausted:
+                return None
+            try:
+                args = next(source)
+            except StopIteration:
+                exhausted = True
+                return None
+            task_id = n_taken
+            n_taken += 1
+            timeout = None if timeout_source is None else next(timeout_source)
+            tasks[task_id] = (cloudpickle.dumps((fn, args)), timeout)
+            return task_id
+
+        workers: List[_Worker] = []
+        try:
+            while True:
+                for worker in workers:
+                    if worker.task is None:
+                        task_id = next_task()
+                        if task_id is None:
+                            break
+                        worker.submit(task_id, *tasks[task_id])
+                while len(workers) < self.n_workers:
+                    task_id = next_task()
+                    if task_id is None:
+                        break
+                    worker = _Worker(self._ctx)
+                    workers.append(worker)
+                    worker.submit(task_id, *tasks[task_id])
+                busy = [w for w in workers if w.task is not None]
+                if not busy:
+                    break
+                deadlines = [w.deadline for w in busy if w.deadline is not None]
+                wait_timeout = None
+                if deadlines:
+                    wait_timeout = max(min(deadlines) - time.monotonic(), 0)
+                ready = wait([w.conn for w in busy] + [w.process.sentinel for w in busy],
+                             timeout=wait_timeout)
+                now = time.monotonic()
+                for worker in busy:
+                    if worker.conn not in ready and worker.process.sentinel not in ready:
+                        if worker.deadline is not None and now >= worker.deadline:
+                            task_id = worker.task
+                            assert task_id is not None
+                            _logger.warning("killing worker %d, task %d timed out",
+                                            worker.process.pid, task_id)
+                            self.n_timeouts += 1
+                            worker.kill()
+                            workers.remove(worker)
+                            del tasks[task_id]
+                            yield task_id, 'timeout', None
+                        continue
+                    msg = None
+                    try:
+                        if worker.conn.poll():
+                            msg = worker.conn.recv()
+                    except (EOFError, OSError):
+                        msg = None
+                    if msg is None:
+                        if worker.process.is_alive():
+                            continue
+                        yield from self._handle_death(worker, workers, queue,
+                                                      attempts, tasks, on_requeue)
+                        continue
+                    task_id, status, value, rss = msg
+                    worker.task = None
+                    worker.n_tasks += 1
+                    del tasks[task_id]
+                    if self._should_recycle(worker, rss):
+                        self.n_recycled += 1
+                        worker.stop()
+                        workers.remove(worker)
+                    yield task_id, status, value
+        finally:
+            for worker in workers:
+                worker.kill()
+
+    def _handle_death(self, worker: _Worker, workers: List[_Worker],
+                      queue: Deque[int], attempts: Dict[int, int],
+                      tasks: Dict[int, Tuple[bytes, Optional[float]]],
+                      on_requeue: Optional[Callable[[int], None]] = None):
+        task_id = worker.task
+        # only called for busy workers
+        assert task_id is not None
+        self.n_died += 1
+        worker.kill()
+        workers.remove(worker)
+        attempts[task_id] = attempts.get(task_id, 0) + 1
+        if attempts[task_id] <= self.max_retries:
+            _logger.warning("worker %d died with exit code %s, re-queuing task %d",
+                            worker.process.pid, worker.process.exitcode, task_id)
+            if on_requeue is not None:
+                on_requeue(task_id)
+            queue.appendleft(task_id)
+        else:
+            _logger.error("task %d failed, its worker died %d times",
+                          task_id, attempts[task_id])
+            del tasks[task_id]
+            yield task_id, 'died', None
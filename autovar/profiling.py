@@ -0,0 +1,92 @@
+"""
+Per-experiment timing breakdown, enabled with ``settings['profile'] = True``.
+"""
+from contextlib import contextmanager
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@contextmanager
+def no_profile() -> Iterator[None]:
+    yield
+
+
+class Profiler(object):
+    """Collects the stage timings and variable loads of one experiment.
+
+    Stages are 'before_hooks', 'get_var' (top level get_var calls,
+    including cache loads and dumps), 'experiment_body' (the experiment
+    without get_var), 'after_hooks' and 'gc'. Every resolved choice
+    variable is recorded with its source: 'memory', 'disk' or 'computed'
+    for cache_outputs variables, and 'uncached' otherwise.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self.variables: List[Dict[str, Any]] = []
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.) + seconds
+
+    @contextmanager
+    def variable(self, var_name: str, argument) -> Iterator[Dict[str, Any]]:
+        record: Dict[str, Any] = {
+            'var_name': var_name, 'argument': argument, 'source': 'uncached'}
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - start
+            self._depth -= 1
+            if self._depth == 0:
+                self.add_time('get_var', record['time'])
+            self.variables.append(record)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'stages': self.stages, 'variables': self.variables}
+
+
+class ProfileAggregator(object):
+    """Sums the profiles of a sweep.
+
+    Can be used as a profile sink (``auto_var.set_profile_sink(agg)``) or
+    fed from the results, e.g. as ``on_result`` of iter_grid_params.
+    """
+
+    def __init__(self) -> None:
+        self.n_experiments = 0
+        self.stages: Dict[str, float] = {}
+        self.variables: Dict[str, Dict[str, Any]] = {}
+
+    def __call__(self, profile: Dict[str, Any],
+                 var_value: Optional[Dict[str, Any]] = None) -> None:
+        self.n_experiments += 1
+        for name, seconds in profile['stages'].items():
+            self.stages[name] = self.stages.get(name, 0.) + seconds
+        for record in profile['variables']:
+            stat = self.variables.setdefault(record['var_name'], {'time': 0.})
+            stat['time'] += record['time']
+            stat[record['source']] = stat.get(record['source'], 0) + 1
+
+    def add_result(self, params: Dict[str, Any], result) -> None:
+        if isinstance(result, dict) and 'profile' in result:
+            self(result['profile'], params)
+
+    def summary(self) -> Dict[str, Any]:
+        n = max(self.n_experiments, 1)
+        return {
+            'n_experiments': self.n_experiments,
+            'total': dict(self.stages),
+            'mean': {k: v / n for k, v in self.stages.items()},
+            'variables': self.variables,
+        }
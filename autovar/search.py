@@ -0,0 +1,175 @@
+"""
+Adaptive searches over the variables of an AutoVar, running every round
+through run_grid_params (so with the hooks and the joblib workers).
+"""
+import math
+import random
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+import logging
+
+from .cache import cache_key
+
+_logger = logging.getLogger(__name__)
+
+Space = Dict[str, Union[List[Any], Callable[[random.Random], Any]]]
+Metric = Union[str, Callable[[Dict[str, Any]], float]]
+
+
+class SearchResult(NamedTuple):
+    best_params: Optional[Dict[str, Any]]
+    best_score: Optional[float]
+    # (params, result, score) of every run, score is None for failed runs
+    history: List[Tuple[Dict[str, Any], Any, Optional[float]]]
+
+
+def sample_params(space: Space, n_samples: int,
+                  rng: Optional[random.Random] = None,
+                  max_tries: int = 100) -> List[Dict[str, Any]]:
+    """Draws up to ``n_samples`` distinct points of ``space``.
+
+    Each variable is a list of arguments picked uniformly or a function
+    drawing a value from the given ``random.Random``. Stops early if
+    ``max_tries`` draws in a row gave no new point.
+    """
+    if rng is None:
+        rng = random.Random()
+    ret: List[Dict[str, Any]] = []
+    seen = set()
+    tries = 0
+    while len(ret) < n_samples and tries < max_tries:
+        params = {}
+        for var_name, values in sorted(space.items()):
+            params[var_name] = values(rng) if callable(values) else rng.choice(values)
+        key = cache_key(params)
+        if key in seen:
+            tries += 1
+            continue
+        tries = 0
+        seen.add(key)
+        ret.append(params)
+    return ret
+
+
+def _score(result, metric: Metric) -> Optional[float]:
+    if not isinstance(result, dict):
+        return None
+    if callable(metric):
+        return metric(result)
+    return result.get(metric)
+
+
+def _run(auto_var, experiment_fn, params_list: List[Dict[str, Any]], metric: Metric,
+         mode: str, history: List, **run_kwargs) -> List[Tuple[float, int]]:
+    """Runs the points, returns (signed score, index) of the successful ones."""
+    params, results = auto_var.run_grid_params(
+        experiment_fn, grid_params=[{k: [v] for k, v in p.items()} for p in params_list],
+        **run_kwargs)
+    by_key = {cache_key(p): r for p, r in zip(params, results)}
+    scored = []
+    for i, p in enumerate(params_list):
+        result = by_key.get(cache_key(p))
+        score = _score(result, metric)
+        history.append((p, result, score))
+        if score is not None:
+            scored.append((score if mode == 'max' else -score, i))
+    return scored
+
+
+def _best(history, mode: str, budget_var: Optional[str] = None) -> Tuple[Optional[Dict], Optional[float]]:
+    scored = [(p, s) for p, _, s in history if s is not None]
+    if budget_var is not None and scored:
+        # only compare runs of the largest budget reached
+        top = max(p[budget_var] for p, _ in scored)
+        scored = [(p, s) for p, s in scored if p[budget_var] == top]
+    if not scored:
+        return None, None
+    sign = 1 if mode == 'max' else -1
+    return max(scored, key=lambda x: sign * x[1])
+
+
+def random_search(auto_var, experiment_fn, space: Space, n_iter: int, metric: Metric,
+                  mode: str = 'max', random_state: Optional[int] = None,
+                  **run_kwargs) -> SearchResult:
+    """Runs ``n_iter`` random points of ``space``.
+
+    ``metric`` is a key of the result dict or a function of the result,
+    ``mode`` 'max' or 'min'. ``run_kwargs`` go to run_grid_params (e.g.
+    n_jobs, backend).
+    """
+    params_list = sample_params(space, n_iter, random.Random(random_state))
+    history: List = []
+    _run(auto_var, experiment_fn, params_list, metric, mode, history, **run_kwargs)
+    return SearchResult(*_best(history, mode), history)
+
+
+def _budget_type(auto_var, budget_var: str):
+    variable = auto_var.variables.get(budget_var)
+    if variable is None or variable['type'] != 'val':
+        raise ValueError(f'budget variable "{budget_var}" must be added with add_variable')
+    return variable['dtype']
+
+
+def _halving(auto_var, experiment_fn, params_list: List[Dict[str, Any]], budget_var: str,
+             min_budget: float, max_budget: float, eta: float, metric: Metric,
+             mode: str, history: List, **run_kwargs) -> None:
+    dtype = _budget_type(auto_var, budget_var)
+
+    def cast(budget):
+        if budget >= max_budget * (1 - 1e-9):
+            return dtype(max_budget)
+        return dtype(round(budget)) if dtype is int else dtype(budget)
+
+    max_value = cast(max_budget)
+    survivors = list(params_list)
+    k = 0
+    while survivors:
+        # from min_budget each time, so float error does not add up
+        value = min(cast(min_budget * eta ** k), max_value)
+        _logger.info("successive halving: %d configurations with %s=%s",
+                     len(survivors), budget_var, value)
+        rung = [dict(p, **{budget_var: value}) for p in survivors]
+        scored = _run(auto_var, experiment_fn, rung, metric, mode, history, **run_kwargs)
+        if value >= max_value:
+            return
+        n_keep = int(len(survivors) / eta)
+        if n_keep == 0:
+            return
+        scored.sort(key=lambda x: x[0], reverse=True)
+        survivors = [survivors[i] for _, i in scored[:n_keep]]
+        k += 1
+
+
+def successive_halving(auto_var, experiment_fn, params_list: List[Dict[str, Any]],
+                       budget_var: str, min_budget: float, max_budget: float,
+                       metric: Metric, mode: str = 'max', eta: float = 3,
+                       **run_kwargs) -> SearchResult:
+    """Runs every point of ``params_list`` with ``budget_var`` (e.g. the
+    number of epochs) at ``min_budget``, keeps the best 1/eta and runs them
+    again with eta times the budget, until ``max_budget`` or one point is
+    left. Each rung runs in parallel through run_grid_params; points
+    without a score (failed, or skipped by the hooks) are dropped.
+    """
+    history: List = []
+    _halving(auto_var, experiment_fn, params_list, budget_var, min_budget,
+             max_budget, eta, metric, mode, history, **run_kwargs)
+    return SearchResult(*_best(history, mode, budget_var), history)
+
+
+def hyperband(auto_var, experiment_fn, space: Space, budget_var: str,
+              min_budget: float, max_budget: float, metric: Metric,
+              mode: str = 'max', eta: float = 3, random_state: Optional[int] = None,
+              **run_kwargs) -> SearchResult:
+    """Hyperband: successive halving brackets over random points of
+    ``space``, from many points at a small budget to few at the largest."""
+    rng = random.Random(random_state)
+    s_max = int(math.floor(math.log(max_budget / min_budget, eta) + 1e-9))
+    history: List = []
+    for s in reversed(range(s_max + 1)):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        budget = max_budget * eta ** (-s)
+        params_list = sample_params(space, n, rng)
+        _logger.info("hyperband bracket %d: %d configurations from %s=%s",
+                     s, len(params_list), budget_var, budget)
+        _halving(auto_var, experiment_fn, params_list, budget_var, budget,
+                 max_budget, eta, metric, mode, history, **run_kwargs)
+    return SearchResult(*_best(history, mode, budget_var), history)
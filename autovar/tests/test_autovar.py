@@ -1,17 +1,38 @@
 import argparse
+from contextlib import redirect_stdout
+import io
+import json
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os.path
 import tempfile
+import time
+from typing import List
 import unittest
 
+import numpy as np
 from numpy.testing import assert_array_equal
 from sklearn.datasets import make_moons
 import joblib
+from sklearn.model_selection import ParameterGrid
 
 from autovar import AutoVar
-from autovar.base.decorators import cache_outputs, requires
+from autovar.base.decorators import cache_outputs, memoize, requires
+from autovar.parallel import schedule_tasks
+from autovar.grid import iter_grid
+from autovar.environment import find_git_dir, get_git_hash, get_repo
+from autovar.profiling import ProfileAggregator
+from autovar.cost_model import CostModel
+from autovar.search import hyperband, random_search, sample_params, \
+    successive_halving
+from autovar.cache import get_memo_cache, get_memory_cache, cache_filename, cache_key, \
+    load_or_compute, CacheManager
+from autovar.cache.__main__ import main as cache_cli
+from autovar.benchmarks.__main__ import compare, main as benchmarks_cli
 from autovar.base import RegisteringChoiceType, VariableClass, \
-    register_var, VariableNotRegisteredError, VariableValueNotSetError
+    register_var, VariableNotRegisteredError, VariableValueNotSetError, \
+    ParameterAlreadyRanError
 
 class DatasetVarClass(VariableClass, metaclass=RegisteringChoiceType):
     """Dataset variable class"""
@@ -68,6 +89,39 @@ class OrdVarClass(VariableClass, metaclass=RegisteringChoiceType):
     def l1(auto_var, var_value, inter_var):
         return 1
 
+class FeatureVarClass(VariableClass, metaclass=RegisteringChoiceType):
+    var_name = "feature"
+
+    @cache_outputs(cache_dir=tempfile.TemporaryDirectory().name, mmap_mode='r')
+    @register_var(argument=r"ones_(?P<n>\d+)")
+    @staticmethod
+    def ones(auto_var, n):
+        return np.ones((int(n), 3))
+
+NOISE_CACHE_DIR = tempfile.TemporaryDirectory().name
+
+class NoiseVarClass(VariableClass, metaclass=RegisteringChoiceType):
+    var_name = "noise"
+
+    @cache_outputs(cache_dir=NOISE_CACHE_DIR, compress=3, max_bytes=20000)
+    @register_var(argument=r"noise_(?P<seed>\d+)")
+    @staticmethod
+    def noise(auto_var, seed):
+        return np.random.RandomState(int(seed)).rand(1000)
+
+n_pipeline_fits: List[str] = []
+
+class PipelineVarClass(VariableClass, metaclass=RegisteringChoiceType):
+    var_name = "pipeline"
+
+    @memoize()
+    @requires(['dataset'])
+    @register_var(argument=r"scale_(?P<factor>\d+)")
+    @staticmethod
+    def scale(auto_var, factor):
+        n_pipeline_fits.append(factor)
+        return auto_var.get_var('dataset')[0] * int(factor)
+
 class TestAutovar(unittest.TestCase):
 
     def setUp(self):
@@ -118,10 +172,111 @@ class TestAutovar(unittest.TestCase):
 
         temp_dir = auto_var.variables['dataset']['cache_dirs']['no4_halfmoon_(?P<n_samples>\\d+)']
 
-        cacheX, cachey = joblib.load(os.path.join(temp_dir, "no4_halfmoon_5-1.pkl"))
+        cacheX, cachey = joblib.load(
+            cache_filename(temp_dir, {'dataset': 'no4_halfmoon_5', 'ord': '1'}))
         assert_array_equal(X, cacheX)
         assert_array_equal(y, cachey)
 
+    def test_cache_key(self):
+        self.assertNotEqual(cache_key({'a': 'x-y', 'b': 'z'}),
+                            cache_key({'a': 'x', 'b': 'y-z'}))
+        self.assertNotEqual(cache_key({'a': 1}), cache_key({'a': '1'}))
+        self.assertEqual(cache_key({'a': 1, 'b': 2}), cache_key({'b': 2, 'a': 1}))
+        self.assertEqual(len(cache_key({'a': 'x' * 1000})), 64)
+
+    def test_cache_lock(self):
+        calls = []
+        def slow_fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return len(calls)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "sub", "out.pkl")
+            with ThreadPoolExecutor(4) as executor:
+                outputs = list(executor.map(
+                    lambda _: load_or_compute(filename, slow_fn), range(4)))
+            self.assertEqual(outputs, [1, 1, 1, 1])
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(
+                [f for f in os.listdir(os.path.dirname(filename)) if f.endswith('.tmp')], [])
+
+    def test_memory_cache(self):
+        auto_var = AutoVar(logging_level=logging.INFO,
+                           settings={'memory_cache_bytes': 10 ** 6})
+        auto_var.add_variable_class(DatasetVarClass())
+        auto_var.add_variable_class(OrdVarClass())
+        memory_cache = get_memory_cache()
+        memory_cache.clear()
+        memory_cache.reset_stats()
+
+        auto_var.set_variable_value_by_dict({"dataset": "no4_halfmoon_6", "ord": "1"})
+        X, _ = auto_var.get_var("dataset")
+        cacheX, _ = auto_var.get_var("dataset")
+        self.assertIs(X, cacheX)
+        # shared between the callers, so it can not be changed in place
+        self.assertFalse(cacheX.flags.writeable)
+        with self.assertRaises(ValueError):
+            cacheX[0] = 0
+        self.assertEqual(memory_cache.hits, 1)
+        self.assertEqual(memory_cache.misses, 1)
+
+        memory_cache.set_max_bytes(X.nbytes)
+        self.assertEqual(len(memory_cache), 0)
+        self.assertEqual(memory_cache.evictions, 1)
+        memory_cache.set_max_bytes(0)
+
+    def test_mmap_cache(self):
+        auto_var = AutoVar(logging_level=logging.INFO)
+        auto_var.add_variable_class(FeatureVarClass())
+        auto_var.set_variable_value("feature", "ones_4")
+
+        X = auto_var.get_var("feature")
+        self.assertIsInstance(X, np.memmap)
+        self.assertFalse(X.flags.writeable)
+        cacheX = auto_var.get_var("feature")
+        self.assertIsInstance(cacheX, np.memmap)
+        assert_array_equal(X, np.ones((4, 3)))
+        assert_array_equal(X, cacheX)
+
+    def test_cache_manager(self):
+        auto_var = AutoVar(settings={'memory_cache_bytes': 0})
+        auto_var.add_variable_class(NoiseVarClass())
+        manager = CacheManager(NOISE_CACHE_DIR)
+        manager.clear()
+
+        for seed in [1, 2, 1]:
+            auto_var.set_variable_value("noise", "noise_%d" % seed)
+            auto_var.get_var("noise")
+            time.sleep(0.01)
+        entries = manager.entries()
+        self.assertEqual([(e.argument, e.hits) for e in entries],
+                         [('noise_2', 0), ('noise_1', 1)])
+        self.assertEqual(entries[1].var_used, {'noise': 'noise_1'})
+        self.assertLess(entries[1].size, 8000)
+
+        # the quota evicts noise_2, the least recently used
+        auto_var.set_variable_value("noise", "noise_3")
+        auto_var.get_var("noise")
+        self.assertEqual([e.argument for e in manager.entries()], ['noise_1', 'noise_3'])
+        self.assertLessEqual(manager.total_bytes(), 20000)
+
+        self.assertEqual(len(manager.evict(0, dry_run=True)), 2)
+        with redirect_stdout(io.StringIO()) as out:
+            cache_cli(['list', NOISE_CACHE_DIR])
+            cache_cli(['evict', NOISE_CACHE_DIR, '--max-bytes', '10K'])
+        self.assertIn('noise=noise_3', out.getvalue())
+        self.assertEqual([e.argument for e in manager.entries()], ['noise_3'])
+
+        # broken files are removed with their sidecar and recomputed
+        with open(manager.entries()[0].path, 'wb') as f:
+            f.write(b'broken')
+        assert_array_equal(auto_var.get_var("noise"),
+                           np.random.RandomState(3).rand(1000))
+        self.assertEqual(manager.entries()[0].hits, 0)
+        self.assertEqual(manager.clear(), 1)
+        self.assertEqual(os.listdir(NOISE_CACHE_DIR), [])
+
     def test_val(self):
         auto_var = AutoVar(logging_level=logging.INFO)
         with self.assertRaises(VariableNotRegisteredError):
@@ -163,6 +318,30 @@ class TestAutovar(unittest.TestCase):
         self.assertTrue('halfmoon dataset' in argparse_help)
         self.assertTrue('Dataset variable class' in argparse_help)
 
+    def test_compiled_variable(self):
+        auto_var = AutoVar(logging_level=logging.INFO)
+        auto_var.add_variable_class(DatasetVarClass())
+        auto_var.add_variable_class(OrdVarClass())
+
+        compiled = auto_var._compiled['dataset']
+        self.assertIsNotNone(compiled.combined)
+        resolved = compiled.resolve('moon_30')
+        self.assertEqual(resolved.template, r"moon_(?P<n_samples>\d+)")
+        self.assertEqual(resolved.groupdict, {'n_samples': '30'})
+        self.assertTrue(resolved.pass_var_value)
+        self.assertFalse(resolved.pass_inter_var)
+        self.assertIs(compiled.resolve('moon_30'), resolved)
+
+        resolved = compiled.resolve('no2_halfmoon_7')
+        self.assertEqual(resolved.groupdict, {'n_samples': '7'})
+        self.assertEqual(resolved.func, DatasetVarClass.no2_halfmoon)
+        self.assertIsNone(compiled.resolve('no3_halfmoon_7'))
+        self.assertIsNone(auto_var.match_variable('dataset', 'halfmoon_'))
+
+        resolved = auto_var._compiled['ord'].resolve('1')
+        self.assertEqual(resolved.groupdict, {})
+        self.assertTrue(resolved.pass_inter_var)
+
     def test_run_grid(self):
         auto_var = AutoVar()
         auto_var.add_variable_class(OrdVarClass())
@@ -194,6 +373,425 @@ class TestAutovar(unittest.TestCase):
         del results[0]['var_value']
         self.assertEqual(params[0], results[0])
 
+    def test_run_grid_parallel(self):
+        auto_var = AutoVar()
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        auto_var.settings['nested'] = {'seen': []}
+        grid_params = {"ord": ['1', '2'], "random_seed": [1, 2, 3]}
+        def fn(auto_var):
+            auto_var.set_intermidiate_variable('seen', True)
+            auto_var.settings['leak'] = auto_var.var_value['random_seed']
+            auto_var.settings['nested']['seen'].append(auto_var.var_value['random_seed'])
+            previous = getattr(auto_var, 'user_attr', None)
+            auto_var.user_attr = auto_var.var_value['random_seed']
+            return {"ord": auto_var.get_var('ord'), "settings": dict(auto_var.settings),
+                    "previous": previous}
+
+        for backend in ['threading', 'loky', 'sequential']:
+            params, results = auto_var.run_grid_params(
+                    fn, grid_params=grid_params, n_jobs=2, backend=backend)
+            self.assertEqual(len(results), 6)
+            for param, result in zip(params, results):
+                self.assertEqual(result['ord'], int(param['ord']))
+                self.assertEqual(result['var_value']['random_seed'], param['random_seed'])
+                self.assertEqual(result['settings']['leak'], param['random_seed'])
+                self.assertEqual(result['settings']['nested']['seen'], [param['random_seed']])
+                self.assertIsNone(result['previous'])
+        self.assertNotIn('leak', auto_var.settings)
+        self.assertEqual(auto_var.settings['nested'], {'seen': []})
+        self.assertEqual(auto_var.inter_var, {})
+
+    def test_run_grid_recycle(self):
+        auto_var = AutoVar(settings={'gc_policy': 'never'})
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        grid_params = {"ord": ['1', '2'], "random_seed": [1, 2]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = os.path.join(tmp_dir, 'crashed')
+            def fn(auto_var):
+                if auto_var.var_value['random_seed'] == 2 and not os.path.exists(marker):
+                    open(marker, 'w').close()
+                    os._exit(1)
+                return {"ord": auto_var.get_var('ord'), "pid": os.getpid()}
+
+            params, results = auto_var.run_grid_params(
+                    fn, grid_params=grid_params, n_jobs=2, max_tasks_per_worker=1)
+            self.assertTrue(os.path.exists(marker))
+        self.assertEqual(len(results), 4)
+        for param, result in zip(params, results):
+            self.assertEqual(result['ord'], int(param['ord']))
+        self.assertEqual(len({r['pid'] for r in results}), 4)
+
+        def crash(auto_var):
+            os._exit(1)
+        _, results = auto_var.run_grid_params(
+                crash, grid_params={"ord": ['1']}, n_jobs=1,
+                max_worker_memory=2**40, max_retries=0)
+        self.assertEqual(results, [None])
+
+        # the pool pulls the grid lazily as workers become free
+        pulled = []
+        def constraint(params):
+            pulled.append(params)
+            return True
+        gen = auto_var.iter_grid_params(
+            lambda auto_var: {}, {"ord": ['1'], "random_seed": list(range(1000))},
+            n_jobs=2, max_tasks_per_worker=10, constraint=constraint)
+        next(gen)
+        gen.close()
+        self.assertLess(len(pulled), 100)
+
+        with self.assertRaisesRegex(ValueError, 'gc_policy sometimes'):
+            AutoVar(settings={'gc_policy': 'sometimes'}).run_single_experiment(
+                    lambda auto_var: {}, with_hook=False)
+
+    def test_run_grid_lpt(self):
+        auto_var = AutoVar()
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+        grid_params = {"ord": ['1', '2'], "random_seed": [1, 2, 3]}
+        params = list(ParameterGrid(grid_params))
+        # no history, grid order
+        self.assertEqual(schedule_tasks(auto_var, params, 'lpt'),
+                         [[i] for i in range(6)])
+
+        def fn(auto_var):
+            time.sleep(0.05 * int(auto_var.var_value['ord']))
+            return {}
+        auto_var.run_grid_params(fn, grid_params={"ord": ['1', '2'], "random_seed": [1]},
+                                 n_jobs=1)
+        self.assertEqual(len(auto_var.cost_model), 2)
+        tasks = schedule_tasks(auto_var, params, 'lpt')
+        self.assertEqual({params[t[0]]['ord'] for t in tasks[:3]}, {'2'})
+
+        model = CostModel.from_results([
+            {'var_value': {'ord': '1', 'random_seed': 1}, 'running_time': 1.},
+            {'var_value': {'ord': '2', 'random_seed': 1}, 'running_time': 3.},
+            {'var_value': {'ord': '2', 'random_seed': 2}, 'running_time': 5.},
+            None,
+        ])
+        self.assertEqual(model.predict({'ord': '2', 'random_seed': 2}), 5.)
+        # unseen point: mean 3 * (ord '1' mean 1 / 3) * (seed 1 mean 2 / 3)
+        self.assertAlmostEqual(model.predict({'ord': '1', 'random_seed': 1, 'x': 0}), 2 / 3)
+        self.assertIsNone(CostModel().predict({'ord': '1'}))
+
+    def test_run_grid_locality(self):
+        auto_var = AutoVar()
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable_class(DatasetVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        grid_params = {
+            "dataset": ['no4_halfmoon_10', 'no4_halfmoon_20', 'halfmoon_10'],
+            "ord": ['1', '2'],
+            "random_seed": [1, 2],
+        }
+        params = list(ParameterGrid(grid_params))
+        tasks = schedule_tasks(auto_var, params, 'locality')
+        # halfmoon_10 is not cached, its points run as one-point tasks
+        self.assertEqual(sorted(len(t) for t in tasks), [1, 1, 1, 1, 2, 2, 2, 2])
+        for task in tasks:
+            keys = {(params[i]['dataset'], params[i]['ord']) for i in task}
+            self.assertEqual(len(keys), 1)
+        self.assertEqual(sorted(i for t in tasks for i in t), list(range(len(params))))
+
+        # a single large group is split over the workers
+        one_group = [p for p in params if p['dataset'] == 'no4_halfmoon_10'
+                     and p['ord'] == '1'] * 4
+        tasks = schedule_tasks(auto_var, one_group, 'locality', n_jobs=4)
+        self.assertEqual([len(t) for t in tasks], [2, 2, 2, 2])
+
+        def fn(auto_var):
+            return {"n": len(auto_var.get_var('dataset')[0])}
+        ret_params, results = auto_var.run_grid_params(
+                fn, grid_params=grid_params, n_jobs=2, schedule='locality')
+        self.assertEqual(ret_params, params)
+        for param, result in zip(ret_params, results):
+            self.assertEqual(result['var_value']['dataset'], param['dataset'])
+            self.assertEqual(result['n'], int(param['dataset'].split('_')[-1]))
+
+    def test_batched_experiment(self):
+        hooked = []
+        def skip_seed_3(auto_var):
+            if auto_var.var_value['random_seed'] == 3:
+                raise ParameterAlreadyRanError
+            auto_var.point_id = auto_var.var_value['random_seed']
+        def after_hook(auto_var, ret):
+            hooked.append((auto_var.point_id, ret))
+
+        auto_var = AutoVar(before_experiment_hooks=[skip_seed_3],
+                           after_experiment_hooks=[after_hook])
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        def experiment(auto_var, var_values):
+            ord = auto_var.get_var('ord')
+            return [{'ord': ord, 'seed': v['random_seed'],
+                     'has_seed': 'random_seed' in auto_var.var_value}
+                    for v in var_values]
+        auto_var.register_experiment('batched', experiment,
+                                     batch_vars=['random_seed'], max_batch_size=3)
+
+        results = auto_var.run_batched_experiment(
+                'batched', [{'ord': '1', 'random_seed': i} for i in [1, 2, 3]])
+        self.assertIsNone(results[2])
+        self.assertEqual([(p, r['seed']) for p, r in hooked], [(1, 1), (2, 2)])
+        self.assertEqual(auto_var.var_value.get('random_seed'), None)
+        with self.assertRaises(ValueError):
+            auto_var.run_batched_experiment(
+                    'batched', [{'ord': '1', 'random_seed': 1}, {'ord': '2', 'random_seed': 2}])
+
+        grid_params = {"ord": ['1', '2'], "random_seed": [1, 2, 3, 4]}
+        params, results = auto_var.run_grid_params(
+                'batched', grid_params=grid_params, n_jobs=2)
+        for param, result in zip(params, results):
+            if param['random_seed'] == 3:
+                self.assertIsNone(result)
+                continue
+            self.assertEqual(result['ord'], int(param['ord']))
+            self.assertEqual(result['seed'], param['random_seed'])
+            self.assertEqual(result['var_value']['ord'], param['ord'])
+            self.assertFalse(result['has_seed'])
+            # seeds 1, 2 (3 skipped) in one batch, 4 in the next
+            self.assertEqual(result['batch_size'], 1 if param['random_seed'] == 4 else 2)
+
+        auto_var.set_variable_value_by_dict({'ord': '2', 'random_seed': 5})
+        self.assertEqual(auto_var.run_single_experiment('batched')['seed'], 5)
+
+    def test_memoize(self):
+        auto_var = AutoVar()
+        auto_var.add_variable_class(DatasetVarClass())
+        auto_var.add_variable_class(PipelineVarClass())
+        auto_var.add_variable('random_seed', int)
+        get_memo_cache().clear()
+        del n_pipeline_fits[:]
+
+        def fn(auto_var):
+            return {'sum': float(auto_var.get_var('pipeline').sum())}
+
+        sums = {}
+        for dataset in ['halfmoon_10', 'halfmoon_20']:
+            for random_seed in range(3):
+                auto_var.set_variable_value_by_dict({
+                    'dataset': dataset, 'pipeline': 'scale_2', 'random_seed': random_seed})
+                ret = auto_var.run_single_experiment(fn, with_hook=False)
+                sums.setdefault(dataset, set()).add(ret['sum'])
+        # one fit per dataset, the random_seed is out of the scope
+        self.assertEqual(n_pipeline_fits, ['2', '2'])
+        self.assertEqual(len(sums['halfmoon_10']), 1)
+        self.assertNotEqual(sums['halfmoon_10'], sums['halfmoon_20'])
+        # shared between the callers, so it can not be changed in place
+        X = auto_var.get_var('pipeline')
+        self.assertFalse(X.flags.writeable)
+        self.assertEqual(n_pipeline_fits, ['2', '2'])
+
+        auto_var.settings['memoize_bytes'] = 0
+        auto_var.run_single_experiment(fn, with_hook=False)
+        self.assertEqual(len(n_pipeline_fits), 3)
+        self.assertEqual(len(get_memo_cache()), 0)
+        get_memo_cache().set_max_bytes(1024 ** 3)
+
+    def test_iter_grid(self):
+        auto_var = AutoVar()
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+        grid_params = {"ord": ['1', '2'], "random_seed": [1, 2, 3]}
+        def fn(auto_var):
+            time.sleep(0.01 * (3 - auto_var.get_var('random_seed')))
+            return {"seed": auto_var.get_var('random_seed')}
+
+        seen = []
+        outputs = list(auto_var.iter_grid_params(
+            fn, grid_params, n_jobs=2, backend='threading', ordered=True,
+            on_result=lambda params, result: seen.append(params)))
+        self.assertEqual([p for p, _ in outputs], list(ParameterGrid(grid_params)))
+        self.assertEqual(seen, [p for p, _ in outputs])
+        for params, result in outputs:
+            self.assertEqual(result['seed'], params['random_seed'])
+
+        outputs = list(auto_var.iter_grid_params(fn, grid_params, n_jobs=2))
+        self.assertEqual(sorted(p['random_seed'] for p, _ in outputs), [1, 1, 2, 2, 3, 3])
+
+        gen = auto_var.iter_grid_params(fn, grid_params, n_jobs=1)
+        next(gen)
+        gen.close()
+
+        # the multiprocessing backend can not stream, results come as a list
+        outputs = list(auto_var.iter_grid_params(
+            fn, grid_params, n_jobs=2, backend='multiprocessing'))
+        self.assertEqual(sorted(p['random_seed'] for p, _ in outputs), [1, 1, 2, 2, 3, 3])
+
+        # commit_before_run is checked when called, not on the first next()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                auto_var.repo = None
+                with self.assertRaises(ValueError):
+                    auto_var.iter_grid_params(fn, grid_params, commit_before_run=True)
+            finally:
+                os.chdir(cwd)
+
+    def test_profile(self):
+        auto_var = AutoVar(settings={'profile': True})
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable_class(DatasetVarClass())
+        aggregator = ProfileAggregator()
+        auto_var.set_profile_sink(aggregator)
+
+        def fn(auto_var):
+            auto_var.get_var('dataset')
+            auto_var.get_var('ord')
+            return {}
+
+        grid_params = {"dataset": ['no4_halfmoon_11'], "ord": ['1', '2']}
+        _, results = auto_var.run_grid_params(fn, grid_params, n_jobs=1)
+        profile = results[0]['profile']
+        self.assertEqual(
+            set(profile['stages']),
+            {'get_var', 'experiment_body', 'after_hooks', 'gc', 'before_hooks'})
+        self.assertEqual([r['var_name'] for r in profile['variables']],
+                         ['dataset', 'ord'])
+        self.assertEqual(profile['variables'][0]['source'], 'computed')
+        self.assertIn('dump_time', profile['variables'][0])
+        self.assertEqual(profile['variables'][1]['source'], 'uncached')
+
+        auto_var.set_variable_value_by_dict({"dataset": "no4_halfmoon_11", "ord": "1"})
+        ret = auto_var.run_single_experiment(fn)
+        self.assertEqual(ret['profile']['variables'][0]['source'], 'disk')
+
+        summary = aggregator.summary()
+        self.assertEqual(summary['n_experiments'], 3)
+        self.assertEqual(summary['variables']['dataset']['computed'], 2)
+        self.assertEqual(summary['variables']['dataset']['disk'], 1)
+        self.assertEqual(summary['variables']['ord']['uncached'], 3)
+
+    def test_grid_expansion(self):
+        grid_params = [
+            {"ord": ['1', '2'], "dataset": ['halfmoon_50', 'halfmoon_10'], "random_seed": [1, 2]},
+            {"ord": ['1']},
+            {},
+        ]
+        self.assertEqual(list(iter_grid(grid_params)), list(ParameterGrid(grid_params)))
+        with self.assertRaises(TypeError):
+            list(iter_grid({"ord": '1'}))
+
+    def test_grid_constraint(self):
+        grid_params = [
+            {"ord": ['1', '2'], "random_seed": [1, 2]},
+            {"ord": ['1'], "random_seed": [2, 3]},
+        ]
+        self.assertEqual(len(list(iter_grid(grid_params, dedupe=True))), 5)
+        constraint = lambda p: p['ord'] == '1' or p['random_seed'] == 1
+        self.assertEqual(list(iter_grid(grid_params, constraint=constraint, dedupe=True)),
+            [{'ord': '1', 'random_seed': 1}, {'ord': '1', 'random_seed': 2},
+             {'ord': '2', 'random_seed': 1}, {'ord': '1', 'random_seed': 3}])
+
+        auto_var = AutoVar()
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+        def fn(auto_var):
+            return {'seed': auto_var.var_value['random_seed']}
+        params, results = auto_var.run_grid_params(
+                fn, grid_params=grid_params, constraint=constraint, n_jobs=1)
+        self.assertEqual(len(params), 4)
+        with self.assertRaises(ValueError):
+            auto_var.run_grid_params(fn, grid_params={"ord": ['3']})
+
+        # only the dispatched part of a huge grid is ever expanded
+        huge = {"ord": ['1', '2'], "random_seed": list(range(10 ** 6))}
+        stream = auto_var.iter_grid_params(fn, grid_params=huge, n_jobs=1,
+                                           backend='sequential', ordered=True)
+        self.assertEqual([r['seed'] for _, r in islice(stream, 3)], [0, 1, 2])
+        stream.close()
+
+    def test_search(self):
+        auto_var = AutoVar()
+        auto_var.add_variable('x', int)
+        auto_var.add_variable('epochs', int)
+        def fn(auto_var):
+            x = auto_var.var_value['x']
+            return {'score': -(x - 3) ** 2 + 0.01 * auto_var.var_value.get('epochs', 0)}
+        space = {'x': list(range(10))}
+
+        self.assertEqual(len(sample_params(space, 20)), 10)
+        ret = random_search(auto_var, fn, space, n_iter=10, metric='score',
+                            random_state=0, n_jobs=2)
+        self.assertEqual(ret.best_params, {'x': 3})
+        self.assertEqual(len(ret.history), 10)
+
+        ret = successive_halving(auto_var, fn, [{'x': x} for x in range(9)], 'epochs',
+                                 min_budget=1, max_budget=9, metric='score', n_jobs=2)
+        self.assertEqual(ret.best_params, {'x': 3, 'epochs': 9})
+        # 9 at one epoch, 3 at three, 1 at nine
+        self.assertEqual([p['epochs'] for p, _, _ in ret.history], [1] * 9 + [3] * 3 + [9])
+
+        ret = hyperband(auto_var, fn, {'x': lambda rng: rng.randint(0, 9)}, 'epochs',
+                        min_budget=1, max_budget=9, metric=lambda r: -r['score'],
+                        mode='min', random_state=0, n_jobs=2)
+        self.assertEqual(ret.best_params['epochs'], 9)
+        with self.assertRaises(ValueError):
+            successive_halving(auto_var, fn, [{'x': 1}], 'y', 1, 9, metric='score')
+
+        # budgets that are not a power of eta: the largest runs once per point
+        ret = successive_halving(auto_var, fn, [{'x': x} for x in range(27)], 'epochs',
+                                 min_budget=1, max_budget=20, metric='score', n_jobs=2)
+        self.assertEqual([p['epochs'] for p, _, _ in ret.history],
+                         [1] * 27 + [3] * 9 + [9] * 3 + [20])
+        auto_var.add_variable('fraction', float)
+        # 100 * 3 ** -4 multiplied by 3 four times is 99.99999999999999
+        ret = successive_halving(auto_var, fn, [{'x': x} for x in range(81)], 'fraction',
+                                 min_budget=100 * 3 ** -4, max_budget=100.,
+                                 metric='score', n_jobs=2)
+        fractions = [p['fraction'] for p, _, _ in ret.history]
+        self.assertEqual(len(fractions), 81 + 27 + 9 + 3 + 1)
+        self.assertEqual(fractions[-1], 100.)
+        self.assertLess(fractions[-2], 100.)
+
+    def test_environment(self):
+        repo = get_repo(os.getcwd())
+        if repo is not None:
+            self.assertEqual(get_git_hash(os.getcwd()), repo.head.object.hexsha)
+        self.assertEqual(AutoVar().var_value.get('git_hash'), get_git_hash(os.getcwd()))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertIsNone(find_git_dir(temp_dir))
+
+    def test_benchmark_compare(self):
+        old = {'results': {'bench': {'a': 1., 'b': 2., 'c': 0.}}}
+        new = {'results': {'bench': {'a': 1.1, 'b': 1., 'c': 1.}, 'other': {'a': 1.}}}
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertFalse(compare(old, new, threshold=1.2))
+            self.assertTrue(compare(old, new, threshold=1.05))
+        lines = out.getvalue().splitlines()
+        # measurements missing from or zero in the old run are not compared
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn('REGRESSION', lines[0])
+        self.assertIn('REGRESSION', lines[2])
+        self.assertNotIn('REGRESSION', lines[3])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'results.json')
+            self.assertEqual(benchmarks_cli(['--only', 'bench_argparse', '-o', path]), 0)
+            with open(path) as f:
+                results = json.load(f)
+            # an old run a thousand times faster
+            for measurements in results['results'].values():
+                for key in measurements:
+                    measurements[key] /= 1000
+            old_path = os.path.join(temp_dir, 'old.json')
+            with open(old_path, 'w') as f:
+                json.dump(results, f)
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(benchmarks_cli(
+                    ['--only', 'bench_argparse', '-o', path, '--compare', old_path]), 1)
+                self.assertEqual(benchmarks_cli(
+                    ['--only', 'bench_argparse', '-o', path, '--compare', old_path,
+                     '--threshold', '1e6']), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,17 +1,30 @@
 from functools import partial
 import json
+import multiprocessing
 import os
+import signal
+import tempfile
+import time
 import unittest
 import shutil
 
 import joblib
+import numpy as np
 from numpy.testing import assert_array_equal
 from mkdir_p import mkdir_p
 
 from autovar import AutoVar
-from autovar.base import RegisteringChoiceType, VariableClass, \
+from autovar import auto_var as auto_var_module
+from autovar.base import RegisteringChoiceType, VariableClass, ExperimentTimeoutError, \
     register_var, VariableNotRegisteredError, VariableValueNotSetError
-from autovar.hooks import save_result_to_file, default_get_file_name
+from autovar.hooks import save_result_to_file, default_get_file_name, \
+    create_placeholder_file, skip_completed_params, scan_result_dir, \
+    check_result_file_exist, remove_placeholder_if_error, get_result_store, \
+    load_results, submit_parameter, submit_parameters, upload_result, get_uploader, ResultUploader, \
+    get_ext, read_result_file, PLACEHOLDER_CONTENT
+from autovar.hooks import formats
+from autovar.hooks.reference_server import ReferenceServer
+from autovar.distributed import WorkQueue
 
 class OrdVarClass(VariableClass, metaclass=RegisteringChoiceType):
     var_name = "ord"
@@ -26,6 +39,26 @@ class OrdVarClass(VariableClass, metaclass=RegisteringChoiceType):
     def l1(auto_var, var_value, inter_var):
         return 1
 
+def _queue_worker(queue_dir, result_dir, crash_marker):
+    auto_var = AutoVar(
+        settings={'file_format': 'json', 'result_file_dir': result_dir},
+        before_experiment_hooks=[check_result_file_exist, create_placeholder_file],
+        after_experiment_hooks=[save_result_to_file, remove_placeholder_if_error],
+    )
+    auto_var.add_variable_class(OrdVarClass())
+    auto_var.add_variable('random_seed', int)
+
+    def experiment(auto_var):
+        if auto_var.var_value['random_seed'] == 0 and not os.path.exists(crash_marker):
+            open(crash_marker, 'w').close()
+            os._exit(1)
+        if auto_var.var_value['random_seed'] == 1 and not os.path.exists(crash_marker + '.raised'):
+            open(crash_marker + '.raised', 'w').close()
+            raise ValueError("fails once")
+        return {'ord': auto_var.get_var('ord'), 'pid': os.getpid()}
+
+    auto_var.run_queue_worker(experiment, queue_dir, lease_timeout=1.)
+
 class TestAutovar(unittest.TestCase):
     def setUp(self):
         pass
@@ -52,6 +85,408 @@ class TestAutovar(unittest.TestCase):
         self.assertEqual(ret['test'], auto_var.get_var('ord'))
         shutil.rmtree(settings['result_file_dir'])
 
+    def test_binary_formats(self):
+        result_dir = tempfile.mkdtemp()
+        pred = np.arange(1000, dtype=np.float32).reshape(10, 100)
+        for file_format, compression in [('npz', 'zlib'), ('npz', None), ('npz', 'lzma'),
+                                         ('joblib', 'zlib'), ('msgpack', None)]:
+            if file_format == 'msgpack' and formats.msgpack is None:
+                continue
+            auto_var = AutoVar(
+                settings={'file_format': file_format, 'result_file_dir': result_dir,
+                          'result_compression': compression},
+                after_experiment_hooks=[save_result_to_file],
+            )
+            auto_var.add_variable_class(OrdVarClass())
+
+            def experiment(auto_var):
+                return {'pred': pred, 'dist': {'l2': pred[:2]}, 'acc': np.float64(.5),
+                        'ord': auto_var.get_var('ord')}
+
+            auto_var.set_variable_value_by_dict({'ord': '1'})
+            create_placeholder_file(auto_var)
+            path = os.path.join(result_dir, '1.' + get_ext(file_format))
+            self.assertIsNone(read_result_file(path, file_format))
+            auto_var.run_single_experiment(experiment, with_hook=True)
+
+            ret = read_result_file(path, file_format)
+            assert_array_equal(ret['pred'], pred)
+            self.assertEqual(ret['pred'].dtype, np.float32)
+            assert_array_equal(ret['dist']['l2'], pred[:2])
+            self.assertEqual(ret['acc'], .5)
+            self.assertEqual(ret['var_value']['ord'], '1')
+
+            auto_var.set_variable_value_by_dict({'ord': '2'})
+            auto_var.run_single_experiment(experiment, with_hook=True)
+            df = load_results(result_dir, file_format=file_format, fields=['acc'], n_jobs=1)
+            self.assertEqual(len(df), 2)
+            self.assertEqual(df['acc'].tolist(), [.5, .5])
+            self.assertNotIn('pred', df.columns)
+            for name in os.listdir(result_dir):
+                os.unlink(os.path.join(result_dir, name))
+        shutil.rmtree(result_dir)
+
+    def test_skip_completed(self):
+        settings = {'file_format': 'json', 'result_file_dir': 'test_skip'}
+        auto_var = AutoVar(
+            settings=settings,
+            before_dispatch_hooks=[
+                partial(skip_completed_params, get_name_fn=default_get_file_name)
+            ],
+            after_experiment_hooks=[
+                partial(save_result_to_file, get_name_fn=default_get_file_name)
+            ],
+        )
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        def experiment(auto_var):
+            return {'test': auto_var.get_var('ord')}
+
+        auto_var.set_variable_value_by_dict({'ord': '1', 'random_seed': 1})
+        auto_var.run_single_experiment(experiment, with_hook=True)
+        auto_var.set_variable_value_by_dict({'ord': '1', 'random_seed': 2})
+        create_placeholder_file(auto_var)
+
+        scan = scan_result_dir(auto_var)
+        self.assertEqual(scan.completed, {'1-1'})
+        self.assertEqual(scan.placeholders, {'1-2'})
+
+        grid_params = {'ord': ['1', '2'], 'random_seed': [1, 2]}
+        params, results = auto_var.run_grid_params(
+            experiment, grid_params, n_jobs=1)
+        self.assertEqual(len(params), 4)
+        self.assertEqual([r is None for r in results], [True, True, False, False])
+        self.assertEqual(results[2]['test'], 2)
+        self.assertEqual(auto_var.dispatch_stats,
+                         {'total': 4, 'completed': 1, 'placeholders': 1, 'pending': 2})
+
+        self.assertEqual(len(list(auto_var.iter_grid_params(
+            experiment, grid_params, n_jobs=1))), 0)
+        self.assertEqual(auto_var.dispatch_stats,
+                         {'total': 4, 'completed': 3, 'placeholders': 1, 'pending': 0})
+
+        # hooks may return copies of the points in any order
+        auto_var.before_dispatch_hooks = [
+            lambda auto_var, params_list: [dict(p) for p in reversed(params_list)]]
+        _, results = auto_var.run_grid_params(
+            experiment, {'ord': ['1', '2'], 'random_seed': [3]}, n_jobs=1)
+        self.assertEqual([r['test'] for r in results], [1, 2])
+        shutil.rmtree(settings['result_file_dir'])
+
+    def test_sqlite_store(self):
+        settings = {'file_format': 'sqlite', 'result_file_dir': 'test_sqlite'}
+        auto_var = AutoVar(
+            settings=settings,
+            before_dispatch_hooks=[skip_completed_params],
+            before_experiment_hooks=[
+                check_result_file_exist, create_placeholder_file,
+            ],
+            after_experiment_hooks=[
+                save_result_to_file, remove_placeholder_if_error,
+            ],
+        )
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        def experiment(auto_var):
+            if auto_var.get_var('random_seed') == 3:
+                raise ValueError("failed run")
+            return {'test': auto_var.get_var('ord'),
+                    'seed': auto_var.get_var('random_seed')}
+
+        grid_params = {'ord': ['1', '2'], 'random_seed': [1, 2, 3]}
+        _, results = auto_var.run_grid_params(
+            experiment, grid_params, n_jobs=2, backend='loky')
+        self.assertEqual(sum(r is not None for r in results), 4)
+
+        store = get_result_store(auto_var)
+        self.assertEqual(store.count(), 4)
+        self.assertEqual(store.count(ord='1'), 2)
+        self.assertEqual(store.count(random_seed=[1, 3]), 2)
+        self.assertEqual(store.count(not_a_var=1), 0)
+        rows = list(store.query(ord='2', random_seed=2))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0]['random_seed'], 2)
+        self.assertEqual(rows[0][1]['test'], 2)
+        self.assertIsNone(list(store.query(load_result=False, ord='2'))[0][1])
+        completed, placeholders = store.scan()
+        self.assertEqual((len(completed), len(placeholders)), (4, 0))
+
+        # only the failed points are dispatched again
+        params = [p for p, _ in auto_var.iter_grid_params(
+            experiment, grid_params, n_jobs=1)]
+        self.assertEqual([p['random_seed'] for p in params], [3, 3])
+        store.close()
+        shutil.rmtree(settings['result_file_dir'])
+
+    def test_load_results(self):
+        settings = {'file_format': 'json', 'result_file_dir': 'test_load'}
+        auto_var = AutoVar(
+            settings=settings,
+            after_experiment_hooks=[save_result_to_file],
+        )
+        auto_var.add_variable_class(OrdVarClass())
+        auto_var.add_variable('random_seed', int)
+
+        def experiment(auto_var):
+            return {'test': auto_var.get_var('ord'), 'other': [1, 2]}
+
+        auto_var.run_grid_params(
+            experiment, {'ord': ['1', '2'], 'random_seed': list(range(5))}, n_jobs=1)
+        auto_var.set_variable_value_by_dict({'ord': '1', 'random_seed': 9})
+        create_placeholder_file(auto_var)
+
+        snapshot_file = os.path.join(settings['result_file_dir'], 'snapshot.pkl')
+        df = load_results(settings['result_file_dir'], fields=['test'],
+                          snapshot_file=snapshot_file, batch_size=3, n_jobs=2)
+        self.assertEqual(len(df), 10)
+        self.assertNotIn('other', df.columns)
+        self.assertEqual(df['test'].sum(), 15)
+        self.assertEqual(sorted(df['random_seed'].unique()), list(range(5)))
+        self.assertEqual(df.loc[df['name'] == '2-3', 'ord'].item(), '2')
+
+        os.unlink(os.path.join(settings['result_file_dir'], '2-3.json'))
+        auto_var.run_single_experiment(experiment)
+        df = load_results(settings['result_file_dir'], fields=['test'],
+                          snapshot_file=snapshot_file)
+        self.assertEqual(len(df), 10)
+        self.assertNotIn('2-3', set(df['name']))
+        self.assertIn('1-9', set(df['name']))
+        shutil.rmtree(settings['result_file_dir'])
+
+        # a snapshot among pickle results is not read as a result
+        with tempfile.TemporaryDirectory() as result_dir:
+            auto_var.settings.update({'file_format': 'pickle', 'result_file_dir': result_dir})
+            auto_var.run_grid_params(
+                experiment, {'ord': ['1', '2'], 'random_seed': [0]}, n_jobs=1)
+            with open(os.path.join(result_dir, 'broken.pkl'), 'wb') as f:
+                f.write(b'not a pickle')
+            snapshot_file = os.path.join(result_dir, 'snapshot.pkl')
+            for _ in range(2):
+                df = load_results(result_dir, file_format='pickle', fields=['test'],
+                                  snapshot_file=snapshot_file)
+                self.assertEqual(sorted(df['name']), ['1-0', '2-0'])
+
+
+    def test_upload_result(self):
+        with ReferenceServer() as server:
+            settings = {'server_url': server.url, 'upload_backoff': 0.01}
+            auto_var = AutoVar(
+                settings=settings,
+                before_experiment_hooks=[submit_parameter],
+                after_experiment_hooks=[upload_result],
+            )
+            auto_var.add_variable_class(OrdVarClass())
+            auto_var.add_variable('random_seed', int)
+
+            def experiment(auto_var):
+                return {'ord': auto_var.get_var('ord')}
+
+            auto_var.run_grid_params(experiment, n_jobs=1,
+                    grid_params={'ord': ['1', '2'], 'random_seed': list(range(5))})
+            uploader = get_uploader(auto_var)
+            self.assertTrue(uploader.flush(timeout=10))
+            self.assertEqual(uploader.n_uploaded, 10)
+            self.assertEqual(len(server.results), 10)
+            for parameter_id, ret in server.results.items():
+                var_value = server.var_values[parameter_id]
+                self.assertEqual(ret['ord'], int(var_value['ord']))
+                self.assertEqual(ret['var_value'], var_value)
+
+            # already uploaded points are not run again
+            _, results = auto_var.run_grid_params(experiment, n_jobs=1,
+                    grid_params={'ord': ['1'], 'random_seed': [0]})
+            self.assertEqual(results, [None])
+
+            # retried with backoff when the server is unavailable
+            n_requests = server.requests['upload_results']
+            server.fail_next = 2
+            uploader = ResultUploader(server.url, backoff=0.01)
+            uploader.put(100, {'retried': True})
+            uploader.close()
+            self.assertEqual(server.results[100], {'retried': True})
+            self.assertEqual(server.requests['upload_results'], n_requests + 3)
+
+            # server without the batch endpoint
+            uploader = ResultUploader(server.url)
+            uploader._batch_endpoint = False
+            uploader.put(0, {'legacy': True})
+            uploader.close()
+            self.assertEqual(server.results[0], {'legacy': True})
+            self.assertEqual(server.requests['upload_result'], 1)
+
+
+    def test_submit_parameters(self):
+        with ReferenceServer() as server:
+            auto_var = AutoVar(
+                settings={'server_url': server.url},
+                before_dispatch_hooks=[submit_parameters],
+                before_experiment_hooks=[submit_parameter],
+                after_experiment_hooks=[upload_result],
+            )
+            auto_var.add_variable_class(OrdVarClass())
+            auto_var.add_variable('random_seed', int)
+            for random_seed in [0, 1]:
+                var_value = dict(auto_var.var_value, ord='1', random_seed=random_seed)
+                server.save_result(server.submit_parameter(var_value)['id'], {})
+
+            def experiment(auto_var):
+                return {'parameter_id': auto_var.parameter_id}
+
+            params, results = auto_var.run_grid_params(experiment, n_jobs=2,
+                    grid_params={'ord': ['1', '2'], 'random_seed': list(range(5))})
+            self.assertEqual(server.requests['submit_parameters'], 1)
+            self.assertNotIn('submit_parameter', server.requests)
+            for param, result in zip(params, results):
+                if param['ord'] == '1' and param['random_seed'] < 2:
+                    self.assertIsNone(result)
+                else:
+                    self.assertEqual(server.var_values[result['parameter_id']],
+                                     result['var_value'])
+
+            # streamed tasks get the ids assigned before their dispatch too,
+            # also those of earlier chunks
+            chunk_size = auto_var_module._DISPATCH_CHUNK_SIZE
+            auto_var_module._DISPATCH_CHUNK_SIZE = 2
+            try:
+                streamed = list(auto_var.iter_grid_params(experiment, n_jobs=2,
+                        grid_params={'ord': ['1'], 'random_seed': [5, 6, 7]}))
+            finally:
+                auto_var_module._DISPATCH_CHUNK_SIZE = chunk_size
+            self.assertEqual(len(streamed), 3)
+            self.assertEqual(server.requests['submit_parameters'], 3)
+            self.assertNotIn('submit_parameter', server.requests)
+            for _, result in streamed:
+                self.assertEqual(server.var_values[result['parameter_id']],
+                                 result['var_value'])
+
+
+    def test_work_queue(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue_dir = os.path.join(tmp_dir, 'queue')
+            result_dir = os.path.join(tmp_dir, 'results')
+            mkdir_p(result_dir)
+            auto_var = AutoVar()
+            auto_var.add_variable_class(OrdVarClass())
+            auto_var.add_variable('random_seed', int)
+            grid_params = {'ord': ['1', '2'], 'random_seed': list(range(4))}
+            queue = auto_var.submit_grid_params(queue_dir, grid_params)
+            self.assertEqual(queue.status()['pending'], 8)
+            # submitting again adds nothing
+            self.assertEqual(queue.submit([{'ord': '1', 'random_seed': 3}]), 0)
+
+            # a lease and a placeholder left behind by a dead node
+            stale_lease = queue._lease_path(queue.tasks()[-1])
+            with open(stale_lease, 'w') as f:
+                f.write('dead-node')
+            os.utime(stale_lease, (time.time() - 600, time.time() - 600))
+            self.assertEqual(queue.status()['expired'], 1)
+            with open(os.path.join(result_dir, '2-3.json'), 'w') as f:
+                f.write(PLACEHOLDER_CONTENT)
+
+            ctx = multiprocessing.get_context('fork')
+            workers = [ctx.Process(target=_queue_worker, args=(
+                queue_dir, result_dir, os.path.join(tmp_dir, 'crashed'))) for _ in range(3)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(timeout=60)
+            self.assertEqual(sorted(w.exitcode for w in workers), [0, 0, 1])
+            self.assertEqual(queue.status(), {'pending': 0, 'running': 0,
+                                              'expired': 0, 'done': 8})
+            results = load_results(result_dir)
+            self.assertEqual(len(results), 8)
+            self.assertEqual(sorted(results['name']), sorted(
+                f'{o}-{r}' for o in ['1', '2'] for r in range(4)))
+            self.assertEqual(len(os.listdir(queue.failed_dir)), 1)
+            for task_id in queue.tasks():
+                with open(queue._done_path(task_id), 'r') as f:
+                    self.assertEqual(json.load(f)['status'], 'ok')
+            scan = scan_result_dir(AutoVar(
+                settings={'file_format': 'json', 'result_file_dir': result_dir}))
+            self.assertEqual(scan.placeholders, set())
+
+            # a task failing every time is given up after max_attempts
+            def always_fails(auto_var):
+                raise ValueError("always fails")
+            queue = auto_var.submit_grid_params(os.path.join(tmp_dir, 'failing'),
+                                                {'ord': ['1'], 'random_seed': [0]})
+            self.assertEqual(auto_var.run_queue_worker(
+                always_fails, queue.queue_dir, max_attempts=2), 2)
+            with open(queue._done_path(queue.tasks()[0]), 'r') as f:
+                self.assertEqual(json.load(f)['status'], 'failed')
+
+
+    def test_run_grid_recycle_placeholders(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            auto_var = AutoVar(
+                settings={'file_format': 'json', 'result_file_dir': result_dir},
+                before_experiment_hooks=[check_result_file_exist, create_placeholder_file],
+                after_experiment_hooks=[save_result_to_file, remove_placeholder_if_error],
+            )
+            auto_var.add_variable_class(OrdVarClass())
+            auto_var.add_variable('random_seed', int)
+            marker = os.path.join(result_dir, 'crashed')
+
+            def experiment(auto_var):
+                if not os.path.exists(marker):
+                    open(marker, 'w').close()
+                    os._exit(1)
+                return {'ord': auto_var.get_var('ord')}
+
+            # the retry does not find the placeholder of the dead attempt
+            _, results = auto_var.run_grid_params(
+                experiment, grid_params={'ord': ['1'], 'random_seed': [0]},
+                n_jobs=1, max_tasks_per_worker=1)
+            self.assertEqual(results[0]['ord'], 1)
+            with open(os.path.join(result_dir, '1-0.json')) as f:
+                self.assertEqual(json.load(f)['ord'], 1)
+
+    def test_timeout(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            auto_var = AutoVar(
+                settings={'file_format': 'json', 'result_file_dir': result_dir},
+                before_experiment_hooks=[create_placeholder_file],
+                after_experiment_hooks=[save_result_to_file, remove_placeholder_if_error],
+            )
+            auto_var.add_variable_class(OrdVarClass())
+            auto_var.add_variable('random_seed', int)
+
+            def experiment(auto_var):
+                if auto_var.var_value['random_seed'] == 1:
+                    time.sleep(30)
+                elif auto_var.var_value['random_seed'] == 2:
+                    # stuck where the timeout can not interrupt it
+                    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+                    time.sleep(30)
+                return {'ord': auto_var.get_var('ord')}
+
+            auto_var.set_variable_value_by_dict({'ord': '1', 'random_seed': 1})
+            start = time.time()
+            with self.assertRaises(ExperimentTimeoutError):
+                auto_var.run_single_experiment(experiment, timeout=0.2)
+            self.assertLess(time.time() - start, 5)
+            self.assertEqual(os.listdir(result_dir), [])
+
+            start = time.time()
+            params, results = auto_var.run_grid_params(
+                    experiment, grid_params={'ord': ['1'], 'random_seed': [0, 1, 2, 3]},
+                    n_jobs=2, timeout=0.5)
+            self.assertLess(time.time() - start, 10)
+            self.assertEqual([r is None for r in results], [False, True, True, False])
+            self.assertEqual(auto_var.timed_out_params,
+                             [{'ord': '1', 'random_seed': 1}, {'ord': '1', 'random_seed': 2}])
+            self.assertEqual(sorted(os.listdir(result_dir)), ['1-0.json', '1-3.json'])
+
+            # a killed group keeps the results of the points that finished
+            auto_var.set_variable_value_by_dict({'ord': '1', 'random_seed': 4})
+            create_placeholder_file(auto_var)
+            auto_var._clean_up_killed([{'ord': '1', 'random_seed': 0},
+                                       {'ord': '1', 'random_seed': 4}])
+            self.assertEqual(sorted(os.listdir(result_dir)), ['1-0.json', '1-3.json'])
+            with open(os.path.join(result_dir, '1-0.json')) as f:
+                self.assertEqual(json.load(f)['var_value']['random_seed'], 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,55 @@
+"""
+Time limits of a single experiment, used by run_single_experiment.
+"""
+from contextlib import contextmanager
+import signal
+import threading
+from typing import Iterator, Optional
+import logging
+
+from .base import ExperimentTimeoutError
+
+_logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def time_limit(timeout: Optional[float] = None,
+               cpu_timeout: Optional[float] = None) -> Iterator[None]:
+    """Raises ExperimentTimeoutError in the block once it ran for
+    ``timeout`` seconds of wall-clock time or used ``cpu_timeout`` seconds
+    of CPU time (of the whole process).
+
+    Uses interval timers and signals, so the limits are only enforced in
+    the main thread, and code that does not return to the interpreter
+    (e.g. a long C call) is only interrupted once it does.
+    """
+    if timeout is None and cpu_timeout is None:
+        yield
+        return
+    if threading.current_thread() is not threading.main_thread() \
+            or not hasattr(signal, 'setitimer'):
+        _logger.warning("time limits are only enforced in the main thread")
+        yield
+        return
+
+    def handler(signum, frame):
+        if signum == signal.SIGALRM:
+            raise ExperimentTimeoutError(f"wall-clock time limit of {timeout}s exceeded")
+        raise ExperimentTimeoutError(f"CPU time limit of {cpu_timeout}s exceeded")
+
+    timers = []
+    if timeout is not None:
+        timers.append((signal.SIGALRM, signal.ITIMER_REAL, timeout))
+    if cpu_timeout is not None:
+        timers.append((signal.SIGPROF, signal.ITIMER_PROF, cpu_timeout))
+    previous = {}
+    try:
+        for signum, which, seconds in timers:
+            previous[signum] = signal.signal(signum, handler)
+            signal.setitimer(which, seconds)
+        yield
+    finally:
+        for signum, which, _ in timers:
+            if signum in previous:
+                signal.setitimer(which, 0)
+                signal.signal(signum, previous[signum])
@@ -32,6 +32,7 @@ setup(
     extras_require={
         'dev': ['pylint'],
         'test': ['coverage', 'pylint', 'mypy'],
+        'msgpack': ['msgpack>=1.0'],
     },
     package_data={},
     entry_points={},